@@ -0,0 +1,3 @@
+# Benchmarks are run from src/, e.g.
+#   python -m benchmarks.throughput --env-config=sc2custom --config=socom --sc2-stub
+# and write machine readable JSON to results/benchmarks/
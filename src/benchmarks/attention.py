@@ -0,0 +1,269 @@
+"""
+Micro-benchmarks and equivalence checks for the entity layers in modules/layers/attention.py:
+    dense:    EntityAttentionLayer
+    rank<p>:  EntityAttentionLayer with rank_percent=p (keeps the top p of available entities)
+    pool_*:   EntityPoolingLayer with max / mean pooling
+
+Every point of the sweep over batch size (bs * ts of the agents), n_entities, n_agents,
+heads and observation mask sparsity is timed for forward (no_grad, as in rollouts) and
+forward + backward (as in training), along with the bytes autograd saves for backward
+and, on GPU, the peak allocated memory.
+
+Before timing, each point is checked against straightforward per-sample reference
+implementations in float64, and rank_percent=1.0 is checked against the dense path
+(outputs and gradients). The run exits with 1 if any check fails, so the harness can
+gate changes to the layers.
+
+Run from src/:
+    python -m benchmarks.attention
+    python -m benchmarks.attention --batch-sizes=1,2240 --n-entities=16,32 --heads=1,4 --sparsity=0,0.8
+    python -m benchmarks.attention ... --compare=results/benchmarks/<previous>.json
+"""
+import argparse
+import itertools
+import sys
+from types import SimpleNamespace as SN
+
+import torch as th
+import torch.nn.functional as F
+
+from benchmarks.common import timeit, summarise, write_results, compare_results
+from modules.layers import EntityAttentionLayer, EntityPoolingLayer
+from utils.logging import get_logger
+
+
+def make_inputs(bs, ne, na, in_dim, sparsity, seed, device, dtype=th.float32):
+    """
+    Entities with the agents first, some absent entities, and an observation mask where
+    each pair is hidden with probability `sparsity` (present entities always see
+    themselves). Masks follow the conventions of the agents (1 = masked out).
+    """
+    gen = th.Generator().manual_seed(seed)
+    entities = th.randn(bs, ne, in_dim, generator=gen, dtype=dtype)
+    entity_mask = (th.rand(bs, ne, generator=gen) < 0.25).to(th.uint8)
+    # first agent always present, other agents occasionally dead (fully masked rows)
+    entity_mask[:, 0] = 0
+    entity_mask[:, 1:na] = (th.rand(bs, na - 1, generator=gen) < 0.1).to(th.uint8)
+    obs_mask = (th.rand(bs, ne, ne, generator=gen) < sparsity).to(th.uint8)
+    obs_mask[:, th.arange(ne), th.arange(ne)] = 0
+    obs_mask = obs_mask | entity_mask.unsqueeze(1) | entity_mask.unsqueeze(2)
+    post_mask = entity_mask[:, :na]
+    return (entities.to(device), obs_mask.to(device), entity_mask.to(device), post_mask.to(device))
+
+
+def make_layer(variant, in_dim, embed_dim, na, n_heads, seed, device):
+    args = SN(attn_n_heads=n_heads, n_agents=na)
+    th.manual_seed(seed)
+    if variant.startswith("pool_"):
+        layer = EntityPoolingLayer(in_dim, embed_dim, embed_dim, variant[len("pool_"):], args)
+    else:
+        layer = EntityAttentionLayer(in_dim, embed_dim, embed_dim, args)
+    return layer.to(device)
+
+
+def rank_percent_of(variant):
+    return float(variant[len("rank"):]) if variant.startswith("rank") else None
+
+
+def run_layer(layer, variant, inputs):
+    entities, obs_mask, entity_mask, post_mask = inputs
+    if variant.startswith("pool_"):
+        return layer(entities, pre_mask=obs_mask, post_mask=post_mask)
+    rank_percent = rank_percent_of(variant)
+    if rank_percent is None:
+        return layer(entities, pre_mask=obs_mask, post_mask=post_mask)
+    return layer(entities, pre_mask=obs_mask, post_mask=post_mask,
+                 rank_percent=rank_percent, entity_mask=entity_mask)[0]
+
+
+def reference_attention(layer, inputs):
+    """Per-sample, per-head masked softmax attention with the weights of `layer`."""
+    entities, obs_mask, _, post_mask = inputs
+    na = post_mask.shape[1]
+    n_heads, head_dim = layer.n_heads, layer.head_dim
+    outs = []
+    for b in range(entities.shape[0]):
+        query, key, value = layer.in_trans(entities[b]).chunk(3, dim=1)
+        heads = []
+        for h in range(n_heads):
+            sl = slice(h * head_dim, (h + 1) * head_dim)
+            logits = query[:na, sl] @ key[:, sl].t() / head_dim ** 0.5
+            visible = obs_mask[b, :na] == 0
+            weights = F.softmax(logits.masked_fill(~visible, -float("inf")), dim=1)
+            # agents that see nothing get zero output
+            weights = th.where(visible.any(dim=1, keepdim=True), weights, th.zeros_like(weights))
+            heads.append(weights @ value[:, sl])
+        out = layer.out_trans(th.cat(heads, dim=1))
+        outs.append(out.masked_fill(post_mask[b].unsqueeze(1).bool(), 0))
+    return th.stack(outs)
+
+
+def reference_pooling(layer, inputs):
+    """Per-sample pooling with the current semantics (masked entities count as zeros)."""
+    entities, obs_mask, _, post_mask = inputs
+    na = post_mask.shape[1]
+    outs = []
+    for b in range(entities.shape[0]):
+        ents = layer.in_trans(entities[b])
+        rep = ents.unsqueeze(0).masked_fill(obs_mask[b, :na].unsqueeze(2).bool(), 0)
+        pooled = rep.max(dim=1)[0] if layer.pooling_type == "max" else rep.mean(dim=1)
+        out = layer.out_trans(pooled)
+        outs.append(out.masked_fill(post_mask[b].unsqueeze(1).bool(), 0))
+    return th.stack(outs)
+
+
+def check_point(point, opts, device):
+    """Float64 equivalence checks for one sweep point, returns a list of failure messages."""
+    bs, ne, na, n_heads, sparsity = point
+    bs = min(bs, opts.check_batch_size)
+    inputs = make_inputs(bs, ne, na, opts.in_dim, sparsity, opts.seed, device, dtype=th.float64)
+    failures = []
+
+    def compare(name, a, b):
+        err = (a - b).abs().max().item() if a.numel() > 0 else 0.0
+        if not err <= opts.atol:
+            failures.append("{} {}: max abs diff {:.3e}".format(name, point, err))
+
+    with th.no_grad():
+        for variant in ["dense", "pool_max", "pool_mean"]:
+            layer = make_layer(variant, opts.in_dim, opts.embed_dim, na, n_heads, opts.seed, device).double()
+            ref = reference_pooling if variant.startswith("pool_") else reference_attention
+            compare("{} vs reference".format(variant), run_layer(layer, variant, inputs), ref(layer, inputs))
+
+    # rank_percent=1.0 keeps every available entity, so it has to match dense in value and gradient
+    grads = {}
+    for variant in ["dense", "rank1.0"]:
+        layer = make_layer(variant, opts.in_dim, opts.embed_dim, na, n_heads, opts.seed, device).double()
+        entities = inputs[0].clone().requires_grad_(True)
+        out = run_layer(layer, variant, (entities,) + inputs[1:])
+        out.pow(2).sum().backward()
+        grads[variant] = [out.detach(), entities.grad] + [p.grad for p in layer.parameters()]
+    for i, (a, b) in enumerate(zip(grads["dense"], grads["rank1.0"])):
+        compare("rank1.0 vs dense " + ("output" if i == 0 else "grad {}".format(i - 1)), a, b)
+    return failures
+
+
+def saved_tensor_bytes(fn):
+    """Bytes of the tensors autograd saves for backward while running fn (activation memory)."""
+    saved = [0]
+
+    def pack(t):
+        saved[0] += t.numel() * t.element_size()
+        return t
+    with th.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        fn()
+    return saved[0]
+
+
+def bench_point(point, variant, opts, device):
+    bs, ne, na, n_heads, sparsity = point
+    layer = make_layer(variant, opts.in_dim, opts.embed_dim, na, n_heads, opts.seed, device)
+    inputs = make_inputs(bs, ne, na, opts.in_dim, sparsity, opts.seed, device)
+    sync_cuda = device == "cuda"
+    tag = "attention/{}/bs{}_ne{}_na{}_h{}_sp{}".format(variant, bs, ne, na, n_heads, sparsity)
+    config = dict(variant=variant, batch_size=bs, n_entities=ne, n_agents=na, n_heads=n_heads, sparsity=sparsity)
+
+    def forward():
+        with th.no_grad():
+            run_layer(layer, variant, inputs)
+
+    def forward_backward():
+        layer.zero_grad()
+        run_layer(layer, variant, inputs).sum().backward()
+
+    results = []
+    for phase, fn in [("forward", forward), ("forward_backward", forward_backward)]:
+        times = timeit(fn, opts.n_iters, n_warmup=opts.n_warmup, sync_cuda=sync_cuda)
+        extra = dict(config)
+        if phase == "forward_backward":
+            extra["saved_bytes"] = saved_tensor_bytes(lambda: run_layer(layer, variant, inputs))
+        if sync_cuda:
+            th.cuda.synchronize()
+            th.cuda.reset_peak_memory_stats()
+            base = th.cuda.memory_allocated()
+            fn()
+            th.cuda.synchronize()
+            extra["peak_bytes"] = th.cuda.max_memory_allocated() - base
+        results.append(summarise("{}/{}".format(tag, phase), times,
+                                 work_per_call=[bs] * len(times), work_unit="samples", **extra))
+    return results
+
+
+def _floats(s):
+    return [float(x) for x in s.split(",")]
+
+
+def _ints(s):
+    return [int(x) for x in s.split(",")]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="EntityAttentionLayer / EntityPoolingLayer micro-benchmarks")
+    parser.add_argument("--batch-sizes", type=_ints, default=[1, 256, 2240],
+                        help="layer batch sizes, agents call the layers with bs * ts rows")
+    parser.add_argument("--n-entities", type=_ints, default=[16, 32])
+    parser.add_argument("--n-agents", type=_ints, default=[8])
+    parser.add_argument("--heads", type=_ints, default=[1, 4])
+    parser.add_argument("--sparsity", type=_floats, default=[0.0, 0.5, 0.9],
+                        help="probability that an entity pair is hidden in the observation mask")
+    parser.add_argument("--rank-percents", type=_floats, default=[1.0, 0.5])
+    parser.add_argument("--pooling", default="max,mean")
+    parser.add_argument("--in-dim", type=int, default=128)
+    parser.add_argument("--embed-dim", type=int, default=128)
+    parser.add_argument("--device", default="cuda" if th.cuda.is_available() else "cpu")
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-iters", type=int, default=50)
+    parser.add_argument("--n-warmup", type=int, default=5)
+    parser.add_argument("--check-batch-size", type=int, default=16,
+                        help="batch rows used for the (slow) reference checks")
+    parser.add_argument("--atol", type=float, default=1e-9)
+    parser.add_argument("--skip-checks", action="store_true")
+    parser.add_argument("--skip-bench", action="store_true")
+    parser.add_argument("--out", default=None, help="JSON output path, defaults to results/benchmarks/")
+    parser.add_argument("--compare", default=None, help="previous JSON report to compare against")
+    opts = parser.parse_args(argv)
+
+    console = get_logger()
+    if opts.num_threads is not None:
+        th.set_num_threads(opts.num_threads)
+    th.backends.cudnn.deterministic = True
+    th.backends.cudnn.benchmark = False
+
+    points = [p for p in itertools.product(opts.batch_sizes, opts.n_entities, opts.n_agents, opts.heads, opts.sparsity)
+              if p[2] <= p[1] and opts.embed_dim % p[3] == 0]
+    variants = ["dense"] + ["rank{}".format(p) for p in opts.rank_percents] + \
+        ["pool_{}".format(p) for p in opts.pooling.split(",") if p]
+
+    failures = []
+    if not opts.skip_checks:
+        for point in points:
+            failures += check_point(point, opts, opts.device)
+        for failure in failures:
+            console.error("Equivalence check failed: " + failure)
+        console.info("Equivalence checks: {} points, {} failures".format(len(points), len(failures)))
+
+    results = []
+    if not opts.skip_bench:
+        for point in points:
+            for variant in variants:
+                results += bench_point(point, variant, opts, opts.device)
+        config_info = {k: v for k, v in vars(opts).items() if k not in ("out", "compare")}
+        out_path = write_results("attention", results, config_info, opts.out)
+        console.info("Wrote benchmark results to {}".format(out_path))
+        for r in results:
+            line = "{:<70} median {:.6f}{}".format(r["name"], r["median"], r["unit"])
+            if "saved_bytes" in r:
+                line += "  saved {:.2f}MB".format(r["saved_bytes"] / 2 ** 20)
+            if "peak_bytes" in r:
+                line += "  peak {:.2f}MB".format(r["peak_bytes"] / 2 ** 20)
+            console.info(line)
+
+    regressions = []
+    if opts.compare is not None and results:
+        regressions = compare_results(opts.compare, results)
+    return 1 if failures or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,167 @@
+import collections.abc
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+from copy import deepcopy
+from os.path import dirname, abspath, join
+from types import SimpleNamespace as SN
+
+import numpy as np
+import torch as th
+import yaml
+
+from envs import REGISTRY as env_REGISTRY
+from envs import env_fn
+from functools import partial
+from benchmarks.stub_sc2 import StubSC2CustomEnv
+
+SRC_DIR = dirname(dirname(abspath(__file__)))
+RESULTS_DIR = join(dirname(SRC_DIR), "results", "benchmarks")
+
+# same constructor arguments and entity interface as sc2custom, no SC2 install needed
+env_REGISTRY["sc2stub"] = partial(env_fn, env=StubSC2CustomEnv)
+
+
+def _load_yaml(*path):
+    with open(join(SRC_DIR, "config", *path), "r") as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def _recursive_dict_update(d, u):
+    for k, v in u.items():
+        if isinstance(v, collections.abc.Mapping):
+            d[k] = _recursive_dict_update(d.get(k, {}), v)
+        else:
+            d[k] = v
+    return d
+
+
+def load_config(env_config, alg_config, overrides=()):
+    """
+    Config dict built the same way as main.py (default.yaml <- envs/<env>.yaml <- algs/<alg>.yaml),
+    followed by "key=value" overrides (dotted keys reach into nested dicts, e.g. env_args.episode_limit=50).
+    """
+    config = _load_yaml("default.yaml")
+    config = _recursive_dict_update(config, _load_yaml("envs", "{}.yaml".format(env_config)))
+    config = _recursive_dict_update(config, _load_yaml("algs", "{}.yaml".format(alg_config)))
+    for override in overrides:
+        key, value = override.split("=", 1)
+        target = config
+        keys = key.split(".")
+        for k in keys[:-1]:
+            target = target.setdefault(k, {})
+        target[keys[-1]] = yaml.load(value, Loader=yaml.FullLoader)
+    return config
+
+
+def make_args(config, sc2_stub=False):
+    config = deepcopy(config)
+    if config["use_cuda"] and not th.cuda.is_available():
+        config["use_cuda"] = False
+    np.random.seed(config["seed"])
+    th.manual_seed(config["seed"])
+    config["env_args"]["seed"] = config["seed"]
+
+    args = SN(**config)
+    args.device = "cuda" if args.use_cuda else "cpu"
+    args.unique_token = "benchmark"
+    args.entity_scheme = args.env_args.get("entity_scheme", False)
+    if getattr(args, "render_args", None) is None:
+        # sc2custom.yaml leaves render_args empty, EpisodeRunner always unpacks it
+        args.render_args = {}
+    if "sc2custom" in args.env:
+        from numpy.random import RandomState
+        from envs import scenario_dict
+        args.env_args["scenario_dict"] = scenario_dict(args.scenario, args.scenario_cache_dir, rs=RandomState(0))
+        if sc2_stub:
+            args.env = "sc2stub"
+    return args
+
+
+def timeit(fn, n_iters, n_warmup=1, sync_cuda=False):
+    """
+    Run fn n_warmup + n_iters times and return the wall clock seconds of each timed call.
+    """
+    for _ in range(n_warmup):
+        fn()
+    times = []
+    for _ in range(n_iters):
+        if sync_cuda:
+            th.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if sync_cuda:
+            th.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarise(name, times, unit="s", work_per_call=None, work_unit=None, **extra):
+    """
+    One benchmark result. With work_per_call, throughput is reported as work units/sec
+    (e.g. env steps/sec) in addition to the per call timings.
+    """
+    times = np.asarray(times)
+    result = {"name": name,
+              "unit": unit,
+              "n": int(len(times)),
+              "mean": float(times.mean()),
+              "median": float(np.median(times)),
+              "std": float(times.std()),
+              "min": float(times.min())}
+    if work_per_call is not None:
+        result["throughput"] = float(np.sum(work_per_call) / times.sum())
+        result["throughput_unit"] = "{}/s".format(work_unit)
+    result.update(extra)
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(suite, results, config_info, out_path=None):
+    report = {"suite": suite,
+              "timestamp": datetime.datetime.now().isoformat(),
+              "git_commit": _git_commit(),
+              "python": platform.python_version(),
+              "torch": th.__version__,
+              "cuda": th.cuda.is_available(),
+              "num_threads": th.get_num_threads(),
+              "config": config_info,
+              "results": results}
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = join(RESULTS_DIR, "{}__{}.json".format(
+            suite, datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")))
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+    return out_path
+
+
+def compare_results(baseline_path, results, tolerance=0.1):
+    """
+    Print the relative change of each benchmark's median time against a previous report.
+    Returns the names that got slower by more than `tolerance`.
+    """
+    with open(baseline_path, "r") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        if r["name"] not in baseline:
+            continue
+        old = baseline[r["name"]]["median"]
+        change = (r["median"] - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(r["name"])
+            flag = "  <-- slower"
+        print("{:<50} {:>12.6f} -> {:>12.6f} ({:+.1%}){}".format(r["name"], old, r["median"], change, flag))
+    return regressions
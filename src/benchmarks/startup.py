@@ -0,0 +1,112 @@
+"""
+Startup (import) time of the entry points, measured in fresh interpreters so every
+repeat pays the full import cost, as a new run or a ParallelRunner worker does:
+    main            import main (sacred, the run registry, ...)
+    run.run         import run.run (all the registries run() uses)
+    registries      import the learner / runner / controller / agent / env registries
+    env_unpickle    unpickle a registry env constructor, what a worker does before
+                    building its env (imports the env module only)
+    torch           import torch, as a reference point
+
+Run from src/:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeats=20 --budget=2.0
+    python -m benchmarks.startup --compare=results/benchmarks/<previous>.json
+
+With --budget, the run exits with 1 if the median import time of main exceeds the
+budget (in seconds) or if import main loads torch, so the harness can catch an eager
+import creeping back in.
+"""
+import argparse
+import pickle
+import subprocess
+import sys
+from functools import partial
+
+from benchmarks.common import SRC_DIR, summarise, write_results, compare_results
+from utils.logging import get_logger
+
+_TIMED_IMPORT = """
+import sys, time
+start = time.perf_counter()
+{}
+sys.stdout.write(repr(time.perf_counter() - start))
+"""
+
+TARGETS = {
+    "main": "import main",
+    "run.run": "import run.run",
+    "registries": "\n".join(["from learners import REGISTRY",
+                             "from runners import REGISTRY",
+                             "from controllers import REGISTRY",
+                             "from modules.agents import REGISTRY",
+                             "from envs import REGISTRY"]),
+    "torch": "import torch",
+}
+
+
+def _env_unpickle_code(env):
+    from envs import REGISTRY as env_REGISTRY
+    env_fn = env_REGISTRY[env]
+    payload = pickle.dumps(partial(env_fn.func, **env_fn.keywords))
+    return "import pickle\npickle.loads({!r})".format(payload)
+
+
+def imports_torch(code):
+    """Whether running `code` in a fresh interpreter imports torch."""
+    check = "import sys\n{}\nsys.stdout.write(repr('torch' in sys.modules))".format(code)
+    out = subprocess.check_output([sys.executable, "-c", check], cwd=SRC_DIR)
+    return out.decode().strip().splitlines()[-1] == "True"
+
+
+def time_import(code, repeats):
+    times = []
+    for _ in range(repeats):
+        out = subprocess.check_output([sys.executable, "-c", _TIMED_IMPORT.format(code)], cwd=SRC_DIR)
+        times.append(float(out.decode().strip().splitlines()[-1]))
+    return times
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Import time of the entry points")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--targets", default=",".join(list(TARGETS) + ["env_unpickle"]))
+    parser.add_argument("--env", default="sc2custom", help="env registry key for env_unpickle")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="fail if the median import time of main exceeds this many seconds, "
+                             "or if import main imports torch")
+    parser.add_argument("--out", default=None, help="JSON output path, defaults to results/benchmarks/")
+    parser.add_argument("--compare", default=None, help="previous JSON report to compare against")
+    opts = parser.parse_args(argv)
+    console = get_logger()
+
+    results = []
+    for target in opts.targets.split(","):
+        code = _env_unpickle_code(opts.env) if target == "env_unpickle" else TARGETS[target]
+        result = summarise("import_{}".format(target), time_import(code, opts.repeats))
+        results.append(result)
+        console.info("{:<25} median {:.3f}s  min {:.3f}s".format(result["name"], result["median"], result["min"]))
+
+    config_info = {k: v for k, v in vars(opts).items() if k not in ("out", "compare")}
+    out_path = write_results("startup", results, config_info, opts.out)
+    console.info("Wrote benchmark results to {}".format(out_path))
+
+    failed = False
+    if opts.budget is not None:
+        main_result = [r for r in results if r["name"] == "import_main"]
+        if main_result and main_result[0]["median"] > opts.budget:
+            console.error("import main took {:.3f}s, over the {:.3f}s budget".format(
+                main_result[0]["median"], opts.budget))
+            failed = True
+        if imports_torch(TARGETS["main"]):
+            console.error("import main imports torch, it should only be imported where it is used")
+            failed = True
+
+    regressions = []
+    if opts.compare is not None:
+        regressions = compare_results(opts.compare, results)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
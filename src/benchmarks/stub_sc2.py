@@ -0,0 +1,164 @@
+import numpy as np
+from envs.multiagentenv import MultiAgentEnv
+
+
+class StubSC2CustomEnv(MultiAgentEnv):
+    """
+    Stand-in for StarCraft2CustomEnv used by the benchmarks. Takes the same
+    constructor arguments (scenario_dict, sight_range, ...) and produces entities,
+    masks and available actions of exactly the same shapes, but units are points on
+    a plane with fixed damage, so no SC2 installation is needed.
+
+    Only meant for throughput measurements, the dynamics are not those of SC2.
+    """
+    def __init__(self, scenario_dict, sight_range=9, move_amount=2, seed=None, **kwargs):
+        self.scenario_dict = scenario_dict
+        self.scenarios = scenario_dict['scenarios']
+        max_allies, max_enemies = scenario_dict['max_types_and_units_scenario']
+        self.max_n_agents = sum(num for num, _ in max_allies)
+        self.max_n_enemies = sum(num for num, _ in max_enemies)
+        unit_types = set(unit for scen in self.scenarios for team in scen[:2] for _, unit in team)
+        self.unit_type_bits = len(unit_types)
+        self.unit_type_ids = dict((unit, i) for i, unit in enumerate(sorted(unit_types)))
+        self.episode_limit = scenario_dict['episode_limit']
+        self.sight_range = sight_range
+        self.shoot_range = 6
+        self.move_amount = move_amount
+        self.map_size = 32.0
+        self.n_actions = 6 + self.max_n_enemies
+        self.rs = np.random.RandomState(seed)
+        self._episode_steps = 0
+
+    def reset(self, test=False, index=None, constrain_num=None, **kwargs):
+        if index is None:
+            index = self.rs.randint(len(self.scenarios))
+        allies, enemies = self.scenarios[index][:2]
+        self.ally_types = [self.unit_type_ids[unit] for num, unit in allies for _ in range(num)]
+        self.enemy_types = [self.unit_type_ids[unit] for num, unit in enemies for _ in range(num)]
+        self.n_agents = len(self.ally_types)
+        self.n_enemies = len(self.enemy_types)
+        n_units = self.n_agents + self.n_enemies
+        self.pos = self.rs.uniform(0, self.map_size, size=(n_units, 2))
+        self.health = np.ones(n_units)
+        self._episode_steps = 0
+        self._calc_distance_mtx()
+        return self.get_entities(), self.get_masks()
+
+    def _calc_distance_mtx(self):
+        diff = self.pos[:, None, :] - self.pos[None, :, :]
+        self.dist_mtx = np.sqrt((diff ** 2).sum(-1))
+        dead = self.health <= 0
+        self.dist_mtx[dead, :] = 1000
+        self.dist_mtx[:, dead] = 1000
+
+    def step(self, actions):
+        actions = [int(a) for a in actions[:self.n_agents]]
+        moves = {2: (0, 1), 3: (0, -1), 4: (1, 0), 5: (-1, 0)}
+        damage = np.zeros(self.n_enemies)
+        for a_id, action in enumerate(actions):
+            if self.health[a_id] <= 0:
+                continue
+            if action in moves:
+                self.pos[a_id] += self.move_amount * np.array(moves[action])
+            elif action >= 6:
+                damage[action - 6] += 0.05
+        self.pos = np.clip(self.pos, 0, self.map_size)
+        self.health[self.n_agents:] -= damage
+        # enemies hit a random ally in range
+        for e_id in range(self.n_enemies):
+            u_id = self.n_agents + e_id
+            in_range = np.where(self.dist_mtx[u_id, :self.n_agents] <= self.shoot_range)[0]
+            if self.health[u_id] > 0 and len(in_range) > 0:
+                self.health[self.rs.choice(in_range)] -= 0.05
+        self._episode_steps += 1
+        self._calc_distance_mtx()
+
+        allies_dead = (self.health[:self.n_agents] <= 0).all()
+        enemies_dead = (self.health[self.n_agents:] <= 0).all()
+        reward = float(damage.sum())
+        info = {"battle_won": bool(enemies_dead and not allies_dead)}
+        terminated = bool(allies_dead or enemies_dead)
+        if self._episode_steps >= self.episode_limit:
+            terminated = True
+            info["episode_limit"] = True
+        return reward, terminated, info
+
+    def get_avail_agent_actions(self, agent_id):
+        avail_actions = [0] * self.n_actions
+        if agent_id >= self.n_agents or self.health[agent_id] <= 0:
+            avail_actions[0] = 1
+            return avail_actions
+        avail_actions[1:6] = [1] * 5
+        for e_id in range(self.n_enemies):
+            if self.dist_mtx[agent_id, self.n_agents + e_id] <= self.shoot_range:
+                avail_actions[6 + e_id] = 1
+        return avail_actions
+
+    def get_avail_actions(self):
+        return [self.get_avail_agent_actions(a_id) for a_id in range(self.max_n_agents)]
+
+    def get_masks(self):
+        n_ent = self.max_n_agents + self.max_n_enemies
+        obs_mask = (self.dist_mtx > self.sight_range).astype(np.uint8)
+        ent_ids = list(range(self.n_agents)) + \
+            list(range(self.max_n_agents, self.max_n_agents + self.n_enemies))
+        obs_mask_padded = np.ones((n_ent, n_ent), dtype=np.uint8)
+        obs_mask_padded[np.ix_(ent_ids, ent_ids)] = obs_mask
+        entity_mask = np.ones(n_ent, dtype=np.uint8)
+        entity_mask[ent_ids] = 0
+        return obs_mask_padded, entity_mask
+
+    def get_entity_size(self):
+        nf_entity = self.max_n_agents + self.max_n_enemies  # tag
+        nf_entity += self.n_actions - 2  # available actions minus those that are always available
+        nf_entity += self.unit_type_bits
+        nf_entity += 2  # health and shield
+        nf_entity += 2  # energy and cooldown
+        nf_entity += 4  # global x-y coords + rel x-y to center of mass
+        return nf_entity
+
+    def get_entities(self):
+        nf_entity = self.get_entity_size()
+        n_units = self.n_agents + self.n_enemies
+        com = self.pos.mean(0)
+        types = self.ally_types + self.enemy_types
+        avail_actions = self.get_avail_actions()
+        entities = np.zeros((self.max_n_agents + self.max_n_enemies, nf_entity), dtype=np.float32)
+        for u_i in range(n_units):
+            row = u_i if u_i < self.n_agents else self.max_n_agents + u_i - self.n_agents
+            entity = entities[row]
+            entity[row] = 1
+            ind = self.max_n_agents + self.max_n_enemies
+            if u_i < self.n_agents:
+                entity[ind:ind + self.n_actions - 2] = avail_actions[u_i][2:]
+            ind += self.n_actions - 2
+            entity[ind + types[u_i]] = 1
+            ind += self.unit_type_bits
+            if self.health[u_i] > 0:
+                entity[ind] = self.health[u_i]
+                ind += 4
+                entity[ind:ind + 2] = self.pos[u_i] / self.map_size - 0.5
+                entity[ind + 2:ind + 4] = (self.pos[u_i] - com) / self.map_size
+        return list(entities)
+
+    def get_total_actions(self):
+        return self.n_actions
+
+    def get_env_info(self, args):
+        return {"entity_shape": self.get_entity_size(),
+                "n_actions": self.get_total_actions(),
+                "n_agents": self.max_n_agents,
+                "n_entities": self.max_n_agents + self.max_n_enemies,
+                "episode_limit": self.episode_limit}
+
+    def get_stats(self):
+        return {}
+
+    def render(self, **kwargs):
+        return None
+
+    def close(self):
+        pass
+
+    def save_replay(self):
+        pass
@@ -0,0 +1,185 @@
+"""
+End-to-end throughput benchmarks for the training components:
+    rollout:  env steps/sec of EpisodeRunner and ParallelRunner
+    batch:    EpisodeBatch.update per step (what the runners do every env step)
+    buffer:   ReplayBuffer.insert_episode_batch and ReplayBuffer.sample
+    learner:  learner.train seconds per batch, for each of the given alg configs
+
+Run from src/:
+    python -m benchmarks.throughput --env-config=particle --config=socom
+    python -m benchmarks.throughput --env-config=sc2custom --sc2-stub --learner-configs=qmix_atten,refil,socom,copa
+    python -m benchmarks.throughput ... --compare=results/benchmarks/<previous>.json
+"""
+import argparse
+import sys
+from copy import deepcopy
+
+from benchmarks.common import load_config, make_args, timeit, summarise, write_results, compare_results
+from components.episode_buffer import ReplayBuffer
+from controllers import REGISTRY as mac_REGISTRY
+from learners import REGISTRY as le_REGISTRY
+from run.run import build_scheme
+from runners import REGISTRY as r_REGISTRY
+from utils.logging import Logger, get_logger
+
+
+def _setup(args, logger):
+    runner = r_REGISTRY[args.runner](args=args, logger=logger)
+    env_info = runner.get_env_info()
+    scheme, groups, preprocess = build_scheme(args, env_info)
+    buffer = ReplayBuffer(scheme, groups, args.buffer_size, env_info["episode_limit"] + 1,
+                          preprocess=preprocess,
+                          device="cpu" if args.buffer_cpu_only else args.device)
+    mac = mac_REGISTRY[args.mac](buffer.scheme, groups, args)
+    runner_scheme = dict(scheme)
+    if args.mac == "rlcomm_mac":
+        # mirrors run/sog_run.py, the runner also records the head election
+        runner_scheme["head_probs"] = {"vshape": (1,)}
+        runner_scheme["head_actions"] = {"vshape": (args.n_agents,)}
+    runner.setup(scheme=runner_scheme, groups=groups, preprocess=preprocess, mac=mac)
+    return runner, buffer, mac, env_info
+
+
+def bench_rollout(config, opts, logger):
+    results = []
+    for runner_name in ["episode", "parallel"]:
+        run_config = deepcopy(config)
+        run_config["runner"] = runner_name
+        if runner_name == "episode":
+            run_config["batch_size_run"] = 1
+        args = make_args(run_config, sc2_stub=opts.sc2_stub)
+        runner, _, _, _ = _setup(args, logger)
+        steps = []
+
+        def run_episode():
+            batch = runner.run(test_mode=False)
+            steps.append(batch["filled"].sum().item())
+        times = timeit(run_episode, opts.n_episodes, n_warmup=1)
+        runner.close_env()
+        results.append(summarise("rollout/{}".format(runner_name), times,
+                                 work_per_call=steps[-len(times):], work_unit="env_steps",
+                                 batch_size_run=args.batch_size_run))
+    return results
+
+
+def bench_batch_and_buffer(config, opts, logger):
+    args = make_args(config, sc2_stub=opts.sc2_stub)
+    runner, buffer, _, env_info = _setup(args, logger)
+    episodes = [runner.run(test_mode=False) for _ in range(max(1, args.batch_size // runner.batch_size))]
+    runner.close_env()
+    results = []
+
+    # per step update, replaying the fields of a recorded episode
+    episode = episodes[0]
+    max_t = episode.max_t_filled()
+    step_keys = [k for k in runner.new_batch().scheme if k in episode.data.transition_data and
+                 k not in ("filled", "actions_onehot")]
+    step_data = [{k: episode[k][:, t] for k in step_keys} for t in range(max_t)]
+
+    def fill_episode():
+        batch = runner.new_batch()
+        for t in range(max_t):
+            batch.update(step_data[t], ts=t)
+    times = timeit(fill_episode, opts.n_iters)
+    results.append(summarise("batch/update", [t / max_t for t in times],
+                             work_per_call=[runner.batch_size] * len(times), work_unit="env_steps"))
+
+    def insert():
+        buffer.insert_episode_batch(episodes[0])
+    times = timeit(insert, opts.n_iters)
+    results.append(summarise("buffer/insert_episode_batch", times,
+                             work_per_call=[episodes[0].batch_size] * len(times), work_unit="episodes"))
+    # sample from a buffer holding a few batches worth of episodes
+    while buffer.episodes_in_buffer < min(args.buffer_size, args.batch_size * 4):
+        buffer.insert_episode_batch(episodes[0])
+
+    def sample():
+        episode_sample = buffer.sample(args.batch_size)
+        max_ep_t = episode_sample.max_t_filled()
+        episode_sample = episode_sample[:, :max_ep_t]
+        if episode_sample.device != args.device:
+            episode_sample.to(args.device)
+    times = timeit(sample, opts.n_iters, sync_cuda=args.use_cuda)
+    results.append(summarise("buffer/sample_truncate_to_device", times,
+                             work_per_call=[args.batch_size] * len(times), work_unit="episodes"))
+    return results
+
+
+def bench_learners(base_overrides, opts, logger):
+    results = []
+    for alg_config in opts.learner_configs.split(","):
+        config = load_config(opts.env_config, alg_config, base_overrides)
+        # keep the learner from logging inside the timed region
+        config["learner_log_interval"] = float("inf")
+        args = make_args(config, sc2_stub=opts.sc2_stub)
+        runner, buffer, mac, _ = _setup(args, logger)
+        learner = le_REGISTRY[args.learner](mac, buffer.scheme, logger, args)
+        if args.use_cuda:
+            learner.cuda()
+        while buffer.episodes_in_buffer < args.batch_size:
+            buffer.insert_episode_batch(runner.run(test_mode=False))
+        runner.close_env()
+
+        episode_sample = buffer.sample(args.batch_size)
+        episode_sample = episode_sample[:, :episode_sample.max_t_filled()]
+        if episode_sample.device != args.device:
+            episode_sample.to(args.device)
+        episode_num = [0]
+
+        def train():
+            episode_num[0] += args.batch_size
+            learner.train(episode_sample, runner.t_env, episode_num[0])
+        times = timeit(train, opts.n_iters, n_warmup=2, sync_cuda=args.use_cuda)
+        results.append(summarise("learner/{}/{}/{}".format(alg_config, args.learner, args.mixer), times,
+                                 work_per_call=[args.batch_size] * len(times), work_unit="episodes",
+                                 mac=args.mac, agent=args.agent))
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Rollout / replay / learner throughput benchmarks")
+    parser.add_argument("--env-config", default="particle")
+    parser.add_argument("--config", default="qmix_atten", help="alg config used for rollout and buffer benchmarks")
+    parser.add_argument("--learner-configs", default="qmix_atten,refil,socom,dppsocom,copa,qmix_atten_silgat",
+                        help="comma separated alg configs to time learner.train for")
+    parser.add_argument("--components", default="rollout,buffer,learner")
+    parser.add_argument("--sc2-stub", action="store_true",
+                        help="replace the SC2 binary with benchmarks/stub_sc2.py (sc2custom only)")
+    parser.add_argument("--n-episodes", type=int, default=10)
+    parser.add_argument("--n-iters", type=int, default=20)
+    parser.add_argument("--out", default=None, help="JSON output path, defaults to results/benchmarks/")
+    parser.add_argument("--compare", default=None, help="previous JSON report to compare against")
+    parser.add_argument("overrides", nargs="*", help="config overrides key=value (dotted keys for nested dicts)")
+    opts = parser.parse_args(argv)
+
+    logger = Logger(get_logger())
+    config = load_config(opts.env_config, opts.config, opts.overrides)
+    components = opts.components.split(",")
+    results = []
+    if "rollout" in components:
+        results += bench_rollout(config, opts, logger)
+    if "buffer" in components:
+        results += bench_batch_and_buffer(config, opts, logger)
+    if "learner" in components:
+        results += bench_learners(opts.overrides, opts, logger)
+
+    config_info = {"env_config": opts.env_config,
+                   "config": opts.config,
+                   "sc2_stub": opts.sc2_stub,
+                   "overrides": opts.overrides}
+    out_path = write_results("throughput", results, config_info, opts.out)
+    logger.console_logger.info("Wrote benchmark results to {}".format(out_path))
+    for r in results:
+        line = "{:<50} median {:.6f}{}".format(r["name"], r["median"], r["unit"])
+        if "throughput" in r:
+            line += "  {:.1f} {}".format(r["throughput"], r["throughput_unit"])
+        logger.console_logger.info(line)
+    if opts.compare is not None:
+        regressions = compare_results(opts.compare, results)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
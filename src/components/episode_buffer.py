@@ -2,6 +2,7 @@ import torch as th
 import numpy as np
 from types import SimpleNamespace as SN
 from torch.autograd import Variable
+from utils.memory import batch_memory_report
 
 class EpisodeBatch:
     def __init__(self,
@@ -207,6 +208,24 @@ class EpisodeBatch:
     def max_t_filled(self):
         return th.sum(self.data.transition_data["filled"], 1).max(0)[0]
 
+    def memory_usage(self):
+        """Bytes allocated for each field (transition and episode data, including "filled")."""
+        return {k: v.numel() * v.element_size()
+                for data in (self.data.transition_data, self.data.episode_data)
+                for k, v in data.items()}
+
+    def memory_report(self):
+        return batch_memory_report(repr(self), self.memory_usage(), self.scheme)
+
+    @staticmethod
+    def estimate_memory(scheme, groups, batch_size, max_seq_length, preprocess=None):
+        """
+        memory_usage() of a batch with these arguments, without allocating it
+        (the fields are created on the "meta" device, which only records shapes).
+        """
+        return EpisodeBatch(scheme, groups, batch_size, max_seq_length,
+                            preprocess=preprocess, device="meta").memory_usage()
+
     def __repr__(self):
         return "EpisodeBatch. Batch Size:{} Max_seq_len:{} Keys:{} Groups:{}".format(self.batch_size,
                                                                                      self.max_seq_length,
@@ -218,6 +237,30 @@ class EpisodeBatch:
             del self.data.transition_data[k]
         if k in self.data.episode_data:
             del self.data.episode_data[k]
+
+    @staticmethod
+    def cat(batches):
+        """
+        One batch of the episodes of `batches` (same scheme) in order, the shorter ones
+        zero padded to the longest max_seq_length (padded steps are not "filled").
+        """
+        max_t = max(b.max_seq_length for b in batches)
+
+        def pad(v):
+            if v.shape[1] == max_t:
+                return v
+            return th.cat([v, v.new_zeros((v.shape[0], max_t - v.shape[1]) + v.shape[2:])], dim=1)
+
+        first = batches[0]
+        data = first._new_data_sn()
+        for k in first.data.transition_data:
+            data.transition_data[k] = th.cat([pad(b.data.transition_data[k]) for b in batches], dim=0)
+        for k in first.data.episode_data:
+            data.episode_data[k] = th.cat([b.data.episode_data[k] for b in batches], dim=0)
+        return EpisodeBatch(first.scheme, first.groups, sum(b.batch_size for b in batches), max_t,
+                            data=data, preprocess=first.preprocess, device=first.device)
+
+
 class ReplayBuffer(EpisodeBatch):
     def __init__(self, scheme, groups, buffer_size, max_seq_length, preprocess=None, device="cpu"):
         super(ReplayBuffer, self).__init__(scheme, groups, buffer_size, max_seq_length, preprocess=preprocess, device=device)
@@ -245,6 +288,24 @@ class ReplayBuffer(EpisodeBatch):
     def can_sample(self, batch_size):
         return self.episodes_in_buffer >= batch_size
 
+    def state_dict(self):
+        """Filled episodes and insert position, for full training checkpoints."""
+        n = self.episodes_in_buffer
+        return {"transition_data": {k: v[:n] for k, v in self.data.transition_data.items()},
+                "episode_data": {k: v[:n] for k, v in self.data.episode_data.items()},
+                "buffer_index": self.buffer_index,
+                "episodes_in_buffer": n}
+
+    def load_state_dict(self, state):
+        n = state["episodes_in_buffer"]
+        assert n <= self.buffer_size, "checkpoint holds {} episodes, buffer_size is {}".format(n, self.buffer_size)
+        for k, v in state["transition_data"].items():
+            self.data.transition_data[k][:n] = v.to(self.device)
+        for k, v in state["episode_data"].items():
+            self.data.episode_data[k][:n] = v.to(self.device)
+        self.buffer_index = state["buffer_index"]
+        self.episodes_in_buffer = n
+
     def sample(self, batch_size):
         assert self.can_sample(batch_size)
         if self.episodes_in_buffer == batch_size:
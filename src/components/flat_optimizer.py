@@ -0,0 +1,138 @@
+import math
+import torch as th
+
+
+class FlatOptimizer:
+    """
+    RMSprop/Adam over one contiguous buffer holding every trainable parameter.
+    Each parameter (and its .grad) becomes a view into the flat buffers, so zeroing
+    grads, clipping the grad norm and the update step are a few kernels in total
+    instead of a few per layer.
+
+    Follows the torch.optim update rules (RMSprop without momentum/centering) and
+    uses the torch.optim state_dict layout, so opt.th files can be moved between
+    flat and regular optimisers.
+
+    Note: moving the parameters to another device replaces their storage, so
+    flatten() has to be called again afterwards.
+    """
+    def __init__(self, params, args):
+        assert args.optim in ["RMSprop", "Adam"], "Optimiser {} not supported with flat_params".format(args.optim)
+        self.optim = args.optim
+        # keep every param (trainable or not) so state_dict indices match torch.optim
+        self.params = list(params)
+        self.lr = args.lr
+        self.alpha = args.optim_alpha
+        self.betas = (0.9, 0.999)
+        self.eps = args.optim_eps
+        self.weight_decay = args.weight_decay
+        self.step_count = 0
+
+        self.flat = None
+        self.flat_grad = None
+        self.state = {}
+        self.flatten()
+
+    def _state_keys(self):
+        if self.optim == "RMSprop":
+            return ["square_avg"]
+        return ["exp_avg", "exp_avg_sq"]
+
+    def flatten(self):
+        self.trainable = [p for p in self.params if p.requires_grad]
+        with th.no_grad():
+            self.flat = th.cat([p.detach().reshape(-1) for p in self.trainable])
+            self.flat_grad = th.zeros_like(self.flat)
+            offset = 0
+            for p in self.trainable:
+                n = p.numel()
+                p.data = self.flat[offset:offset + n].view_as(p)
+                # autograd accumulates in place into an existing .grad, keeping it a view
+                p.grad = self.flat_grad[offset:offset + n].view_as(p)
+                offset += n
+        for k in self._state_keys():
+            if k in self.state:
+                self.state[k] = self.state[k].to(self.flat.device)
+            else:
+                self.state[k] = th.zeros_like(self.flat)
+
+    def zero_grad(self, set_to_none=False):
+        # grads must stay views into flat_grad, so never set them to None
+        self.flat_grad.zero_()
+
+    @th.no_grad()
+    def clip_grad_norm_(self, max_norm):
+        total_norm = self.flat_grad.norm(2)
+        clip_coef = (max_norm / (total_norm + 1e-6)).clamp(max=1.0)
+        self.flat_grad.mul_(clip_coef)
+        return total_norm
+
+    @th.no_grad()
+    def step(self):
+        self.step_count += 1
+        grad = self.flat_grad
+        if self.weight_decay != 0:
+            grad = grad.add(self.flat, alpha=self.weight_decay)
+
+        if self.optim == "RMSprop":
+            square_avg = self.state["square_avg"]
+            square_avg.mul_(self.alpha).addcmul_(grad, grad, value=1 - self.alpha)
+            avg = square_avg.sqrt().add_(self.eps)
+            self.flat.addcdiv_(grad, avg, value=-self.lr)
+        else:
+            beta1, beta2 = self.betas
+            exp_avg, exp_avg_sq = self.state["exp_avg"], self.state["exp_avg_sq"]
+            exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            bias_correction1 = 1 - beta1 ** self.step_count
+            bias_correction2 = 1 - beta2 ** self.step_count
+            denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(self.eps)
+            self.flat.addcdiv_(exp_avg, denom, value=-self.lr / bias_correction1)
+
+    def _param_group(self):
+        group = {"lr": self.lr,
+                 "eps": self.eps,
+                 "weight_decay": self.weight_decay,
+                 "params": list(range(len(self.params)))}
+        if self.optim == "RMSprop":
+            group.update({"alpha": self.alpha, "momentum": 0, "centered": False})
+        else:
+            group.update({"betas": self.betas, "amsgrad": False})
+        return group
+
+    def state_dict(self):
+        param_ids = {id(p): i for i, p in enumerate(self.params)}
+        state = {}
+        if self.step_count > 0:
+            offset = 0
+            for p in self.trainable:
+                n = p.numel()
+                p_state = {"step": th.tensor(float(self.step_count))}
+                for k in self._state_keys():
+                    p_state[k] = self.state[k][offset:offset + n].view_as(p).clone()
+                state[param_ids[id(p)]] = p_state
+                offset += n
+        return {"state": state, "param_groups": [self._param_group()]}
+
+    def load_state_dict(self, state_dict):
+        assert len(state_dict["param_groups"]) == 1, "Flat optimiser only supports a single param group"
+        group = state_dict["param_groups"][0]
+        assert len(group["params"]) == len(self.params), "Loaded state dict has a different number of parameters"
+        self.lr = group.get("lr", self.lr)
+        self.eps = group.get("eps", self.eps)
+        self.weight_decay = group.get("weight_decay", self.weight_decay)
+        self.alpha = group.get("alpha", self.alpha)
+        self.betas = tuple(group.get("betas", self.betas))
+
+        saved_ids = dict((id(p), saved_id) for p, saved_id in zip(self.params, group["params"]))
+        with th.no_grad():
+            offset = 0
+            for p in self.trainable:
+                n = p.numel()
+                p_state = state_dict["state"].get(saved_ids[id(p)], {})
+                for k in self._state_keys():
+                    if k in p_state:
+                        self.state[k][offset:offset + n].copy_(p_state[k].reshape(-1))
+                if "step" in p_state:
+                    self.step_count = int(p_state["step"])
+                offset += n
@@ -0,0 +1,170 @@
+import numpy as np
+
+
+class ScenarioSampler:
+    """
+    Picks the scenario of every training episode and tracks per scenario statistics
+    online (exponential moving averages of return, win rate and a success score).
+
+    A scenario is a key of `keys`: a team size (passed to env.reset as
+    constrain_num=[size], for both sc2custom and particle) or an sc2custom scenario
+    index (passed as index=i). `sizes` gives the team size of every key, which orders
+    the curriculum.
+
+    mode:
+        uniform       every scenario equally often, as env.reset does on its own
+        prioritized   probability proportional to (1 - success) ** alpha, so solved
+                      scenarios are rarely drawn
+        curriculum    only the scenarios up to the current team size are drawn
+                      (prioritized among them); the next team size is unlocked once every
+                      unlocked scenario has a success score of at least `threshold` over
+                      `min_episodes` episodes
+    `uniform_mix` of the probability mass is always spread over the drawable scenarios,
+    so none is forgotten and every score keeps being updated.
+
+    Success is the win rate for envs that report battle_won, otherwise the return
+    normalised by the lowest / highest average return over all scenarios.
+    """
+    MODES = ("uniform", "prioritized", "curriculum")
+
+    def __init__(self, keys, mode="uniform", sizes=None, by_index=False, alpha=1.0, ema=0.05, uniform_mix=0.1,
+                 threshold=0.8, min_episodes=20, seed=None):
+        assert mode in self.MODES, "scenario_sampler must be one of {}".format(self.MODES)
+        self.keys = list(keys)
+        self.mode = mode
+        self.sizes = np.array(sizes if sizes is not None else self.keys, dtype=np.float64)
+        self.by_index = by_index
+        self.alpha = alpha
+        self.ema = ema
+        self.uniform_mix = uniform_mix
+        self.threshold = threshold
+        self.min_episodes = min_episodes
+        self.rs = np.random.RandomState(seed)
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        n = len(self.keys)
+        self.counts = np.zeros(n, dtype=np.int64)
+        self.return_ema = np.full(n, np.nan)
+        self.win_ema = np.full(n, np.nan)
+        # team sizes in curriculum order, the first `n_unlocked` of them can be drawn
+        self.size_levels = np.unique(self.sizes)
+        self.n_unlocked = 1
+
+    def _drawable(self):
+        if self.mode != "curriculum":
+            return np.ones(len(self.keys), dtype=bool)
+        return self.sizes <= self.size_levels[self.n_unlocked - 1]
+
+    def success(self):
+        """Success score in [0, 1] per scenario, nan for scenarios not played yet."""
+        if not np.all(np.isnan(self.win_ema)):
+            return self.win_ema.copy()
+        played = ~np.isnan(self.return_ema)
+        if not played.any():
+            return self.return_ema.copy()
+        lo, hi = self.return_ema[played].min(), self.return_ema[played].max()
+        return (self.return_ema - lo) / max(hi - lo, 1e-8)
+
+    def probs(self):
+        drawable = self._drawable()
+        uniform = drawable / drawable.sum()
+        if self.mode == "uniform":
+            return uniform
+        # scenarios not played yet get the highest priority
+        success = np.nan_to_num(self.success(), nan=0.0)
+        priority = np.clip(1 - success, 0, 1) ** self.alpha * drawable
+        if priority.sum() <= 0:
+            return uniform
+        return (1 - self.uniform_mix) * priority / priority.sum() + self.uniform_mix * uniform
+
+    def sample(self, n):
+        """Keys of the scenarios of the next n episodes."""
+        return [self.keys[i] for i in self.rs.choice(len(self.keys), size=n, p=self.probs())]
+
+    def reset_kwargs(self, key):
+        """env.reset kwargs that play scenario `key`."""
+        return {"index": key} if self.by_index else {"constrain_num": [key]}
+
+    def update(self, key, episode_return, won=None):
+        i = self.index[key]
+        self.counts[i] += 1
+        # the first episode initialises the average, so early estimates are not biased to 0
+        rate = max(self.ema, 1 / self.counts[i])
+        self.return_ema[i] = episode_return if np.isnan(self.return_ema[i]) else \
+            (1 - rate) * self.return_ema[i] + rate * episode_return
+        if won is not None:
+            self.win_ema[i] = float(won) if np.isnan(self.win_ema[i]) else \
+                (1 - rate) * self.win_ema[i] + rate * float(won)
+        if self.mode == "curriculum" and self.n_unlocked < len(self.size_levels):
+            unlocked = self._drawable()
+            if (self.counts[unlocked] >= self.min_episodes).all() and \
+                    (np.nan_to_num(self.success()[unlocked], nan=0.0) >= self.threshold).all():
+                self.n_unlocked += 1
+
+    def log(self, logger, t_env):
+        probs = self.probs()
+        success = self.success()
+        for i, key in enumerate(self.keys):
+            logger.log_stat("scenario_{}_p".format(key), probs[i], t_env)
+            if not np.isnan(success[i]):
+                logger.log_stat("scenario_{}_success".format(key), success[i], t_env)
+        if self.mode == "curriculum":
+            logger.log_stat("curriculum_max_team_size", self.size_levels[self.n_unlocked - 1], t_env)
+
+    def state_dict(self):
+        return {"counts": self.counts.copy(), "return_ema": self.return_ema.copy(),
+                "win_ema": self.win_ema.copy(), "n_unlocked": self.n_unlocked,
+                "rs": self.rs.get_state()}
+
+    def load_state_dict(self, state):
+        self.counts = state["counts"].copy()
+        self.return_ema = state["return_ema"].copy()
+        self.win_ema = state["win_ema"].copy()
+        self.n_unlocked = state["n_unlocked"]
+        self.rs.set_state(state["rs"])
+
+
+def build_scenario_sampler(args):
+    """ScenarioSampler for args.scenario_sampler, None to let the envs pick as before."""
+    if not args.scenario_sampler:
+        return None
+    if args.scenario_sampler_by_index:
+        # sc2custom scenarios with the training team sizes, drawn by index
+        scenarios = args.env_args["scenario_dict"]["scenarios"]
+        sizes = [sum(num for num, _ in scenario[0]) for scenario in scenarios]
+        keys = [i for i, size in enumerate(sizes) if not args.test_unseen or size in args.train_map_num]
+        sizes = [sizes[i] for i in keys]
+    else:
+        keys = sizes = list(args.train_map_num)
+    return ScenarioSampler(keys, mode=args.scenario_sampler, sizes=sizes, by_index=args.scenario_sampler_by_index,
+                           alpha=args.scenario_sampler_alpha, ema=args.scenario_sampler_ema,
+                           uniform_mix=args.scenario_sampler_uniform_mix,
+                           threshold=args.curriculum_threshold, min_episodes=args.curriculum_min_episodes,
+                           seed=args.seed)
+
+
+class ScenarioStats:
+    """
+    Per team size return (and win rate) of the episodes since the last log, logged
+    by the runners next to the overall means as <prefix>team<size>_return_mean etc.
+    """
+    def __init__(self):
+        self.sums = {}
+
+    def add(self, team_size, episode_return, won=None):
+        sums = self.sums.setdefault(team_size, {"n_episodes": 0, "return": 0.0})
+        sums["n_episodes"] += 1
+        sums["return"] += episode_return
+        if won is not None:
+            sums["battle_won"] = sums.get("battle_won", 0) + float(won)
+
+    def log(self, logger, prefix, t_env):
+        for team_size, sums in sorted(self.sums.items()):
+            for k, v in sums.items():
+                if k != "n_episodes":
+                    logger.log_stat("{}team{}_{}_mean".format(prefix, team_size, k), v / sums["n_episodes"], t_env)
+        self.sums.clear()
+
+
+def team_sizes(batch, n_agents):
+    """Number of agents present at the start of every episode of an entity scheme batch."""
+    return (1 - batch["entity_mask"][:, 0, :n_agents].float()).sum(-1).long().tolist()
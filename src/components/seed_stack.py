@@ -0,0 +1,79 @@
+import torch as th
+from torch.utils._pytree import tree_leaves, tree_map
+
+from utils.th_utils import compact_deepcopy
+
+
+class SeedStack:
+    """
+    Calls K networks of the same architecture (one per seed, see run/multi_seed.py) as
+    one: their parameters are stacked into (K, ...) tensors and the forward runs under
+    torch.func.vmap over the seed dim, so the K seeds share every kernel launch of the
+    forward and of the backward.
+
+    Inputs and outputs have the layout of a single network called on a batch made of K
+    equally sized blocks of episodes, one per seed (seed major): tensor arguments are
+    split into (K, batch / K, ...) and the outputs merged back. An output with m times
+    the per seed batch (the imagine agents return the batch and its two imagined copies
+    stacked) is merged copy major, as the single network returns it.
+
+    stack() has to be called once per train step, after the optimisers stepped: the
+    stacked parameters are part of the autograd graph, so the gradients land in the
+    parameters of every seed's own network, and each seed clips and steps its own
+    optimiser, updates its own targets and saves its own checkpoints as before.
+    """
+    def __init__(self, modules):
+        self.modules = list(modules)
+        # only provides the structure for functional_call, its own weights are never used
+        self.base = compact_deepcopy(self.modules[0])
+        self.params = None
+        self.buffers = None
+
+    def stack(self, requires_grad=True):
+        with th.set_grad_enabled(requires_grad):
+            named = [dict(m.named_parameters()) for m in self.modules]
+            self.params = {k: th.stack([p[k] for p in named]) for k in named[0]}
+        named = [dict(m.named_buffers()) for m in self.modules]
+        self.buffers = {k: th.stack([b[k] for b in named]) for k in named[0]}
+
+    def init_hidden(self):
+        return self.base.init_hidden()
+
+    def train(self, mode=True):
+        # dropout etc. follow the mode of base, functional_call keeps the module's mode
+        self.base.train(mode)
+        return self
+
+    def eval(self):
+        return self.train(False)
+
+    def parameters(self):
+        return (p for m in self.modules for p in m.parameters())
+
+    def __call__(self, *args, **kwargs):
+        try:
+            from torch.func import functional_call, vmap
+        except ImportError:
+            raise ImportError("Batching the seeds (n_seeds > 1) requires torch >= 2.0 (torch.func)")
+        assert self.params is not None, "SeedStack.stack() has to be called before the forward"
+        n_seeds = len(self.modules)
+        batch_size = next(x.shape[0] for x in tree_leaves((args, kwargs)) if th.is_tensor(x))
+        assert batch_size % n_seeds == 0, "The batch must hold the same number of episodes for every seed"
+        seed_bs = batch_size // n_seeds
+        args, kwargs = tree_map(lambda x: x.reshape(n_seeds, seed_bs, *x.shape[1:]) if th.is_tensor(x) else x,
+                                (args, kwargs))
+        in_dims = tree_map(lambda x: 0 if th.is_tensor(x) else None, (args, kwargs))
+
+        def call(params, buffers, args, kwargs):
+            return functional_call(self.base, (params, buffers), args, kwargs)
+
+        out = vmap(call, in_dims=(0, 0) + in_dims, randomness="different")(self.params, self.buffers, args, kwargs)
+        return tree_map(lambda x: self._merge(x, seed_bs) if th.is_tensor(x) else x, out)
+
+    @staticmethod
+    def _merge(x, seed_bs):
+        # (K, m * b, ...) -> (m * K * b, ...)
+        n_seeds, n_copies = x.shape[0], x.shape[1] // seed_bs
+        assert n_copies * seed_bs == x.shape[1], "Output of shape {} does not split by seed".format(tuple(x.shape))
+        x = x.reshape(n_seeds, n_copies, seed_bs, *x.shape[2:]).transpose(0, 1)
+        return x.reshape(n_copies * n_seeds * seed_bs, *x.shape[3:])
@@ -0,0 +1,32 @@
+class TargetCache:
+    """
+    Keeps the target network outputs computed for one sampled batch so that
+    repeated gradient steps on the same batch (see `reuse_sample`) can skip the
+    target forward pass.
+
+    max_reuse: number of extra train calls a cached value may serve before it is
+               recomputed (0 disables caching). The learner clears the cache
+               whenever the target networks are updated.
+    """
+    def __init__(self, max_reuse=0):
+        self.max_reuse = max_reuse
+        self.clear()
+
+    def clear(self):
+        self.batch = None
+        self.value = None
+        self.uses = 0
+
+    def get(self, batch):
+        # identity check: the cache only ever serves the exact batch object it was built on
+        if self.max_reuse <= 0 or self.batch is not batch or self.uses >= self.max_reuse:
+            return None
+        self.uses += 1
+        return self.value
+
+    def put(self, batch, value):
+        if self.max_reuse <= 0:
+            return
+        self.batch = batch
+        self.value = value
+        self.uses = 0
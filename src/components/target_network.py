@@ -0,0 +1,60 @@
+import torch as th
+
+
+class TargetNetworkManager:
+    """
+    Keeps the parameters of the target networks in one flat contiguous buffer so
+    that target updates touch a single tensor instead of every layer:
+        hard_update: flat copy of the online weights (replaces load_state_dict)
+        soft_update: in-place Polyak averaging, target <- target + tau * (online - target)
+
+    online_modules/target_modules: matching lists of nn.Modules (None entries are skipped)
+
+    Note: moving the target modules to another device (e.g. .cuda()) replaces their
+    parameter storage, so flatten() has to be called again afterwards.
+    """
+    def __init__(self, online_modules, target_modules):
+        assert len(online_modules) == len(target_modules)
+        pairs = [(o, t) for o, t in zip(online_modules, target_modules) if o is not None]
+        self.online_modules = [o for o, _ in pairs]
+        self.target_modules = [t for _, t in pairs]
+        self.flatten()
+
+    def flatten(self):
+        self.online_params = [p for m in self.online_modules for p in m.parameters()]
+        self.target_params = [p for m in self.target_modules for p in m.parameters()]
+        assert len(self.online_params) == len(self.target_params), "Online and target networks do not match"
+        self.online_buffers = [b for m in self.online_modules for b in m.buffers()]
+        self.target_buffers = [b for m in self.target_modules for b in m.buffers()]
+
+        self.flat = None
+        self._online_flat = None
+        if len(self.target_params) == 0:
+            return
+        with th.no_grad():
+            self.flat = th.cat([p.detach().reshape(-1) for p in self.target_params])
+            offset = 0
+            for p in self.target_params:
+                n = p.numel()
+                p.data = self.flat[offset:offset + n].view_as(p)
+                offset += n
+        # scratch space the online weights are gathered into for soft updates
+        self._online_flat = th.empty_like(self.flat)
+
+    def _online_views(self):
+        return [p.detach().reshape(-1) for p in self.online_params]
+
+    @th.no_grad()
+    def hard_update(self):
+        if self.flat is not None:
+            th.cat(self._online_views(), out=self.flat)
+        for t_buf, o_buf in zip(self.target_buffers, self.online_buffers):
+            t_buf.copy_(o_buf)
+
+    @th.no_grad()
+    def soft_update(self, tau):
+        if self.flat is not None:
+            th.cat(self._online_views(), out=self._online_flat)
+            self.flat.lerp_(self._online_flat, tau)
+        for t_buf, o_buf in zip(self.target_buffers, self.online_buffers):
+            t_buf.copy_(o_buf)
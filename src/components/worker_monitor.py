@@ -0,0 +1,118 @@
+import numpy as np
+
+
+class WorkerMonitor:
+    """
+    Aggregates the step/reset latencies and SC2 restart counts reported by the
+    env_worker processes of ParallelRunner.
+
+    Latencies go into fixed log-spaced histograms per worker (reset every log
+    window) and into an exponential moving average of the step time, which is
+    used to flag stragglers: workers whose average step time is more than
+    `straggler_factor` times the median over all workers. A worker flagged in
+    `straggler_patience` consecutive windows is reported by `chronic_stragglers`.
+
+    Startup times (Process.start to env ready, and the env construction part of it)
+    are kept per worker and logged once, in the first window after the worker started.
+    """
+    # bin edges in seconds, 0.1ms to 10s
+    BIN_EDGES = np.logspace(-4, 1, 26)
+
+    def __init__(self, n_workers, straggler_factor=2.0, straggler_patience=3, ema_decay=0.99):
+        self.n_workers = n_workers
+        self.straggler_factor = straggler_factor
+        self.straggler_patience = straggler_patience
+        self.ema_decay = ema_decay
+        n_bins = len(self.BIN_EDGES) + 1
+        self.hists = {kind: np.zeros((n_workers, n_bins), dtype=np.int64) for kind in ("step", "reset")}
+        self.sums = {kind: np.zeros(n_workers) for kind in ("step", "reset")}
+        self.step_ema = np.full(n_workers, np.nan)
+        self.restarts = np.zeros(n_workers, dtype=np.int64)
+        self.new_restarts = np.zeros(n_workers, dtype=np.int64)
+        self.strikes = np.zeros(n_workers, dtype=np.int64)
+        self.startup = np.full(n_workers, np.nan)
+        self.env_build = np.full(n_workers, np.nan)
+        self.startup_logged = np.zeros(n_workers, dtype=bool)
+
+    def record_startup(self, worker, seconds, env_build_seconds):
+        self.startup[worker] = seconds
+        self.env_build[worker] = env_build_seconds
+        self.startup_logged[worker] = False
+
+    def startup_summary(self):
+        valid = ~np.isnan(self.startup)
+        if not valid.any():
+            return "n/a"
+        return "median {:.2f}s, max {:.2f}s (env construction median {:.2f}s)".format(
+            np.median(self.startup[valid]), self.startup[valid].max(), np.median(self.env_build[valid]))
+
+    def record(self, worker, kind, seconds, restarts=0):
+        self.hists[kind][worker, np.searchsorted(self.BIN_EDGES, seconds)] += 1
+        self.sums[kind][worker] += seconds
+        if kind == "step":
+            if np.isnan(self.step_ema[worker]):
+                self.step_ema[worker] = seconds
+            else:
+                self.step_ema[worker] = self.ema_decay * self.step_ema[worker] + (1 - self.ema_decay) * seconds
+        # workers report the total number of restarts of their env
+        if restarts > self.restarts[worker]:
+            self.new_restarts[worker] += restarts - self.restarts[worker]
+            self.restarts[worker] = restarts
+
+    def reset_worker(self, worker):
+        """Forget the history of a worker whose process was replaced."""
+        for kind in self.hists:
+            self.hists[kind][worker] = 0
+            self.sums[kind][worker] = 0
+        self.step_ema[worker] = np.nan
+        self.restarts[worker] = 0
+        self.strikes[worker] = 0
+
+    def percentile(self, kind, worker, q):
+        """Upper bin edge containing the q-th percentile of the current window, in seconds."""
+        hist = self.hists[kind][worker]
+        n = hist.sum()
+        if n == 0:
+            return np.nan
+        idx = np.searchsorted(np.cumsum(hist), q / 100 * n)
+        return self.BIN_EDGES[min(idx, len(self.BIN_EDGES) - 1)]
+
+    def stragglers(self):
+        valid = ~np.isnan(self.step_ema)
+        if valid.sum() < 2:
+            return []
+        median = np.median(self.step_ema[valid])
+        return [w for w in range(self.n_workers)
+                if valid[w] and self.step_ema[w] > self.straggler_factor * median]
+
+    def chronic_stragglers(self):
+        return [w for w in range(self.n_workers) if self.strikes[w] >= self.straggler_patience]
+
+    def log(self, logger, t):
+        """Log per-worker stats for the current window, update straggler strikes and start a new window."""
+        for w in range(self.n_workers):
+            for kind in ("step", "reset"):
+                n = self.hists[kind][w].sum()
+                if n == 0:
+                    continue
+                prefix = "worker{}_{}".format(w, kind)
+                logger.log_stat(prefix + "_ms_mean", 1000 * self.sums[kind][w] / n, t)
+                if kind == "step":
+                    logger.log_stat(prefix + "_ms_p50", 1000 * self.percentile(kind, w, 50), t)
+                    logger.log_stat(prefix + "_ms_p95", 1000 * self.percentile(kind, w, 95), t)
+            logger.log_stat("worker{}_restarts".format(w), self.new_restarts[w], t)
+            if not self.startup_logged[w] and not np.isnan(self.startup[w]):
+                logger.log_stat("worker{}_startup_s".format(w), self.startup[w], t)
+                logger.log_stat("worker{}_env_build_s".format(w), self.env_build[w], t)
+                self.startup_logged[w] = True
+        stragglers = self.stragglers()
+        for w in range(self.n_workers):
+            self.strikes[w] = self.strikes[w] + 1 if w in stragglers else 0
+        logger.log_stat("n_straggler_workers", len(stragglers), t)
+        if stragglers:
+            logger.console_logger.warning("Straggling env workers {} (step ms avg {})".format(
+                stragglers, ", ".join("{:.1f}".format(1000 * self.step_ema[w]) for w in stragglers)))
+        for kind in self.hists:
+            self.hists[kind][:] = 0
+            self.sums[kind][:] = 0
+        self.new_restarts[:] = 0
@@ -1,21 +1,13 @@
-REGISTRY = {}
+from utils.registry import LazyRegistry
 
+# controllers are imported on first lookup, see utils/registry.py
+REGISTRY = LazyRegistry()
 
-from .rlcomm_controller import RlCommMAC
-from .basic_controller import BasicMAC
-from .entity_controller import EntityMAC
-from .comm_controller import CommMAC
-from .copa_controller import COPAMAC
-from .gat_controller import GatMAC
-from .dppcomm_contorller import DppCommMac
-
-REGISTRY["basic_mac"] = BasicMAC
-REGISTRY["entity_mac"] = EntityMAC
-REGISTRY["comm_mac"] = CommMAC
-REGISTRY["copa_mac"] = COPAMAC
-REGISTRY["gat_mac"] = GatMAC
-
-REGISTRY["rlcomm_mac"] = RlCommMAC
-REGISTRY["dppcomm_mac"] = DppCommMac
-
+REGISTRY["basic_mac"] = "controllers.basic_controller:BasicMAC"
+REGISTRY["entity_mac"] = "controllers.entity_controller:EntityMAC"
+REGISTRY["comm_mac"] = "controllers.comm_controller:CommMAC"
+REGISTRY["copa_mac"] = "controllers.copa_controller:COPAMAC"
+REGISTRY["gat_mac"] = "controllers.gat_controller:GatMAC"
 
+REGISTRY["rlcomm_mac"] = "controllers.rlcomm_controller:RlCommMAC"
+REGISTRY["dppcomm_mac"] = "controllers.dppcomm_contorller:DppCommMac"
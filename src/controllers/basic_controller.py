@@ -1,6 +1,9 @@
 from modules.agents import REGISTRY as agent_REGISTRY
 from components.action_selectors import REGISTRY as action_REGISTRY
 import torch as th
+import copy
+from utils.th_utils import compact_state_dict
+from utils.profiling import profile_range
 
 
 # This multi-agent controller shares parameters between agents
@@ -18,6 +21,7 @@ class BasicMAC:
 
         self.hidden_states = None
 
+    @profile_range("BasicMAC.select_actions")
     def select_actions(self, ep_batch, t_ep, t_env, bs=slice(None), test_mode=False, ret_agent_outs=False, ret_attn_weights=False):
         # Only select actions for the selected batch elements in bs
         avail_actions = ep_batch["avail_actions"][:, t_ep]
@@ -30,6 +34,7 @@ class BasicMAC:
             return chosen_actions, agent_outputs[bs]
         return chosen_actions
 
+    @profile_range("BasicMAC.forward")
     def forward(self, ep_batch, t, test_mode=False, **kwargs):
         if t is None:
             t = slice(0, ep_batch["avail_actions"].shape[1])
@@ -82,6 +87,14 @@ class BasicMAC:
     def load_state(self, other_mac):
         self.agent.load_state_dict(other_mac.agent.state_dict())
 
+    def clone_for_target(self):
+        # shallow copy shares the action selector, args and any other stateless helpers,
+        # only the agent gets its own weights
+        target_mac = copy.copy(self)
+        target_mac.agent = copy.deepcopy(self.agent)
+        target_mac.hidden_states = None
+        return target_mac
+
     def cuda(self):
         self.agent.cuda()
 
@@ -92,7 +105,7 @@ class BasicMAC:
         self.agent.train()
 
     def save_models(self, path):
-        th.save(self.agent.state_dict(), "{}/agent.th".format(path))
+        th.save(compact_state_dict(self.agent), "{}/agent.th".format(path))
 
     def load_models(self, path):
         self.agent.load_state_dict(th.load("{}/agent.th".format(path), map_location=lambda storage, loc: storage))
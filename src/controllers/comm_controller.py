@@ -3,6 +3,7 @@ import torch as th
 import torch.nn.functional as F
 from torch.distributions.categorical import Categorical
 from modules.layers.comm_mixer import AverageMessageEncoder
+from utils.profiling import profile_range
 class CommMAC(EntityMAC):
     def __init__(self, scheme, groups, args):
         assert args.use_msg
@@ -11,6 +12,7 @@ class CommMAC(EntityMAC):
         self.message_mixer = AverageMessageEncoder()
         self.message=None
 
+    @profile_range("CommMAC.decide_header")
     def decide_header(self, avail_actions, test_mode=False, agent_vis_mask=None):
         # entity, obs_mask, entity_mask = agent_inputs
         if self.args.order_leader:
@@ -44,6 +46,7 @@ class CommMAC(EntityMAC):
             header = (rnd*candidate_num < self.args.header_num * generation_alpha) * alive_agent
             return header.detach() #bs*n
     
+    @profile_range("CommMAC.decide_group")
     def decide_group(self, agent_inputs, avail_actions, test_mode=False):
         if self.args.use_comm_sr:
             agent_vis_mask = self.gt_mask[:,:, :self.n_agents, :self.n_agents]
@@ -71,6 +74,7 @@ class CommMAC(EntityMAC):
         #bs*1*n*n, control_message[:,0, i,j]=True means agent i leads agent j.
         return control_message.detach(), header
 
+    @profile_range("CommMAC.message_comm")
     def message_comm(self, agent_inputs, avail_actions, t, train_mode=False, test_mode=False, **kwargs):
         entity, obs_mask, entity_mask = agent_inputs
         if train_mode:
@@ -105,6 +109,7 @@ class CommMAC(EntityMAC):
         else:
             return message_personal, self.message #bs*n*msg_d, bs*n*msg_d
 
+    @profile_range("CommMAC.forward")
     def forward(self, ep_batch, t, test_mode=False, fix_msg=None, train_mode=False, **kwargs):
         if t is None:
             t = slice(0, ep_batch["avail_actions"].shape[1])
@@ -142,6 +147,7 @@ class CommMAC(EntityMAC):
             outs += (msg_dis, msg_dis_inf)
         return outs
 
+    @profile_range("CommMAC.select_actions")
     def select_actions(self, ep_batch, t_ep, t_env, bs=slice(None), test_mode=False, ret_agent_outs=False, ret_msg=False):
         # Only select actions for the selected batch elements in bs
         avail_actions = ep_batch["avail_actions"][:, t_ep]
@@ -1,5 +1,6 @@
 from .entity_controller import EntityMAC
 import torch as th
+from utils.profiling import profile_range
 
 
 # This multi-agent controller shares parameters between agents and takes
@@ -8,6 +9,7 @@ class COPAMAC(EntityMAC):
     def __init__(self, scheme, groups, args):
         super(EntityMAC, self).__init__(scheme, groups, args)
 
+    @profile_range("COPAMAC.select_actions")
     def select_actions(self, ep_batch, t_ep, t_env, bs=slice(None), test_mode=False, ret_agent_outs=False, ret_attn_weights=False):
         # Only select actions for the selected batch elements in bs
         avail_actions = ep_batch["avail_actions"][:, t_ep]
@@ -20,6 +22,7 @@ class COPAMAC(EntityMAC):
             return chosen_actions, agent_outputs[bs]
         return chosen_actions
 
+    @profile_range("COPAMAC.forward")
     def forward(self, ep_batch, t, test_mode=False, need_msg=False, **kwargs):
         if t is None:
             t = slice(0, ep_batch["avail_actions"].shape[1])
@@ -3,6 +3,7 @@ import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions import Categorical
+from utils.profiling import profile_range
 
 
 class DppCommMac(CommMAC):
@@ -44,6 +45,7 @@ class DppCommMac(CommMAC):
         #return th.logical_or(sample_mask.unsqueeze(1), sample_mask.unsqueeze(-1)), sample_mask
         return header_mask
     @th.no_grad()
+    @profile_range("DppCommMac.decide_group")
     def decide_group(self, agent_inputs, avail_actions, head_feature,test_mode=False):
         entity, obs_mask, entity_mask = agent_inputs
         bs, ts, _ = entity_mask.shape
@@ -71,6 +73,7 @@ class DppCommMac(CommMAC):
         control_message *= ind.bool()
         #bs*1*n*n, control_message[:,0, i,j]=True means agent i leads agent j.
         return control_message.detach(), header
+    @profile_range("DppCommMac.message_comm")
     def message_comm(self, agent_inputs, avail_actions, t, train_mode=False, test_mode=False, **kwargs):
         # TODO: concate hidden state feature?
         entity, obs_mask, entity_mask = agent_inputs
@@ -0,0 +1,167 @@
+import copy
+from typing import Tuple
+import torch as th
+import torch.nn as nn
+
+from utils.th_utils import compact_deepcopy
+
+
+class _StepBatch:
+    """
+    Minimal stand-in for EpisodeBatch holding a single decision step. Every field is
+    expanded (no copy) along time so that mac._build_inputs(batch, slice(t, t + 1))
+    reads the current step, and "actions_onehot" at t - 1 holds the last actions.
+    """
+    def __init__(self, data, t):
+        self.batch_size = data["avail_actions"].shape[0]
+        self.device = data["avail_actions"].device
+        self.data = {k: v.unsqueeze(1).expand(v.shape[0], t + 1, *v.shape[1:]) for k, v in data.items()}
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+
+class _PolicyStep(nn.Module):
+    """
+    One greedy decision step of a MAC written as a pure function so it can be traced:
+        (entities, obs_mask, entity_mask, avail_actions, last_actions, hidden, message)
+            -> (actions, hidden, message)
+    Python-side state of the MAC (hidden_states, CommMAC.message, COPA's zt) is set
+    from the inputs before the call and read back afterwards.
+
+    t: episode step the graph is traced at. Only t % msg_T matters, it decides
+       whether this step forms groups and exchanges messages.
+    """
+    def __init__(self, mac, t):
+        super(_PolicyStep, self).__init__()
+        self.mac = mac
+        self.agent = mac.agent
+        if hasattr(mac, "elector"):
+            self.elector = mac.elector
+        self.t = t
+
+    def forward(self, entities, obs_mask, entity_mask, avail_actions, last_actions, hidden, message):
+        args = self.mac.args
+        bs = avail_actions.shape[0]
+        if args.entity_scheme:
+            data = {"entities": entities, "obs_mask": obs_mask, "entity_mask": entity_mask}
+        else:
+            data = {"obs": entities}
+        data["avail_actions"] = avail_actions
+        data["actions_onehot"] = last_actions
+        batch = _StepBatch(data, self.t)
+
+        self.mac.hidden_states = hidden
+        if hasattr(self.mac, "message"):
+            self.mac.message = message
+        if hasattr(self.agent, "zt"):
+            self.agent.zt = message.unsqueeze(1)
+
+        outs = self.mac.forward(batch, self.t, test_mode=True)
+        agent_outs = outs[0] if isinstance(outs, tuple) else outs
+
+        q = agent_outs.masked_fill(avail_actions == 0, -float("inf"))
+        actions = q.max(dim=-1)[1]
+        hidden = self.mac.hidden_states.reshape(bs, args.n_agents, -1)
+        if hasattr(self.mac, "message"):
+            message = self.mac.message.reshape(bs, args.n_agents, -1)
+        elif hasattr(self.agent, "zt"):
+            message = self.agent.zt.reshape(bs, args.n_agents, -1)
+        return actions, hidden, message
+
+
+class ExportedPolicy(nn.Module):
+    """
+    Self-contained actor: picks the traced communication step every msg_T steps and the
+    message-holding step otherwise. Shape information is kept as attributes so that
+    utils/policy_loader.py can build the initial state without any of this codebase.
+    """
+    def __init__(self, comm_step, hold_step, msg_T, sizes):
+        super(ExportedPolicy, self).__init__()
+        self.comm_step = comm_step
+        self.hold_step = hold_step
+        self.msg_T = msg_T
+        self.batch_size = sizes["batch_size"]
+        self.n_agents = sizes["n_agents"]
+        self.n_actions = sizes["n_actions"]
+        self.hidden_dim = sizes["hidden_dim"]
+        self.message_dim = sizes["message_dim"]
+
+    def forward(self, t: int, entities, obs_mask, entity_mask, avail_actions, last_actions, hidden,
+                message) -> Tuple[th.Tensor, th.Tensor, th.Tensor]:
+        if t % self.msg_T == 0:
+            return self.comm_step(entities, obs_mask, entity_mask, avail_actions, last_actions, hidden, message)
+        return self.hold_step(entities, obs_mask, entity_mask, avail_actions, last_actions, hidden, message)
+
+
+def _cpu_copy(mac):
+    # independent CPU copy of the networks, the training mac is left untouched
+    export_mac = copy.copy(mac)
+    export_mac.args = copy.copy(mac.args)
+    export_mac.args.device = "cpu"
+    export_mac.agent = compact_deepcopy(mac.agent).cpu().eval()
+    if hasattr(mac, "elector"):
+        export_mac.elector = compact_deepcopy(mac.elector).cpu().eval()
+    export_mac.hidden_states = None
+    if hasattr(export_mac.agent, "have_attn"):
+        export_mac.agent.have_attn = False
+    return export_mac
+
+
+def _example_inputs(mac, batch_size):
+    args = mac.args
+    scheme = mac.scheme
+    n_agents, n_actions = args.n_agents, args.n_actions
+    if args.entity_scheme:
+        ne = args.n_entities
+        entities = th.zeros(batch_size, ne, scheme["entities"]["vshape"])
+        obs_mask = th.zeros(batch_size, ne, ne, dtype=th.uint8)
+        entity_mask = th.zeros(batch_size, ne, dtype=th.uint8)
+    else:
+        entities = th.zeros(batch_size, n_agents, scheme["obs"]["vshape"])
+        # masks are unused without the entity scheme
+        obs_mask = th.zeros(batch_size, 1, dtype=th.uint8)
+        entity_mask = th.zeros(batch_size, 1, dtype=th.uint8)
+    avail_actions = th.ones(batch_size, n_agents, n_actions, dtype=th.int)
+    last_actions = th.zeros(batch_size, n_agents, n_actions)
+    hidden = th.zeros(batch_size, n_agents, args.rnn_hidden_dim)
+    message_dim = args.msg_dim if args.use_msg else 1
+    message = th.zeros(batch_size, n_agents, message_dim)
+    return (entities, obs_mask, entity_mask, avail_actions, last_actions, hidden, message), message_dim
+
+
+def export_policy(mac, path, batch_size=1):
+    """
+    Trace the greedy actor of `mac` into a TorchScript file that only needs torch to
+    run (see utils/policy_loader.py). Inputs are the raw env entities/obs, masks,
+    available actions and the previous one-hot actions; recurrent hidden state and
+    messages are passed in and returned explicitly.
+
+    The traced graphs are specialised to `batch_size` and to the Python branches
+    taken by the config (e.g. random_master), which are fixed for a given run anyway.
+    """
+    args = mac.args
+    if args.__dict__.get("order_leader", False) or args.__dict__.get("use_comm_sr", False) or \
+            args.__dict__.get("gt_mask_avail", False):
+        raise ValueError("Policy export does not support order_leader, use_comm_sr or gt_mask inputs")
+
+    export_mac = _cpu_copy(mac)
+    example_inputs, message_dim = _example_inputs(export_mac, batch_size)
+    msg_T = args.msg_T if args.use_msg else 1
+    with th.no_grad():
+        # group formation is sampled, so the traces are not checked against a second run
+        comm_step = th.jit.trace(_PolicyStep(export_mac, msg_T), example_inputs, check_trace=False)
+        if msg_T > 1:
+            hold_step = th.jit.trace(_PolicyStep(export_mac, msg_T + 1), example_inputs, check_trace=False)
+        else:
+            hold_step = comm_step
+    sizes = {"batch_size": batch_size,
+             "n_agents": args.n_agents,
+             "n_actions": args.n_actions,
+             "hidden_dim": args.rnn_hidden_dim,
+             "message_dim": message_dim}
+    policy = th.jit.script(ExportedPolicy(comm_step, hold_step, msg_T, sizes).eval())
+    policy = th.jit.freeze(policy, preserved_attrs=["batch_size", "n_agents", "n_actions",
+                                                    "hidden_dim", "message_dim", "msg_T"])
+    th.jit.save(policy, path)
+    return policy
@@ -0,0 +1,100 @@
+import copy
+import torch as th
+import torch.nn as nn
+from torch.utils._pytree import tree_map
+
+from utils.th_utils import compact_deepcopy
+
+
+def _dynamic_qconfig_spec(module):
+    # agents allocate their hidden state from fc1.weight (init_hidden), which a
+    # quantized Linear no longer exposes as a tensor, so fc1 stays float
+    return {name: th.quantization.default_dynamic_qconfig
+            for name, m in module.named_modules()
+            if isinstance(m, (nn.Linear, nn.GRUCell)) and name != "fc1"}
+
+
+class CPUActor(nn.Module):
+    """
+    Runs a CPU copy of a network for a mac on another device: tensor inputs are moved
+    to CPU and the outputs back to `device`. Other attributes (attn_weights, ...) are
+    read from the wrapped network.
+    """
+    def __init__(self, module, device):
+        super(CPUActor, self).__init__()
+        self.module = module
+        self.device = device
+
+    def forward(self, *args, **kwargs):
+        args, kwargs = tree_map(lambda x: x.cpu() if th.is_tensor(x) else x, (args, kwargs))
+        out = self.module(*args, **kwargs)
+        return tree_map(lambda x: x.to(self.device) if th.is_tensor(x) else x, out)
+
+    def init_hidden(self):
+        return self.module.init_hidden().to(self.device)
+
+    def __getattr__(self, name):
+        try:
+            return super(CPUActor, self).__getattr__(name)
+        except AttributeError:
+            return getattr(self.module, name)
+
+
+def _quantize(module, device):
+    # quantized kernels only run on CPU: quantize a CPU copy, the float module stays on its device
+    q_module = th.quantization.quantize_dynamic(compact_deepcopy(module).cpu(), _dynamic_qconfig_spec(module),
+                                                dtype=th.qint8, inplace=True)
+    return q_module if device == "cpu" else CPUActor(q_module, device)
+
+
+def quantize_mac(mac):
+    """
+    Copy of `mac` for acting only, with the Linear and GRUCell layers of the agent
+    (and the elector of rlcomm_mac) replaced by int8 dynamically quantized versions.
+    Action selector and other stateless parts are shared with the float mac.
+
+    Quantized kernels only run on CPU: with use_cuda the quantized networks are CPU
+    copies, their inputs are moved to CPU every step and their outputs back to the GPU.
+    """
+    q_mac = copy.copy(mac)
+    q_mac.agent = _quantize(mac.agent, mac.args.device)
+    if hasattr(mac, "elector"):
+        q_mac.elector = _quantize(mac.elector, mac.args.device)
+    q_mac.hidden_states = None
+    return q_mac
+
+
+@th.no_grad()
+def greedy_action_agreement(float_mac, q_mac, batch):
+    """
+    Fraction of (step, agent) pairs of a recorded episode batch where the quantized
+    mac picks the same greedy action as the float mac. Both macs are stepped through
+    the episode with the same inputs; comm MACs get the recorded head messages so
+    that differences in sampled group formation do not count as disagreement.
+    """
+    avail_actions = batch["avail_actions"]
+    filled = batch["filled"].squeeze(-1).bool()
+    use_recorded_msg = "head_message" in batch.scheme
+
+    float_mac.init_hidden(batch.batch_size)
+    q_mac.init_hidden(batch.batch_size)
+    float_mac.eval()
+    q_mac.eval()
+    n_same = 0
+    n_total = 0
+    for t in range(batch.max_seq_length):
+        if use_recorded_msg:
+            float_q = float_mac.forward(batch, t, test_mode=True, fix_msg=batch["head_message"][:, t])[0]
+            quant_q = q_mac.forward(batch, t, test_mode=True, fix_msg=batch["head_message"][:, t])[0]
+        else:
+            float_q = float_mac.forward(batch, t, test_mode=True)
+            quant_q = q_mac.forward(batch, t, test_mode=True)
+            if isinstance(float_q, tuple):
+                float_q, quant_q = float_q[0], quant_q[0]
+        avail = avail_actions[:, t] == 0
+        float_actions = float_q.masked_fill(avail, -float("inf")).max(dim=-1)[1]
+        quant_actions = quant_q.masked_fill(avail, -float("inf")).max(dim=-1)[1]
+        step_mask = filled[:, t].unsqueeze(1).expand_as(float_actions)
+        n_same += ((float_actions == quant_actions) & step_mask).sum().item()
+        n_total += step_mask.sum().item()
+    return n_same / max(n_total, 1)
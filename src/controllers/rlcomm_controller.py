@@ -2,6 +2,8 @@ import torch
 import torch.nn.functional as F
 from .comm_controller import CommMAC
 from modules.agents import REGISTRY as agent_REGISTRY
+from utils.th_utils import compact_state_dict
+from utils.profiling import profile_range
 
 
 class RlCommMAC(CommMAC):
@@ -10,6 +12,7 @@ class RlCommMAC(CommMAC):
         self.elector = agent_REGISTRY["election_agent"](self.input_shape, args)
         self.head_prob = None
         self.selected_head = None
+    @profile_range("RlCommMAC.decide_header")
     def decide_header(self, entity, entity_mask):
         # TODO: lack of alive agent mask
         header_dist = self.elector(entity, entity_mask) # B, max_n_agent
@@ -18,6 +21,7 @@ class RlCommMAC(CommMAC):
         self.head_prob = torch.prod(head_prob, dim=-1) # TODO: check here again and again
         self.selected_head = header
         return header.detach().squeeze(1)
+    @profile_range("RlCommMAC.decide_group")
     def decide_group(self, agent_inputs, avail_actions, test_mode=False):
         entity, obs_mask, entity_mask = agent_inputs
         # header try to dominate all visible agents
@@ -47,6 +51,7 @@ class RlCommMAC(CommMAC):
         control_message *= ind.bool()
         #bs*1*n*n, control_message[:,0, i,j]=True means agent i leads agent j.
         return control_message.detach(), header
+    @profile_range("RlCommMAC.select_actions")
     def select_actions(self, ep_batch, t_ep, t_env, bs=..., test_mode=False,
                              ret_agent_outs=False, ret_msg=False):
         # set head-related variables as None
@@ -66,8 +71,8 @@ class RlCommMAC(CommMAC):
     def elector_parameters(self):
         return self.elector.parameters()
     def save_models(self, path):
-        torch.save(self.agent.state_dict(), "{}/agent.th".format(path))
-        torch.save(self.elector.state_dict(), "{}/elector.th".format(path))
+        torch.save(compact_state_dict(self.agent), "{}/agent.th".format(path))
+        torch.save(compact_state_dict(self.elector), "{}/elector.th".format(path))
     def load_models(self, path):
         self.agent.load_state_dict(torch.load("{}/agent.th".format(path), map_location=lambda storage, loc: storage))
         self.elector.load_state_dict(torch.load("{}/elector.th".format(path), map_location=lambda storage, loc: storage))
@@ -1,21 +1,35 @@
 from functools import partial
 
 from .multiagentenv import MultiAgentEnv
-from .starcraft2 import StarCraft2Env, StarCraft2CustomEnv
-from .multiagent_particle_env import MultiAgentParticleEnv
-from .starcraft2 import custom_scenario_registry as sc_scenarios
+from .starcraft2.custom_scenarios import custom_scenario_registry as sc_scenarios
+from utils.registry import load_object
 
 
 # TODO: Do we need this?
 def env_fn(env, **kwargs) -> MultiAgentEnv: # TODO: this may be a more complex function
     # env_args = kwargs.get("env_args", {})
+    if isinstance(env, str):
+        # "module:class", imported here so that pysc2 / gym are only loaded by the
+        # processes that build the env (e.g. the ParallelRunner workers)
+        env = load_object(env)
     return env(**kwargs)
 
 
 REGISTRY = {}
-REGISTRY["sc2"] = partial(env_fn, env=StarCraft2Env)#TODO
-REGISTRY["sc2custom"] = partial(env_fn, env=StarCraft2CustomEnv)
-REGISTRY["particle"] = partial(env_fn, env=MultiAgentParticleEnv)
+REGISTRY["sc2"] = partial(env_fn, env="envs.starcraft2.starcraft2:StarCraft2Env")#TODO
+REGISTRY["sc2custom"] = partial(env_fn, env="envs.starcraft2.starcraft2custom:StarCraft2CustomEnv")
+REGISTRY["particle"] = partial(env_fn, env="envs.multiagent_particle_env.environment_entity:MultiAgentParticleEnv")
 
 s_REGISTRY = {}
 s_REGISTRY.update(sc_scenarios)
+
+
+def scenario_dict(name, cache_dir=None, rs=None):
+    """
+    Scenario dict of s_REGISTRY[name]. With cache_dir, the scenarios are compiled into
+    a file there once and the dict holds a ScenarioSet that workers load by path.
+    """
+    if not cache_dir:
+        return s_REGISTRY[name](rs=rs)
+    from .starcraft2.scenario_set import compile_scenario_dict
+    return compile_scenario_dict(name, s_REGISTRY[name], cache_dir, rs=rs)
@@ -1,2 +1,6 @@
-from gym.envs.registration import register
-from .environment_entity import MultiAgentParticleEnv
+def __getattr__(name):
+    # environment_entity imports gym, only load it when the env is used
+    if name == "MultiAgentParticleEnv":
+        from .environment_entity import MultiAgentParticleEnv
+        return MultiAgentParticleEnv
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
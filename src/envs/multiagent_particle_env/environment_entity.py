@@ -242,8 +242,35 @@ class MultiAgentParticleEnv(gym.Env, MultiAgentEnv):
         self.render_geoms = None
         self.render_geoms_xform = None
 
+    # geometry of a frame, for the numpy rasterizer in raster.py
+    def render_geometry(self, draw_sight_range=False, srk=[1,2,4], sr_color=["#2CAFAC","#FB5607", "#1982C4"], **kwargs):
+        """
+        {"circles": (n_entities, 7), "rings": (n_rings, 7)} arrays of center x, y, radius,
+        r, g, b, alpha, in the order the Viewer draws them, and the camera "center" (2,) of
+        the first Viewer. Small enough to send from env workers every step.
+        """
+        from envs.multiagent_particle_env.raster import hex_rgb
+        circles = np.zeros((len(self.world.entities), 7), dtype=np.float32)
+        for e, entity in enumerate(self.world.entities):
+            alpha = 0.5 if 'agent' in entity.name else 1.0
+            circles[e] = [*entity.state.p_pos[:2], entity.size, *entity.color[:3], alpha]
+        rings = np.zeros((len(srk) if draw_sight_range else 0, 7), dtype=np.float32)
+        if draw_sight_range:
+            pos = self.world.agents[0].state.p_pos
+            for j, (sr, color) in enumerate(zip(srk, sr_color)):
+                rings[j] = [*pos[:2], self.world.sight_range_set[sr], *hex_rgb(color), 1.0]
+        # as in render: the origin, or the agent of the first viewer when viewers are per agent
+        center = np.zeros(2, dtype=np.float32) if self.shared_viewer else \
+            np.asarray(self.agents[0].state.p_pos[:2], dtype=np.float32)
+        return {"circles": circles, "rings": rings, "center": center}
+
     # render environment
-    def render(self, mode='human', draw_sight_range=False, srk=[1,2,4], sr_color=["#2CAFAC","#FB5607", "#1982C4"]):
+    def render(self, mode='human', draw_sight_range=False, srk=[1,2,4], sr_color=["#2CAFAC","#FB5607", "#1982C4"],
+               headless=False, size=700):
+        if headless:
+            # numpy rasterizer, no display needed (always returns the rgb array)
+            from envs.multiagent_particle_env.raster import rasterize
+            return rasterize([self.render_geometry(draw_sight_range, srk, sr_color)], size=size)[0]
         if mode == 'human':
             alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
             message = ''
@@ -342,6 +369,14 @@ class MultiAgentParticleEnv(gym.Env, MultiAgentEnv):
                     dx.append(np.array([x,y]))
         return dx
     
+    def configure(self, sight_range_kind=None):
+        # reset_world keeps the world's sight range kind unless reset is given one
+        if sight_range_kind is not None:
+            self.world.sight_range_kind = sight_range_kind
+            if not getattr(self.world, "return_comm_sr", True):
+                # comm range follows the sight range unless comm_sr was given
+                self.world.comm_sr = self.world.sight_range_set[sight_range_kind]
+
     def close(self):
         print("Env closed.")
     
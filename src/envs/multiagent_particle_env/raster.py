@@ -0,0 +1,75 @@
+"""
+Software rasterizer for the particle env: draws the circles of render_geometry into RGB
+arrays with numpy only, so frames can be rendered without a display or OpenGL (the
+pyglet Viewer in rendering.py needs both).
+
+Frames match the Viewer: white background, camera over [-cam_range, cam_range] in both
+axes around the geometry's "center" (the origin with a shared viewer, otherwise the
+first agent, whose viewer is the first of the list Viewer rendering returns), entities
+drawn in order with alpha blending, sight range rings 2px wide.
+"""
+import numpy as np
+
+# columns of a geometry row: center x, y, radius, r, g, b, alpha
+GEOM_COLS = 7
+
+
+def hex_rgb(color):
+    """"#RRGGBB" -> [r, g, b] in [0, 1]"""
+    color = color.lstrip("#")
+    return [int(color[i:i + 2], 16) / 255 for i in (0, 2, 4)]
+
+
+def _blend(canvas, x, y, radius, rgba, center, size, cam_range, ring_width):
+    """Alpha blend one circle (ring_width None) or ring into canvas (size, size, 3), in place."""
+    scale = size / (2 * cam_range)
+    cx = (x - center[0] + cam_range) * scale
+    cy = (cam_range - y + center[1]) * scale
+    r = radius * scale
+    reach = r + (ring_width or 0) / 2 + 1
+    x0, x1 = max(int(cx - reach), 0), min(int(cx + reach) + 1, size)
+    y0, y1 = max(int(cy - reach), 0), min(int(cy + reach) + 1, size)
+    if x0 >= x1 or y0 >= y1:
+        return
+    # distance of the pixel centers in the bounding box from the center
+    dx = np.arange(x0, x1, dtype=np.float32) + 0.5 - cx
+    dy = np.arange(y0, y1, dtype=np.float32)[:, None] + 0.5 - cy
+    dist = np.sqrt(dx * dx + dy * dy)
+    # coverage ramps over one pixel at the edges, which anti-aliases them
+    if ring_width is None:
+        coverage = np.clip(r + 0.5 - dist, 0, 1)
+    else:
+        coverage = np.clip(ring_width / 2 + 0.5 - np.abs(dist - r), 0, 1)
+    alpha = (coverage * rgba[3])[..., None]
+    region = canvas[y0:y1, x0:x1]
+    region *= 1 - alpha
+    region += alpha * np.asarray(rgba[:3], dtype=np.float32)
+
+
+def rasterize(geometries, size=700, cam_range=1.0, ring_width=2.0):
+    """
+    uint8 frames (len(geometries), size, size, 3) of a batch of render_geometry outputs,
+    one per env. Each circle only touches the pixels of its bounding box.
+    """
+    frames = np.ones((len(geometries), size, size, 3), dtype=np.float32)
+    for canvas, geometry in zip(frames, geometries):
+        # geometries without a center (older trajectory dumps) are from shared viewers
+        center = geometry.get("center", (0.0, 0.0))
+        for x, y, r, *rgba in geometry["circles"]:
+            _blend(canvas, x, y, r, rgba, center, size, cam_range, None)
+        for x, y, r, *rgba in geometry["rings"]:
+            _blend(canvas, x, y, r, rgba, center, size, cam_range, ring_width)
+    return (frames * 255 + 0.5).astype(np.uint8)
+
+
+def tile_frames(frames, n_cols=None):
+    """One frame with the (n, h, w, 3) frames laid out in a grid, row by row."""
+    n, h, w, c = frames.shape
+    if n_cols is None:
+        n_cols = int(np.ceil(np.sqrt(n)))
+    n_rows = int(np.ceil(n / n_cols))
+    tiled = np.full((n_rows * h, n_cols * w, c), 255, dtype=frames.dtype)
+    for i, frame in enumerate(frames):
+        row, col = divmod(i, n_cols)
+        tiled[row * h:(row + 1) * h, col * w:(col + 1) * w] = frame
+    return tiled
@@ -49,9 +49,17 @@ class MultiAgentEnv(object):
     def render(self):
         raise NotImplementedError
 
+    def render_geometry(self, **render_args):
+        """ Picklable description of the current frame, rasterized outside the env (see ParallelRunner) """
+        raise NotImplementedError
+
     def close(self):
         pass # This gets called all the time.
 
+    def configure(self, **kwargs):
+        """ Change env args of a running env, applied from the next reset """
+        raise NotImplementedError
+
     def seed(self):
         raise NotImplementedError
 
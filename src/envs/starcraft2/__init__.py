@@ -2,10 +2,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from .starcraft2 import StarCraft2Env
-from .starcraft2custom import StarCraft2CustomEnv
 from .custom_scenarios import custom_scenario_registry
 
 from absl import flags
 FLAGS = flags.FLAGS
 FLAGS(['main.py'])
+
+
+def __getattr__(name):
+    # the env classes import pysc2, only load them when they are used
+    if name == "StarCraft2Env":
+        from .starcraft2 import StarCraft2Env
+        return StarCraft2Env
+    if name == "StarCraft2CustomEnv":
+        from .starcraft2custom import StarCraft2CustomEnv
+        return StarCraft2CustomEnv
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,129 @@
+"""
+Compiled scenario sets for sc2custom.
+
+The custom_scenarios functions enumerate every team of an army spec at startup, and
+the resulting list of scenarios used to be pickled into the env args of every worker.
+compile_scenario_dict writes the scenarios once to
+    <cache_dir>/<name>-<spec key>.npy    int16 unit counts (n_scenarios, 2, n_unit_types),
+                                         -1 where a unit type is not part of the team
+    <cache_dir>/<name>-<spec key>.json   unit types, the other scenario_dict entries and
+                                         the content hash
+and the scenario dict then holds a ScenarioSet, which pickles as the path and hash
+only and memory maps the counts, so every worker shares one copy through the page cache.
+"""
+import hashlib
+import inspect
+import json
+import os
+import threading
+
+import numpy as np
+
+# bump when the file layout changes, part of the spec key
+FORMAT_VERSION = 1
+
+
+def _spec_key(scenario_fn):
+    """Hash of the registry entry (function and arguments), names the compiled file."""
+    func = getattr(scenario_fn, "func", scenario_fn)
+    try:
+        # editing the function invalidates its compiled files
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = ""
+    spec = {"format": FORMAT_VERSION,
+            "func": "{}.{}".format(func.__module__, func.__qualname__),
+            "source": source,
+            "args": getattr(scenario_fn, "args", ()),
+            "keywords": {k: v for k, v in getattr(scenario_fn, "keywords", {}).items() if k != "rs"}}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=repr).encode()).hexdigest()[:16]
+
+
+def _content_hash(unit_types, counts, meta):
+    h = hashlib.sha256()
+    h.update(json.dumps([unit_types, meta], sort_keys=True).encode())
+    h.update(np.ascontiguousarray(counts, dtype="<i2").tobytes())
+    return h.hexdigest()
+
+
+def _encode_team(team, type_index):
+    row = np.full(len(type_index), -1, dtype=np.int16)
+    for num, unit_type in team:
+        # a type listed by two sub-specs of the army spec adds up
+        row[type_index[unit_type]] = max(row[type_index[unit_type]], 0) + num
+    return row
+
+
+def _decode_team(row, unit_types):
+    return [(int(num), unit_types[i]) for i, num in enumerate(row) if num >= 0]
+
+
+class ScenarioSet:
+    """
+    Read-only sequence of (ally team, enemy team) scenarios backed by a compiled file,
+    scenario i is decoded from row i of the counts (O(n_unit_types)), nothing else is
+    read. Teams list their unit types in the order of the unit type table, so a scenario
+    is the same in every process (the enumeration goes through sets, whose order depends
+    on the string hash seed).
+    """
+    def __init__(self, path, expected_hash=None):
+        self.path = path
+        with open(path + ".json", "r") as f:
+            self.meta = json.load(f)
+        self.unit_types = self.meta["unit_types"]
+        self.hash = self.meta["hash"]
+        if expected_hash is not None and expected_hash != self.hash:
+            raise ValueError("Scenario set {} changed (hash {}, expected {})".format(path, self.hash, expected_hash))
+        self.counts = np.load(path + ".npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        ally, enemy = self.counts[index]
+        return _decode_team(ally, self.unit_types), _decode_team(enemy, self.unit_types)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        # workers open the file themselves instead of receiving the scenarios
+        return {"path": self.path, "hash": self.hash}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], expected_hash=state["hash"])
+
+
+def compile_scenario_dict(name, scenario_fn, cache_dir, rs=None):
+    """
+    scenario_fn(rs=rs) with its scenarios replaced by a ScenarioSet, compiled into
+    cache_dir the first time the registry entry (name, function, arguments) is used.
+    """
+    path = os.path.join(cache_dir, "{}-{}".format(name, _spec_key(scenario_fn)))
+    if not os.path.isfile(path + ".json"):
+        scenario_dict = scenario_fn(rs=rs)
+        scenarios = scenario_dict.pop("scenarios")
+        unit_types = sorted({unit_type for scenario in scenarios for team in scenario for _, unit_type in team})
+        type_index = {unit_type: i for i, unit_type in enumerate(unit_types)}
+        counts = np.stack([np.stack([_encode_team(team, type_index) for team in scenario])
+                           for scenario in scenarios])
+        # the remaining entries are small, json keeps them readable (tuples become lists)
+        meta = json.loads(json.dumps(scenario_dict))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path + ".npy", "wb") as f:
+            np.save(f, counts)
+        with open(tmp_path + ".json", "w") as f:
+            json.dump({"unit_types": unit_types, "scenario_dict": meta,
+                       "hash": _content_hash(unit_types, counts, meta)}, f, indent=2)
+        # json last: its presence marks a complete file, concurrent compiles write the same content
+        os.replace(tmp_path + ".npy", path + ".npy")
+        os.replace(tmp_path + ".json", path + ".json")
+    scenarios = ScenarioSet(path)
+    scenario_dict = dict(scenarios.meta["scenario_dict"])
+    scenario_dict["scenarios"] = scenarios
+    scenario_dict["scenario_set_hash"] = scenarios.hash
+    return scenario_dict
@@ -25,9 +25,6 @@ from s2clientprotocol import sc2api_pb2 as sc_pb
 from s2clientprotocol import raw_pb2 as r_pb
 from s2clientprotocol import debug_pb2 as d_pb
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
 
 difficulties = {
     "1": sc_pb.VeryEasy,
@@ -1577,6 +1574,13 @@ class StarCraft2CustomEnv(MultiAgentEnv):
             avail_actions.append(avail_agent)
         return avail_actions
 
+    def configure(self, sight_range=None, divide_group=None):
+        """Change the sight range / group division without restarting StarCraft II."""
+        if sight_range is not None:
+            self._sight_range = sight_range
+        if divide_group is not None:
+            self.divide_group = divide_group
+
     def close(self):
         """Close StarCraft II."""
         if self._sc2_proc:
@@ -1593,6 +1597,11 @@ class StarCraft2CustomEnv(MultiAgentEnv):
         version of the game. This requires the version of the game used to save
         the replay and the version to load it to match up.
         """
+        # matplotlib is only needed for rendering, keep it out of env construction
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+        from matplotlib.figure import Figure
+
         if self.fig is None:
             self.fig = Figure(figsize=(15, 15), dpi=48)
             self.canvas = FigureCanvas(self.fig)
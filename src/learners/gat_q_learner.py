@@ -1,10 +1,15 @@
 import copy
 from components.episode_buffer import EpisodeBatch
+from components.target_cache import TargetCache
+from components.target_network import TargetNetworkManager
+from components.flat_optimizer import FlatOptimizer
 from modules.mixers.vdn import VDNMixer
 from modules.mixers.qmix import QMixer
 from modules.mixers.flex_qmix import FlexQMixer, LinearFlexQMixer
 from modules.mixers.weighted_vdn import WVDNMixer
 import torch as th
+from utils.th_utils import compact_state_dict
+from utils.memory import tensors_nbytes, optimizer_state_nbytes
 from torch.optim import RMSprop
 
 
@@ -18,6 +23,7 @@ class GatQLearner:
         self.params = list(mac.parameters())
 
         self.last_target_update_episode = 0
+        self.target_cache = TargetCache(args.target_cache_max_reuse)
 
         self.mixer = None
         if args.mixer is not None:
@@ -39,11 +45,20 @@ class GatQLearner:
             self.params += list(self.mixer.parameters())
             self.target_mixer = copy.deepcopy(self.mixer)
 
-        self.optimiser = RMSprop(params=self.params, lr=args.lr, alpha=args.optim_alpha, eps=args.optim_eps,
-                                 weight_decay=args.weight_decay)
+        # only the agent network is duplicated, the action selector and other stateless parts are shared
+        # copied before flattening: a copy of the flat views would duplicate the whole flat buffers
+        self.target_mac = mac.clone_for_target()
 
-        # a little wasteful to deepcopy (e.g. duplicates action selector), but should work for any MAC
-        self.target_mac = copy.deepcopy(mac)
+        if args.flat_params:
+            # params and grads become views into one buffer, step/clip run as single fused ops
+            self.optimiser = FlatOptimizer(self.params, args)
+        else:
+            self.optimiser = RMSprop(params=self.params, lr=args.lr, alpha=args.optim_alpha, eps=args.optim_eps,
+                                     weight_decay=args.weight_decay)
+
+        # target weights live in one flat buffer so hard/soft updates are single tensor ops
+        self.target_updater = TargetNetworkManager([self.mac.agent, self.mixer],
+                                                   [self.target_mac.agent, getattr(self, "target_mixer", None)])
 
         self.log_stats_t = -self.args.learner_log_interval - 1
         self.current_id = 0
@@ -71,6 +86,7 @@ class GatQLearner:
                      batch["entity_mask"][:, 1:]))
 
     def train(self, batch: EpisodeBatch, t_env: int, episode_num: int):
+        forward_timer = self.logger.timer("learner_forward").start()
         # Get the relevant quantities
         rewards = batch["reward"][:, :-1]
         actions = batch["actions"][:, :-1]
@@ -110,13 +126,8 @@ class GatQLearner:
             mac_out, x2_gate = self.mac.forward(batch, t=None, train_mode=True)
             # Pick the Q-Values for the actions taken by each agent
             chosen_action_qvals = th.gather(mac_out[:, :-1], dim=3, index=actions).squeeze(3)  # Remove the last dim
-        self.target_mac.init_hidden(batch.batch_size)
-        target_mac_out = self.target_mac.forward(batch, t=None)
         avail_actions_targ = avail_actions
-        target_mac_out = target_mac_out[:, 1:]
-
-        # Mask out unavailable actions
-        target_mac_out[avail_actions_targ[:, 1:] == 0] = -9999999  # From OG deepmarl
+        target_mac_out = self._get_target_mac_out(batch)
 
         # Max over target Q-Values
         if self.args.double_q:
@@ -174,15 +185,25 @@ class GatQLearner:
         mean_deltaQ = (deltaQ * mask).sum() / mask.sum()
         self.T = (1-self.args.beta)*self.T + self.args.beta * mean_deltaQ.detach()
         self.current_id = (self.current_id + 1) % self.args.n_agents
+        forward_timer.stop()
         self.optimiser.zero_grad()
-        loss.backward()
-        grad_norm = th.nn.utils.clip_grad_norm_(self.params, self.args.grad_norm_clip)
+        with self.logger.timer("learner_backward"):
+            loss.backward()
+        step_timer = self.logger.timer("optimizer_step").start()
+        if self.args.flat_params:
+            grad_norm = self.optimiser.clip_grad_norm_(self.args.grad_norm_clip)
+        else:
+            grad_norm = th.nn.utils.clip_grad_norm_(self.params, self.args.grad_norm_clip)
         try:
             grad_norm=grad_norm.item()
         except:
             pass
         self.optimiser.step()
-        if (episode_num - self.last_target_update_episode) / self.args.target_update_interval >= 1.0:
+        step_timer.stop()
+        if self.args.target_update_mode == "soft":
+            self.target_updater.soft_update(self.args.target_tau)
+            self.target_cache.clear()
+        elif (episode_num - self.last_target_update_episode) / self.args.target_update_interval >= 1.0:
             self._update_targets()
             self.last_target_update_episode = episode_num
 
@@ -202,23 +223,53 @@ class GatQLearner:
             self.logger.log_stat("target_mean", (targets * mask).sum().item()/(mask_elems * self.args.n_agents), t_env)
             self.log_stats_t = t_env
 
+    def _get_target_mac_out(self, batch):
+        # target outputs only depend on the batch and the target weights, so they can be
+        # reused across gradient steps on the same batch until the targets change
+        target_mac_out = self.target_cache.get(batch)
+        if target_mac_out is not None:
+            return target_mac_out
+        with th.no_grad():
+            self.target_mac.init_hidden(batch.batch_size)
+            target_mac_out = self.target_mac.forward(batch, t=None)
+            target_mac_out = target_mac_out[:, 1:]
+
+            # Mask out unavailable actions
+            target_mac_out[batch["avail_actions"][:, 1:] == 0] = -9999999  # From OG deepmarl
+        self.target_cache.put(batch, target_mac_out)
+        return target_mac_out
+
     def _update_targets(self):
-        self.target_mac.load_state(self.mac)
-        if self.mixer is not None:
-            self.target_mixer.load_state_dict(self.mixer.state_dict())
+        self.target_updater.hard_update()
+        self.target_cache.clear()
         self.logger.console_logger.info("Updated target network")
 
+    def memory_usage(self):
+        """Bytes of parameters, gradients and optimiser state, per module."""
+        usage = {"mac": tensors_nbytes(self.mac.parameters()),
+                 "target_mac": tensors_nbytes(self.target_mac.parameters())}
+        if self.mixer is not None:
+            usage["mixer"] = tensors_nbytes(self.mixer.parameters())
+            usage["target_mixer"] = tensors_nbytes(self.target_mixer.parameters())
+        usage["grads"] = tensors_nbytes(p.grad for p in self.params if p.grad is not None)
+        usage["optimiser"] = optimizer_state_nbytes(self.optimiser)
+        return usage
+
     def cuda(self):
         self.mac.cuda()
         self.target_mac.cuda()
         if self.mixer is not None:
             self.mixer.cuda()
             self.target_mixer.cuda()
+        # moving the target networks replaced their parameter storage
+        self.target_updater.flatten()
+        if self.args.flat_params:
+            self.optimiser.flatten()
 
     def save_models(self, path):
         self.mac.save_models(path)
         if self.mixer is not None:
-            th.save(self.mixer.state_dict(), "{}/mixer.th".format(path))
+            th.save(compact_state_dict(self.mixer), "{}/mixer.th".format(path))
         th.save(self.optimiser.state_dict(), "{}/opt.th".format(path))
 
     def load_models(self, path, evaluate=False):
@@ -1,10 +1,15 @@
 import copy
 from components.episode_buffer import EpisodeBatch
+from components.target_cache import TargetCache
+from components.target_network import TargetNetworkManager
+from components.flat_optimizer import FlatOptimizer
 from modules.mixers.vdn import VDNMixer
 from modules.mixers.qmix import QMixer
 from modules.mixers.flex_qmix import FlexQMixer, LinearFlexQMixer
 from modules.mixers.weighted_vdn import WVDNMixer
 import torch as th
+from utils.th_utils import compact_state_dict
+from utils.memory import tensors_nbytes, optimizer_state_nbytes
 from torch.optim import RMSprop
 
 
@@ -18,6 +23,7 @@ class QLearner:
         self.params = list(mac.parameters())
 
         self.last_target_update_episode = 0
+        self.target_cache = TargetCache(args.target_cache_max_reuse)
 
         self.mixer = None
         if args.mixer is not None:
@@ -39,13 +45,28 @@ class QLearner:
             self.params += list(self.mixer.parameters())
             self.target_mixer = copy.deepcopy(self.mixer)
 
-        self.optimiser = RMSprop(params=self.params, lr=args.lr, alpha=args.optim_alpha, eps=args.optim_eps,
-                                 weight_decay=args.weight_decay)
+        # only the agent network is duplicated, the action selector and other stateless parts are shared
+        # copied before flattening: a copy of the flat views would duplicate the whole flat buffers
+        self.target_mac = mac.clone_for_target()
 
-        # a little wasteful to deepcopy (e.g. duplicates action selector), but should work for any MAC
-        self.target_mac = copy.deepcopy(mac)
+        if args.flat_params:
+            # params and grads become views into one buffer, step/clip run as single fused ops
+            self.optimiser = FlatOptimizer(self.params, args)
+        else:
+            self.optimiser = RMSprop(params=self.params, lr=args.lr, alpha=args.optim_alpha, eps=args.optim_eps,
+                                     weight_decay=args.weight_decay)
+
+        # target weights live in one flat buffer so hard/soft updates are single tensor ops
+        self.target_updater = TargetNetworkManager([self.mac.agent, self.mixer],
+                                                   [self.target_mac.agent, getattr(self, "target_mixer", None)])
 
         self.log_stats_t = -self.args.learner_log_interval - 1
+        # number of seeds whose episodes are stacked in a training batch, see SeedBatchedQLearner
+        self.n_seeds = 1
+
+    def _seed_sum(self, x):
+        """(n_seeds,) sums of x over the equally sized blocks of episodes of each seed."""
+        return x.reshape(self.n_seeds, -1).sum(1)
 
     def _get_mixer_ins(self, batch, repeat_batch=1):
         if not self.args.entity_scheme:
@@ -74,6 +95,21 @@ class QLearner:
         return grad
 
     def train(self, batch: EpisodeBatch, t_env: int, episode_num: int):
+        will_log = (t_env - self.log_stats_t >= self.args.learner_log_interval)
+        losses, log_stats = self.compute_loss(batch, will_log)
+        # Optimise
+        self.optimiser.zero_grad()
+        with self.logger.timer("learner_backward"):
+            losses.sum().backward()
+        self.apply_update(t_env, episode_num, log_stats[0] if will_log else None)
+
+    def compute_loss(self, batch: EpisodeBatch, will_log: bool):
+        """
+        Forward pass of the loss. Returns the (n_seeds,) losses of the seeds whose
+        episodes make up the batch (a single seed outside SeedBatchedQLearner) and, with
+        will_log, a dict of training stats per seed.
+        """
+        forward_timer = self.logger.timer("learner_forward").start()
         # Get the relevant quantities
         rewards = batch["reward"][:, :-1]
         actions = batch["actions"][:, :-1]
@@ -82,8 +118,6 @@ class QLearner:
         mask[:, 1:] = mask[:, 1:] * (1 - terminated[:, :-1])
         avail_actions = batch["avail_actions"]
 
-        will_log = (t_env - self.log_stats_t >= self.args.learner_log_interval)
-
         # # Calculate estimated Q-Values
         # mac_out = []
         self.mac.init_hidden(batch.batch_size)
@@ -126,14 +160,8 @@ class QLearner:
 
             
 
-        self.target_mac.init_hidden(batch.batch_size)
-
-        target_mac_out = self.target_mac.forward(batch, t=None)
         avail_actions_targ = avail_actions
-        target_mac_out = target_mac_out[:, 1:]
-
-        # Mask out unavailable actions
-        target_mac_out[avail_actions_targ[:, 1:] == 0] = -9999999  # From OG deepmarl
+        target_mac_out = self._get_target_mac_out(batch)
 
         # Max over target Q-Values
         if self.args.double_q:
@@ -188,14 +216,14 @@ class QLearner:
         mask = mask.expand_as(td_error)
         # 0-out the targets that came from padded data
         masked_td_error = td_error * mask
-        # Normal L2 loss, take mean over actual data
-        loss = (masked_td_error ** 2).sum() / mask.sum()
+        # Normal L2 loss, take mean over actual data (of each seed)
+        loss = self._seed_sum(masked_td_error ** 2) / self._seed_sum(mask)
 
         if 'imagine' in self.args.agent:
             im_prop = self.args.lmbda
             im_td_error = (caq_imagine - targets.detach())
             im_masked_td_error = im_td_error * mask
-            im_loss = (im_masked_td_error ** 2).sum() / mask.sum()
+            im_loss = self._seed_sum(im_masked_td_error ** 2) / self._seed_sum(mask)
             loss = (1 - im_prop) * loss + im_prop * im_loss
         if self.args.__dict__.get("local_constraint", False):
             if self.args.ave_tot:
@@ -220,75 +248,109 @@ class QLearner:
         # for p, rg in zip(self.mac.parameters(), orig_req_grad):
         #     p.requires_grad = rg
         # hk.remove()
-        # Optimise
-        self.optimiser.zero_grad()
-        loss.backward()
-        grad_norm = th.nn.utils.clip_grad_norm_(self.params, self.args.grad_norm_clip)
+        forward_timer.stop()
+
+        log_stats = []
+        if will_log:
+            seed_bs = batch.batch_size // self.n_seeds
+            for i in range(self.n_seeds):
+                sl = slice(i * seed_bs, (i + 1) * seed_bs)
+                mask_elems = mask[sl].sum().item()
+                stats = {"loss": loss[i].item(),
+                         "min_local_taken_q": chosen_action_qvals[sl].min(-1)[0].mean().item(),
+                         "max_local_taken_q": chosen_action_qvals[sl].max(-1)[0].mean().item(),
+                         "td_error_abs": masked_td_error[sl].abs().sum().item() / mask_elems,
+                         "q_taken_mean": (global_action_qvals[sl] * mask[sl]).sum().item() / (mask_elems * self.args.n_agents),
+                         "target_mean": (targets[sl] * mask[sl]).sum().item() / (mask_elems * self.args.n_agents)}
+                if 'imagine' in self.args.agent:
+                    stats["im_loss"] = im_loss[i].item()
+                if self.args.test_gt_factors:
+                    stats["ingroup_prop"] = ingroup_prop.item()
+                    stats["gt_ingroup_prop"] = gt_ingroup_prop.item()
+                if self.args.__dict__.get("local_constraint", False):
+                    stats["local_loss"] = local_loss.item()
+                if batch.max_seq_length == 2:
+                    # We are in a 1-step env. Calculate the max Q-Value for logging
+                    max_agent_qvals = mac_out_detach[:,0].max(dim=2, keepdim=True)[0]
+                    max_qtots = self.mixer(max_agent_qvals, batch["state"][:,0])
+                    stats["max_qtot"] = max_qtots.mean().item()
+                log_stats.append(stats)
+        return loss, log_stats
+
+    def apply_update(self, t_env, episode_num, log_stats=None):
+        """Clip and apply the gradients of compute_loss, update the targets and log `log_stats`."""
+        step_timer = self.logger.timer("optimizer_step").start()
+        if self.args.flat_params:
+            grad_norm = self.optimiser.clip_grad_norm_(self.args.grad_norm_clip)
+        else:
+            grad_norm = th.nn.utils.clip_grad_norm_(self.params, self.args.grad_norm_clip)
         try:
             grad_norm=grad_norm.item()
         except:
             pass
         self.optimiser.step()
+        step_timer.stop()
 
-        if (episode_num - self.last_target_update_episode) / self.args.target_update_interval >= 1.0:
+        if self.args.target_update_mode == "soft":
+            self.target_updater.soft_update(self.args.target_tau)
+            self.target_cache.clear()
+        elif (episode_num - self.last_target_update_episode) / self.args.target_update_interval >= 1.0:
             self._update_targets()
             self.last_target_update_episode = episode_num
 
-        if t_env - self.log_stats_t >= self.args.learner_log_interval:
-            self.logger.log_stat("loss", loss.item(), t_env)
-            # self.logger.log_stat("max_local_weight", self.local_q_weight.max(-1)[0].mean().item(), t_env)
-            # self.logger.log_stat("min_local_weight", self.local_q_weight.min(-1)[0].mean().item(), t_env)
-            # self.logger.log_stat("delta_local_weight", (self.local_q_weight.max(-1)[0].mean()-self.local_q_weight.min(-1)[0].mean()).item(), t_env)
-            # self.logger.log_stat("max_local_weight[0,10]", self.local_q_weight[0,10].max(-1)[0].item(), t_env)
-            # self.logger.log_stat("min_local_weight[0,10]", self.local_q_weight[0,10].min(-1)[0].item(), t_env)
-            # self.logger.log_stat("unnorm_max_local_weight", self.unnorm_local_q_weight.max(-1)[0].mean().item(), t_env)
-            # self.logger.log_stat("unnorm_min_local_weight", self.unnorm_local_q_weight.min(-1)[0].mean().item(), t_env)
-            # self.logger.log_stat("unnorm_max_local_weight[0,10]", self.unnorm_local_q_weight[0,10].max(-1)[0].item(), t_env)
-            # self.logger.log_stat("unnorm_min_local_weight[0,10]", self.unnorm_local_q_weight[0,10].min(-1)[0].item(), t_env)
-            
-            self.logger.log_stat("min_local_taken_q", chosen_action_qvals.min(-1)[0].mean().item(), t_env)
-            self.logger.log_stat("max_local_taken_q", chosen_action_qvals.max(-1)[0].mean().item(), t_env)
-            # self.logger.log_stat("mean_local_taken_q", chosen_action_qvals.mean(-1)[0].mean().item(), t_env)
-            # self.logger.log_stat("min_local_taken_q[0,10]", chosen_action_qvals[0,10].min(-1)[0].item(), t_env)
-            # self.logger.log_stat("max_local_taken_q[0,10]", chosen_action_qvals[0,10].max(-1)[0].item(), t_env)
-            # self.logger.log_stat("mean_local_taken_q[0,10]", chosen_action_qvals[0,10].mean(-1).item(), t_env)
-            
-            if 'imagine' in self.args.agent:
-                self.logger.log_stat("im_loss", im_loss.item(), t_env)
-            if self.args.test_gt_factors:
-                self.logger.log_stat("ingroup_prop", ingroup_prop.item(), t_env)
-                self.logger.log_stat("gt_ingroup_prop", gt_ingroup_prop.item(), t_env)
+        if log_stats is not None:
+            for k, v in log_stats.items():
+                self.logger.log_stat(k, v, t_env)
             self.logger.log_stat("grad_norm", grad_norm, t_env)
-            mask_elems = mask.sum().item()
-            self.logger.log_stat("td_error_abs", (masked_td_error.abs().sum().item()/mask_elems), t_env)
-            self.logger.log_stat("q_taken_mean", (global_action_qvals * mask).sum().item()/(mask_elems * self.args.n_agents), t_env)
-            self.logger.log_stat("target_mean", (targets * mask).sum().item()/(mask_elems * self.args.n_agents), t_env)
-            if self.args.__dict__.get("local_constraint", False):
-                self.logger.log_stat("local_loss", local_loss.item(), t_env)
-            if batch.max_seq_length == 2:
-                # We are in a 1-step env. Calculate the max Q-Value for logging
-                max_agent_qvals = mac_out_detach[:,0].max(dim=2, keepdim=True)[0]
-                max_qtots = self.mixer(max_agent_qvals, batch["state"][:,0])
-                self.logger.log_stat("max_qtot", max_qtots.mean().item(), t_env)
             self.log_stats_t = t_env
 
+    def _get_target_mac_out(self, batch):
+        # target outputs only depend on the batch and the target weights, so they can be
+        # reused across gradient steps on the same batch until the targets change
+        target_mac_out = self.target_cache.get(batch)
+        if target_mac_out is not None:
+            return target_mac_out
+        with th.no_grad():
+            self.target_mac.init_hidden(batch.batch_size)
+            target_mac_out = self.target_mac.forward(batch, t=None)
+            target_mac_out = target_mac_out[:, 1:]
+
+            # Mask out unavailable actions
+            target_mac_out[batch["avail_actions"][:, 1:] == 0] = -9999999  # From OG deepmarl
+        self.target_cache.put(batch, target_mac_out)
+        return target_mac_out
+
     def _update_targets(self):
-        self.target_mac.load_state(self.mac)
-        if self.mixer is not None:
-            self.target_mixer.load_state_dict(self.mixer.state_dict())
+        self.target_updater.hard_update()
+        self.target_cache.clear()
         self.logger.console_logger.info("Updated target network")
 
+    def memory_usage(self):
+        """Bytes of parameters, gradients and optimiser state, per module."""
+        usage = {"mac": tensors_nbytes(self.mac.parameters()),
+                 "target_mac": tensors_nbytes(self.target_mac.parameters())}
+        if self.mixer is not None:
+            usage["mixer"] = tensors_nbytes(self.mixer.parameters())
+            usage["target_mixer"] = tensors_nbytes(self.target_mixer.parameters())
+        usage["grads"] = tensors_nbytes(p.grad for p in self.params if p.grad is not None)
+        usage["optimiser"] = optimizer_state_nbytes(self.optimiser)
+        return usage
+
     def cuda(self):
         self.mac.cuda()
         self.target_mac.cuda()
         if self.mixer is not None:
             self.mixer.cuda()
             self.target_mixer.cuda()
+        # moving the target networks replaced their parameter storage
+        self.target_updater.flatten()
+        if self.args.flat_params:
+            self.optimiser.flatten()
 
     def save_models(self, path):
         self.mac.save_models(path)
         if self.mixer is not None:
-            th.save(self.mixer.state_dict(), "{}/mixer.th".format(path))
+            th.save(compact_state_dict(self.mixer), "{}/mixer.th".format(path))
         th.save(self.optimiser.state_dict(), "{}/opt.th".format(path))
 
     def load_models(self, path, evaluate=False):
@@ -0,0 +1,58 @@
+import copy
+
+from components.seed_stack import SeedStack
+from components.target_cache import TargetCache
+from learners.q_learner import QLearner
+
+
+class SeedBatchedQLearner(QLearner):
+    """
+    One training step of several QLearners (one per seed, same config) as a single
+    batched forward / backward: the agents, mixers and their targets are SeedStacks of
+    the seeds' networks and the batch holds the sampled episodes of every seed, seed
+    major (EpisodeBatch.cat). The loss is computed per seed, so each seed's learner
+    then clips, steps its optimiser, updates its targets and logs exactly as if it had
+    trained alone (QLearner.apply_update).
+    """
+    def __init__(self, learners):
+        first = learners[0]
+        self.learners = learners
+        self.args = first.args
+        # times the batched forward / backward
+        self.logger = first.logger
+        self.n_seeds = len(learners)
+        self.mac = self._stacked_mac(first.mac, [l.mac.agent for l in learners])
+        self.target_mac = self._stacked_mac(first.target_mac, [l.target_mac.agent for l in learners])
+        self.mixer = SeedStack([l.mixer for l in learners])
+        self.target_mixer = SeedStack([l.target_mixer for l in learners])
+        self.target_cache = TargetCache(self.args.target_cache_max_reuse)
+
+    @staticmethod
+    def _stacked_mac(mac, agents):
+        # shares the action selector and args, as clone_for_target does
+        stacked = copy.copy(mac)
+        stacked.agent = SeedStack(agents)
+        stacked.hidden_states = None
+        return stacked
+
+    def train(self, batch, t_envs, episode_nums):
+        will_log = [t_env - l.log_stats_t >= self.args.learner_log_interval
+                    for l, t_env in zip(self.learners, t_envs)]
+        # the optimisers stepped since the last call
+        self.mac.agent.stack()
+        self.mixer.stack()
+        self.target_mac.agent.stack(requires_grad=False)
+        self.target_mixer.stack(requires_grad=False)
+
+        losses, log_stats = self.compute_loss(batch, any(will_log))
+        for l in self.learners:
+            l.optimiser.zero_grad()
+        with self.logger.timer("learner_backward"):
+            losses.sum().backward()
+
+        last_target_updates = [l.last_target_update_episode for l in self.learners]
+        for i, l in enumerate(self.learners):
+            l.apply_update(t_envs[i], episode_nums[i], log_stats[i] if will_log[i] else None)
+        if self.args.target_update_mode == "soft" or \
+                last_target_updates != [l.last_target_update_episode for l in self.learners]:
+            self.target_cache.clear()
@@ -2,6 +2,7 @@ import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
 from modules.layers import EntityAttentionLayer, EntityPoolingLayer
+from utils.th_utils import StepBuffer
 import torch.distributions as D
 
 
@@ -40,12 +41,13 @@ class EntityAttentionCOPAAgent(nn.Module):
         self.zt = None
         self.max_logvar = nn.Parameter((th.ones((1, args.msg_dim)).float() / 2).to(args.device), requires_grad=False)
         self.min_logvar = nn.Parameter((-th.ones((1, args.msg_dim)).float() * 10).to(args.device), requires_grad=False)
-        self.attn_weights=None
+        # attention weights of every step when called with ret_attn_weights
+        self.attn_weights = StepBuffer()
         
 
     def init_hidden(self):
         # make hidden states on same device as model
-        self.attn_weights=None
+        self.attn_weights.clear()
         return self.fc1.weight.new(1, self.args.rnn_hidden_dim).zero_()
 
     def forward(self, inputs, hidden_state, ret_attn_logits=None, new_msg=False, ret_attn_weights=False):
@@ -72,10 +74,7 @@ class EntityAttentionCOPAAgent(nn.Module):
             x2, attn_logits = attn_outs
         elif ret_attn_weights:
             x2, attn_weights = attn_outs
-            if self.attn_weights is None:
-                self.attn_weights = attn_weights
-            else:
-                self.attn_weights=th.cat([self.attn_weights, attn_weights], dim=0)
+            self.attn_weights.append(attn_weights)
         else:
             x2 = attn_outs
         zt_logits = F.relu(self.fc_msg(x2_coach)) # should be [bs, ts, n, msg_d]
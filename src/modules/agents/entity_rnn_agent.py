@@ -2,6 +2,7 @@ import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
 from modules.layers import EntityAttentionLayer, EntityPoolingLayer
+from utils.th_utils import StepBuffer
 
 
 class EntityAttentionRNNAgent(nn.Module):
@@ -26,11 +27,12 @@ class EntityAttentionRNNAgent(nn.Module):
         self.fc3 = nn.Linear(args.rnn_hidden_dim+msg_d, args.n_actions)
         if args.self_loc:
             self.self_fc = nn.Linear(input_shape, args.attn_embed_dim)
-        self.attn_weights=None
+        # attention weights of every step when called with ret_attn_weights
+        self.attn_weights = StepBuffer()
 
     def init_hidden(self):
         # make hidden states on same device as model
-        self.attn_weights=None
+        self.attn_weights.clear()
         return self.fc1.weight.new(1, self.args.rnn_hidden_dim).zero_()
 
     def forward(self, inputs, hidden_state, ret_attn_logits=None, msg=None, ret_attn_weights=False):
@@ -49,10 +51,7 @@ class EntityAttentionRNNAgent(nn.Module):
             x2, attn_logits = attn_outs
         elif ret_attn_weights:
             x2, attn_weights = attn_outs
-            if self.attn_weights is None:
-                self.attn_weights = attn_weights
-            else:
-                self.attn_weights=th.cat([self.attn_weights, attn_weights], dim=0)
+            self.attn_weights.append(attn_weights)
         else:
             x2 = attn_outs
         for i in range(self.args.repeat_attn):
@@ -96,9 +95,8 @@ class ImagineEntityAttentionRNNAgent(EntityAttentionRNNAgent):
         return 1 - inp
 
     def logical_or(self, inp1, inp2):
-        out = inp1 + inp2
-        out[out > 1] = 1
-        return out
+        # clamp instead of masked assignment, which vmap (components/seed_stack.py) does not support
+        return (inp1 + inp2).clamp(max=1)
 
     def entitymask2attnmask(self, entity_mask):
         bs, ts, ne = entity_mask.shape
@@ -1,6 +1,7 @@
 import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
+from utils.profiling import profile_range
 
 
 class EntityAttentionLayer(nn.Module):
@@ -22,6 +23,7 @@ class EntityAttentionLayer(nn.Module):
             assert in_dim == out_dim
         self.out_trans = nn.Linear(self.embed_dim, self.out_dim)
 
+    @profile_range("EntityAttentionLayer.forward")
     def forward(self, entities, pre_mask=None, post_mask=None, ret_attn_logits=None, ret_attn_weights=False, rank_percent=None, entity_mask=None):
         """
         entities: Entity representations
@@ -120,6 +122,7 @@ class EntityPoolingLayer(nn.Module):
         self.in_trans = nn.Linear(self.in_dim, self.embed_dim)
         self.out_trans = nn.Linear(self.embed_dim, self.out_dim)
 
+    @profile_range("EntityPoolingLayer.forward")
     def forward(self, entities, pre_mask=None, post_mask=None, ret_attn_logits=None):
         """
         entities: Entity representations
@@ -2,6 +2,7 @@ import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
 from modules.layers import EntityAttentionLayer, EntityPoolingLayer
+from utils.profiling import profile_range
 
 
 class AttentionHyperNet(nn.Module):
@@ -37,6 +38,7 @@ class AttentionHyperNet(nn.Module):
                                            args)
         self.fc2 = nn.Linear(hypernet_embed, args.mixing_embed_dim)
 
+    @profile_range("AttentionHyperNet.forward")
     def forward(self, entities, entity_mask, attn_mask=None):
         x1 = F.relu(self.fc1(entities))
         agent_mask = entity_mask[:, :self.args.n_agents]
@@ -76,6 +78,7 @@ class FlexQMixer(nn.Module):
         if getattr(self.args, "mixer_non_lin", "elu") == "tanh":
             self.non_lin = F.tanh
 
+    @profile_range("FlexQMixer.forward")
     def forward(self, agent_qs, inputs, imagine_groups=None):
         entities, entity_mask = inputs
         bs, max_t, ne, ed = entities.shape
@@ -133,6 +136,7 @@ class LinearFlexQMixer(nn.Module):
         self.hyper_w_1 = AttentionHyperNet(args, mode='alt_vector')
         self.V = AttentionHyperNet(args, mode='scalar')
 
+    @profile_range("LinearFlexQMixer.forward")
     def forward(self, agent_qs, inputs, imagine_groups=None, ret_ingroup_prop=False):
         entities, entity_mask = inputs
         bs, max_t, ne, ed = entities.shape
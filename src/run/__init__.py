@@ -1,6 +1,6 @@
-from .run import run as default_run
-from .sog_run import run as sog_run
+from utils.registry import LazyRegistry
 
-REGISTRY = {}
-REGISTRY["default"] = default_run
-REGISTRY["sog"] = sog_run
+# run/run.py and run/sog_run.py pull in every registry, import them only when chosen
+REGISTRY = LazyRegistry()
+REGISTRY["default"] = "run.run:run"
+REGISTRY["sog"] = "run.sog_run:run"
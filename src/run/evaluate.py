@@ -0,0 +1,220 @@
+import csv
+import os
+import os.path as osp
+
+import numpy as np
+import torch as th
+from numpy.random import RandomState
+
+from runners import REGISTRY as r_REGISTRY
+from controllers import REGISTRY as mac_REGISTRY
+from controllers.policy_export import export_policy
+from controllers.quantization import quantize_mac
+from envs import scenario_dict
+from components.episode_buffer import EpisodeBatch
+from components.scenario_sampler import ScenarioStats
+from run.run import build_scheme
+from utils.checkpoint import find_checkpoint, CheckpointIndex
+
+# evaluate_multi_model sight range kinds -> sc2 env args
+SC2_SIGHT_RANGE = {0: 3, 1: 3, 2: 9, 3: 9}
+SC2_DIVIDE_GROUP = {0: True, 1: False, 2: True, 3: False}
+
+
+def env_variants(args):
+    """
+    (label, env args) of every env variant of the sweep: one per sight range kind
+    in env_args["sight_range_kind"] (all four kinds if it is not set).
+    """
+    sight_ranges = args.env_args.get("sight_range_kind", [0, 1, 2, 3])
+    if not isinstance(sight_ranges, (list, tuple)):
+        sight_ranges = [sight_ranges]
+    variants = []
+    for sr in sight_ranges:
+        if "sc2" in args.env:
+            variants.append((sr, {"sight_range": SC2_SIGHT_RANGE[sr], "divide_group": SC2_DIVIDE_GROUP[sr]}))
+        else:
+            variants.append((sr, {"sight_range_kind": sr}))
+    return variants
+
+
+def build_eval_runner(args, logger, env_args=None):
+    """
+    Runner (and its env workers) plus the scheme, groups and preprocess to build
+    MACs with. No replay buffer or learner is allocated.
+    """
+    args.entity_scheme = args.env_args.get('entity_scheme', False)
+    if env_args is not None:
+        args.env_args.update(env_args)
+    if 'sc2custom' in args.env:
+        args.env_args['scenario_dict'] = scenario_dict(args.scenario, args.scenario_cache_dir, rs=RandomState(0))
+    runner = r_REGISTRY[args.runner](args=args, logger=logger)
+    scheme, groups, preprocess = build_scheme(args, runner.get_env_info())
+    return runner, scheme, groups, preprocess
+
+
+def build_eval_mac(args, scheme, groups, preprocess):
+    # the MAC expects the scheme with the preprocessed fields (actions_onehot) added,
+    # a one step batch fills them in without allocating a buffer
+    batch_scheme = EpisodeBatch(scheme, groups, 1, 1, preprocess=preprocess, device="cpu").scheme
+    mac = mac_REGISTRY[args.mac](batch_scheme, groups, args)
+    if args.use_cuda:
+        mac.cuda()
+    return mac
+
+
+def build_eval_mixer(args):
+    """The learner's mixer for args.mixer, on its own (no target copy or optimiser)."""
+    from modules.mixers.vdn import VDNMixer
+    from modules.mixers.qmix import QMixer
+    from modules.mixers.flex_qmix import FlexQMixer, LinearFlexQMixer
+    from modules.mixers.weighted_vdn import WVDNMixer
+    mixers = {"vdn": lambda: VDNMixer(),
+              "qmix": lambda: QMixer(args),
+              "flex_qmix": lambda: FlexQMixer(args),
+              "lin_flex_qmix": lambda: LinearFlexQMixer(args),
+              "wvdn": lambda: WVDNMixer(args)}
+    if args.mixer not in mixers:
+        raise ValueError("Mixer {} not recognised.".format(args.mixer))
+    mixer = mixers[args.mixer]()
+    if args.use_cuda:
+        mixer.cuda()
+    return mixer
+
+
+def eval_checkpoints(args, logger):
+    """
+    Evaluation only entry point: builds the runner and the MAC (and the mixer when
+    save_global_attn reads its attention), without the replay buffer and learner of
+    run_sequential, so memory does not depend on buffer_size.
+
+    Yields (runner, timestep) after loading the checkpoint in args.checkpoint_path
+    matching each of args.load_step (a step, "latest", "best[:stat]" or a list of them,
+    see CheckpointIndex.resolve) into the MAC:
+        for runner, timestep in eval_checkpoints(args, logger):
+            evaluate_sequential(args, runner, logger, load_time_step=timestep)
+    """
+    runner, scheme, groups, preprocess = build_eval_runner(args, logger)
+    mac = build_eval_mac(args, scheme, groups, preprocess)
+    if args.save_global_attn:
+        # mixer hypernetworks for global attention analysis, reachable as runner.mac.mixer
+        mac.mixer = build_eval_mixer(args)
+    runner.setup(scheme=scheme, groups=groups, preprocess=preprocess, mac=mac)
+
+    load_steps = args.load_step if isinstance(args.load_step, list) else [args.load_step]
+    index = CheckpointIndex(args.checkpoint_path)
+    for load_step in load_steps:
+        found = find_checkpoint(args.checkpoint_path, load_step, index=index)
+        if found is None:
+            # the other load steps may still resolve
+            logger.console_logger.warning("No checkpoint for load_step {} in {}, skipping it".format(
+                load_step, args.checkpoint_path))
+            continue
+        model_path, timestep = found
+        logger.console_logger.info("Loading model from {}".format(model_path))
+        mac.load_models(model_path)
+        runner.refresh_actor()
+        if args.save_global_attn:
+            mac.mixer.load_state_dict(th.load("{}/mixer.th".format(model_path),
+                                              map_location=lambda storage, loc: storage))
+        if args.export_policy:
+            export_policy(mac, os.path.join(model_path, "policy.pt"), args.export_batch_size)
+        runner.t_env = timestep
+        yield runner, timestep
+
+
+def _write_table(path, rows, columns):
+    os.makedirs(osp.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: row.get(k, "") for k in columns})
+
+
+def evaluate_sweep(args, logger):
+    """
+    Evaluate every checkpoint in args.checkpoint_path (comma separated, relative to
+    args.checkpoint_prefix) on every env variant of env_variants(args).
+
+    The runner and its env workers are built once and every MAC is loaded once.
+    Switching variant reconfigures the envs in place (runner.configure_envs), and the
+    test episodes of a variant are interleaved across the models batch by batch, so
+    all models see the envs in the same state of the run. Each (model, variant) gets
+    its own copy of the runner's test returns / stats and per team size stats, which
+    the runner logs as usual once test_nepisode episodes are done.
+
+    Writes one row per (model, variant), plus the average over models per variant,
+    to a csv table (args.eval_path, or <local_results_path>/eval/<unique_token>.csv)
+    and returns the rows.
+    """
+    model_dirs = args.checkpoint_path.split(",")
+    variants = env_variants(args)
+    args.evaluate = True
+
+    runner, scheme, groups, preprocess = build_eval_runner(args, logger, env_args=variants[0][1])
+
+    macs = []
+    for md in model_dirs:
+        found = find_checkpoint(osp.join(args.checkpoint_prefix, md), args.load_step)
+        if found is None:
+            logger.console_logger.warning("No checkpoint found in {}, skipping it".format(
+                osp.join(args.checkpoint_prefix, md)))
+            continue
+        model_path, timestep = found
+        mac = build_eval_mac(args, scheme, groups, preprocess)
+        logger.console_logger.info("Loading model from {}".format(model_path))
+        mac.load_models(model_path)
+        macs.append((md, timestep, mac))
+    if not macs:
+        runner.close_env()
+        return []
+    runner.setup(scheme=scheme, groups=groups, preprocess=preprocess, mac=macs[0][2])
+    # the weights never change here, so every model is quantized once
+    actors = {md: quantize_mac(mac) if args.quantize_actor else mac for md, _, mac in macs}
+
+    n_test_batches = max(1, args.test_nepisode // runner.batch_size)
+    rows = []
+    for i, (label, env_args) in enumerate(variants):
+        if i > 0:
+            runner.configure_envs(**env_args)
+        returns = {md: [] for md, _, _ in macs}
+        stats = {md: {} for md, _, _ in macs}
+        team_stats = {md: ScenarioStats() for md, _, _ in macs}
+        variant_rows = []
+        for j in range(n_test_batches):
+            for md, timestep, mac in macs:
+                runner.mac = mac
+                runner.actor_mac = actors[md]
+                runner.test_returns, runner.test_stats = returns[md], stats[md]
+                runner.scenario_stats[True] = team_stats[md]
+                # each model's test_* stats are logged at its own step, as in eval_checkpoints
+                runner.t_env = timestep
+                last_logged = {k: v[-1] for k, v in logger.stats.items() if v}
+                runner.run(test_mode=True)
+                if j == n_test_batches - 1:
+                    # the runner logged this model's test_* stats at the end of its last batch
+                    row = {"model": md, "timestep": timestep, "variant": label}
+                    row.update({k: v[-1][1] for k, v in logger.stats.items()
+                                if k.startswith("test_") and v and v[-1] is not last_logged.get(k)})
+                    variant_rows.append(row)
+        average = {"model": "Average", "timestep": "", "variant": label}
+        for k in variant_rows[0]:
+            if k.startswith("test_"):
+                average[k] = np.mean([r[k] for r in variant_rows if k in r])
+        rows += variant_rows + [average]
+    runner.close_env()
+
+    columns = ["model", "timestep", "variant"]
+    columns += sorted({k for row in rows for k in row if k not in columns})
+    if args.eval_path is not None:
+        table_path = osp.splitext(args.eval_path)[0] + "_" + args.unique_token + ".csv"
+    else:
+        table_path = osp.join(args.local_results_path, "eval", args.unique_token + ".csv")
+    _write_table(table_path, rows, columns)
+    logger.console_logger.info("Wrote evaluation results of {} models x {} variants to {}".format(
+        len(macs), len(variants), table_path))
+    for row in rows:
+        logger.console_logger.info("model: {}, variant: {}, return mean: {}".format(
+            row["model"], row["variant"], row.get("test_return_mean")))
+    return rows
@@ -0,0 +1,178 @@
+"""
+n_seeds > 1: train seeds seed, seed + 1, ..., seed + n_seeds - 1 of one config in a
+single process, each on its own thread with its own env workers, replay buffer,
+learner, checkpoints (results/models/<token>_seed<s>) and Logger:
+    tensorboard   <tb_dirname>/<token>_seed<s>
+    sacred        info keys prefixed with seed<s>_
+    console       logger name ...seed<s>
+With checkpoint_path set, seed s resumes from <checkpoint_path>_seed<s> (the layout the
+seeds save with), load_step picks the step in every seed's directory.
+
+The rollouts of the threads overlap: torch ops and the waits on the env worker pipes
+release the GIL, so one seed's envs step while another seed picks its actions. The
+train steps (q_learner) run in lockstep through a SeedBatchedTrainer: a seed's train
+call waits until every seed still training has sampled its batch, then one
+SeedBatchedQLearner step computes the forward / backward of all seeds in single
+batched (vmapped) calls of their stacked networks, and every seed steps its own
+optimiser. Other learners train their seeds independently on the threads.
+
+Each seed seeds its env workers, but the python / numpy / torch global RNGs are shared
+by the threads, so action sampling and buffer sampling of a seed depend on how the
+threads interleave: runs are independent, but not bitwise reproducible as with one
+seed per process. For the same reason resuming does not restore the saved RNG states.
+"""
+import datetime
+import os
+import signal
+import threading
+from copy import deepcopy
+from functools import partial
+from os.path import dirname, abspath
+from types import SimpleNamespace as SN
+
+import torch as th
+
+from components.episode_buffer import EpisodeBatch
+from utils.logging import Logger
+
+
+class SeedBatchedTrainer:
+    """
+    Batches the train steps of the seed threads: train(slot, ...) blocks until every
+    slot still active has handed in its batch, the last one to arrive runs one
+    SeedBatchedQLearner step for all of them and wakes the others. A seed that stops
+    training (finished, preempted or failed) calls leave(slot), so the others never
+    wait for it. If a batched step fails, every seed raises from its next train call.
+    """
+    def __init__(self, n_seeds):
+        self.cond = threading.Condition()
+        self.active = set(range(n_seeds))
+        self.learners = {}
+        self.pending = {}
+        self.generation = 0
+        self.error = None
+        self.batched = None
+        # (samples, concatenated batch): reuse_sample trains on the same samples, which
+        # keeps the concatenated batch (and so the target cache) valid
+        self.last = None
+
+    def bind(self, slot, learner):
+        with self.cond:
+            self.learners[slot] = learner
+        return partial(self.train, slot)
+
+    def train(self, slot, batch, t_env, episode_num):
+        with self.cond:
+            self.pending[slot] = (batch, t_env, episode_num)
+            generation = self.generation
+            if not self._maybe_step():
+                self.cond.wait_for(lambda: self.generation != generation)
+            if self.error is not None:
+                raise RuntimeError("Batched train step failed") from self.error
+
+    def leave(self, slot):
+        with self.cond:
+            self.active.discard(slot)
+            self._maybe_step()
+
+    def _maybe_step(self):
+        if not self.pending or set(self.pending) != self.active:
+            return False
+        slots = sorted(self.pending)
+        try:
+            if len(slots) == 1:
+                batch, t_env, episode_num = self.pending[slots[0]]
+                self.learners[slots[0]].train(batch, t_env, episode_num)
+            else:
+                self._step(slots)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.pending.clear()
+            self.generation += 1
+            self.cond.notify_all()
+        return True
+
+    def _step(self, slots):
+        from learners.seed_batched_q_learner import SeedBatchedQLearner
+        learners = [self.learners[s] for s in slots]
+        if self.batched is None or self.batched.learners != learners:
+            self.batched = SeedBatchedQLearner(learners)
+        samples = [self.pending[s][0] for s in slots]
+        if self.last is None or len(self.last[0]) != len(samples) or \
+                any(a is not b for a, b in zip(self.last[0], samples)):
+            self.last = (samples, EpisodeBatch.cat(samples))
+        self.batched.train(self.last[1], [self.pending[s][1] for s in slots], [self.pending[s][2] for s in slots])
+
+
+def _batchable(config):
+    """Configs whose train step SeedBatchedQLearner computes like QLearner.train."""
+    return config["learner"] == "q_learner" and config.get("mixer") is not None and \
+        not config.get("local_constraint", False) and not config.get("test_gt_factors", False)
+
+
+def _train_seed(run_sequential, args, logger, preempted, trainer, slot):
+    bind_learner = None if trainer is None else partial(trainer.bind, slot)
+    try:
+        run_sequential(args=args, logger=logger, preempted=preempted, bind_learner=bind_learner)
+    except Exception:
+        # the other seeds go on
+        logger.console_logger.exception("Seed {} failed".format(args.seed))
+    finally:
+        if trainer is not None:
+            trainer.leave(slot)
+        logger.close()
+
+
+def run_seeds(_run, _config, _log, run_sequential):
+    n_seeds = _config["n_seeds"]
+    assert not (_config["evaluate"] or _config["save_replay"] or _config["evaluate_multi_model"]), \
+        "n_seeds > 1 is only supported for training"
+    if not _config["worker_start_method"]:
+        # forking a process that runs several threads can copy held locks into the child
+        _config["worker_start_method"] = "forkserver"
+    trainer = SeedBatchedTrainer(n_seeds) if _batchable(_config) else None
+    if trainer is None:
+        _log.warning("learner {} trains its seeds independently, only q_learner batches them".format(
+            _config["learner"]))
+        # the seeds' train steps run concurrently, split the intra-op thread pool between them
+        th.set_num_threads(max(1, th.get_num_threads() // n_seeds))
+
+    token = "{}__{}".format(_config["name"], datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f"))
+    # one SIGTERM handler (signals only reach the main thread) stops every seed
+    preempted = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: preempted.append(signum))
+
+    threads = []
+    for k in range(n_seeds):
+        config = deepcopy(_config)
+        config["seed"] = _config["seed"] + k
+        config["env_args"]["seed"] = config["seed"]
+        if config["checkpoint_path"]:
+            config["checkpoint_path"] = "{}_seed{}".format(_config["checkpoint_path"], config["seed"])
+        args = SN(**config)
+        args.device = "cuda" if args.use_cuda else "cpu"
+        args.unique_token = "{}_seed{}".format(token, args.seed)
+
+        logger = Logger(_log.getChild("seed{}".format(args.seed)), history=args.logger_history,
+                        async_writes=args.logger_async)
+        logger.setup_profiling(args.profile_timings, args.profile_sync_cuda)
+        if args.use_tensorboard:
+            tb_logs_direc = os.path.join(dirname(dirname(dirname(abspath(__file__)))), "results", args.tb_dirname)
+            logger.setup_tb(os.path.join(tb_logs_direc, args.unique_token))
+        logger.setup_sacred(_run, prefix="seed{}_".format(args.seed))
+        if args.metrics_port:
+            logger.setup_metrics_server(args.metrics_port + k, args.metrics_host, run_label=args.unique_token)
+
+        threads.append(threading.Thread(target=_train_seed,
+                                        args=(run_sequential, args, logger, preempted, trainer, k),
+                                        name="Seed{}".format(args.seed)))
+
+    _log.info("Training seeds {} to {} in one process".format(_config["seed"], _config["seed"] + n_seeds - 1))
+    for t in threads:
+        t.start()
+    # join with a timeout, so the main thread keeps handling SIGTERM
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=1)
+    _log.info("All {} seeds finished".format(n_seeds))
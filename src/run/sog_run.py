@@ -1,11 +1,11 @@
 import datetime
 from functools import partial
 from math import ceil
-import imageio
 import os
 import os.path as osp
 import numpy as np
 import pprint
+import signal
 import time
 import json
 import threading
@@ -14,13 +14,20 @@ import torch as th
 from numpy.random import RandomState
 from types import SimpleNamespace as SN
 from utils.logging import Logger
+from utils.profiling import StepProfiler
+from utils.memory import available_memory, format_bytes, log_memory_report
 from utils.timehelper import time_left, time_str
+from utils.trajectory import TrajectoryRecorder
+from utils.checkpoint import (find_verified_checkpoint, AsyncCheckpointer, training_checkpoint,
+                              checkpoint_metrics, is_training_checkpoint, restore_training_checkpoint)
 from os.path import dirname, abspath, basename, join, splitext
 
 from learners import REGISTRY as le_REGISTRY
 from runners import REGISTRY as r_REGISTRY
 from controllers import REGISTRY as mac_REGISTRY
-from envs import s_REGISTRY
+from controllers.policy_export import export_policy
+from controllers.quantization import greedy_action_agreement
+from envs import scenario_dict
 from components.episode_buffer import ReplayBuffer
 from components.transforms import OneHot
 
@@ -29,11 +36,18 @@ def run(_run, _config, _log):
     # check args sanity
     _config = args_sanity_check(_config, _log)
 
+    if _config["n_seeds"] > 1:
+        # several seeds on threads of this process, see run/multi_seed.py
+        from run.multi_seed import run_seeds
+        run_seeds(_run, _config, _log, run_sequential)
+        os._exit(os.EX_OK)
+
     args = SN(**_config)
     args.device = "cuda" if args.use_cuda else "cpu"
 
     # setup loggers
-    logger = Logger(_log)
+    logger = Logger(_log, history=args.logger_history, async_writes=args.logger_async)
+    logger.setup_profiling(args.profile_timings, args.profile_sync_cuda)
 
     _log.info("Experiment Parameters:")
     experiment_params = pprint.pformat(_config,
@@ -53,78 +67,28 @@ def run(_run, _config, _log):
     # sacred is on by default
     logger.setup_sacred(_run)
 
+    if args.metrics_port:
+        logger.setup_metrics_server(args.metrics_port, args.metrics_host, run_label=unique_token)
+
     # Run and train
-    if args.evaluate_multi_model:
-        model_dir = deepcopy(args.checkpoint_path.split(","))
-        if "sight_range_kind" in args.env_args.keys():
-            sight_ranges = deepcopy(args.env_args["sight_range_kind"])
+    try:
+        if args.evaluate_multi_model:
+            # all checkpoints x sight ranges on one set of env workers, see run/evaluate.py
+            from run.evaluate import evaluate_sweep
+            evaluate_sweep(args, logger)
         else:
-            sight_ranges = [0,1,2,3]
-        args.evaluate=True
-        rm_dic={}
-        sc2_sr_kind_dict = {0:3, 1:3, 2:9, 3:9}
-        sc2_group_kind_dict = {0:True, 1:False, 2:True, 3:False}
-        for sr in sight_ranges:
-            rmm = []
-            for md in model_dir:
-                args.checkpoint_path = osp.join(args.checkpoint_prefix, md)
-                if "sc2" in args.env:
-                    args.env_args["sight_range"] = sc2_sr_kind_dict[sr]
-                    args.env_args["divide_group"] = sc2_group_kind_dict[sr]
-                else:
-                    args.env_args["sight_range_kind"] = sr
-                rm = run_sequential(args=args, logger=logger)
-                print("model:", md, ", sight range:", sr, ", return mean:", rm)
-                rm_dic.update({(md, sr):rm})
-                rmm.append(rm)
-            # Clean up after finishing
-                print("Exiting Main")
-
-                print("Stopping all threads")
-                for t in threading.enumerate():
-                    if t.name != "MainThread":
-                        print("Thread {} is alive! Is daemon: {}".format(t.name, t.daemon))
-                        t.join(timeout=1)
-                        print("Thread joined")
-            rm_dic.update({('Average', sr):np.mean(rmm)})
-        for (md, sr), rm in rm_dic.items():
-            print("model:", md, ", sight range:", sr, ", return mean:", rm)
-        # model_dir = deepcopy(args.checkpoint_path.split(","))
-        # sight_ranges = deepcopy(args.env_args["sight_range_kind"])
-        # args.evaluate=True
-        # rm_dic={}
-        # for sr in sight_ranges:
-        #     rmm = []
-        #     for md in model_dir:
-        #         args.checkpoint_path = osp.join(args.checkpoint_prefix, md)
-        #         args.env_args["sight_range_kind"] = sr
-        #         rm = run_sequential(args=args, logger=logger)
-        #         print("model:", md, ", sight range:", sr, ", return mean:", rm)
-        #         rm_dic.update({(md, sr):rm})
-        #         rmm.append(rm)
-        #     # Clean up after finishing
-        #         print("Exiting Main")
-
-        #         print("Stopping all threads")
-        #         for t in threading.enumerate():
-        #             if t.name != "MainThread":
-        #                 print("Thread {} is alive! Is daemon: {}".format(t.name, t.daemon))
-        #                 t.join(timeout=1)
-        #                 print("Thread joined")
-        #     rm_dic.update({('Average', sr):np.mean(rmm)})
-        # for (md, sr), rm in rm_dic.items():
-        #     print("model:", md, ", sight range:", sr, ", return mean:", rm)
-    else:
-        run_sequential(args=args, logger=logger)
-        print("Exiting Main")
-
-        print("Stopping all threads")
-        for t in threading.enumerate():
-            if t.name != "MainThread":
-                print("Thread {} is alive! Is daemon: {}".format(t.name, t.daemon))
-                t.join(timeout=1)
-                print("Thread joined")
-
+            run_sequential(args=args, logger=logger)
+            print("Exiting Main")
+
+            print("Stopping all threads")
+            for t in threading.enumerate():
+                if t.name != "MainThread":
+                    print("Thread {} is alive! Is daemon: {}".format(t.name, t.daemon))
+                    t.join(timeout=1)
+                    print("Thread joined")
+    finally:
+        # write out whatever is still queued for tensorboard / sacred, also when training fails
+        logger.close()
     print("Exiting script")
 
     # Making sure framework really exits
@@ -141,6 +105,7 @@ def evaluate_sequential(args, runner, logger):
         else:
             vid_basename = ''.join(vid_basename_split) + '.mp4'
         vid_filename = join(dirname(args.video_path), vid_basename)
+        import imageio
         vw = imageio.get_writer(vid_filename, format='FFMPEG', mode='I',
                                 fps=args.fps, codec='h264', quality=10)
 
@@ -164,6 +129,12 @@ def evaluate_sequential(args, runner, logger):
     else:
         n_scen = 1
     n_test_batches = max(1, args.test_nepisode // runner.batch_size)
+    recorder = None
+    if args.record_trajectories:
+        # videos / plots are made from it afterwards: python -m tools.render_trajectories <path>
+        traj_path = os.path.join(args.local_results_path, "trajectories", args.unique_token, str(runner.t_env))
+        recorder = TrajectoryRecorder(traj_path, args, runner, chunk_size=args.attn_dump_chunk_size,
+                                      compress=args.attn_dump_compress)
 
     for i in range(n_scen):
         run_args = {'test_mode': True, 'vid_writer': vw,
@@ -171,7 +142,12 @@ def evaluate_sequential(args, runner, logger):
         if args.eval_all_scen:
             run_args['index'] = i
         for _ in range(n_test_batches):
-            runner.run(**run_args)
+            batch = runner.run(**run_args)
+            if recorder is not None:
+                recorder.append(batch)
+        if args.quantize_actor:
+            logger.log_stat("test_quant_action_agreement",
+                            greedy_action_agreement(runner.mac, runner.actor_mac, batch), runner.t_env)
         rm = runner.rm
         curr_stats = dict((k, v[-1][1]) for k, v in logger.stats.items())
         if args.eval_all_scen:
@@ -188,6 +164,10 @@ def evaluate_sequential(args, runner, logger):
     if vw is not None:
         vw.close()
 
+    if recorder is not None:
+        recorder.close()
+        logger.console_logger.info("Saved trajectories of {} episodes to {}".format(recorder.n_episodes, traj_path))
+
     if args.eval_path is not None:
         with open(eval_filename, 'w') as f:
             json.dump(res_dict, f)
@@ -200,12 +180,26 @@ def evaluate_sequential(args, runner, logger):
     return rm 
 
 
-def run_sequential(args, logger):
+def run_sequential(args, logger, preempted=None, bind_learner=None):
+    """
+    preempted: list shared with a SIGTERM handler installed by the caller (run_seeds),
+        by default run_sequential installs its own
+    bind_learner: called with the learner, returns the function that replaces
+        learner.train (run_seeds batches the train steps of its seeds)
+    """
     '''
     : params:
     args: SimpleNamespace | contains parameters
     logger: utils.logging.Logger | just a logger
     '''
+    if args.checkpoint_path != "" and (args.evaluate or args.save_replay):
+        # evaluation only, no replay buffer or learner
+        from run.evaluate import eval_checkpoints
+        rm = None
+        for runner, _ in eval_checkpoints(args, logger):
+            rm = evaluate_sequential(args, runner, logger)
+        return rm
+
     # Init runner so we can get env info
     if 'entity_scheme' in args.env_args:
         args.entity_scheme = args.env_args['entity_scheme']
@@ -214,7 +208,17 @@ def run_sequential(args, logger):
 
     if ('sc2custom' in args.env):
         rs = RandomState(0)
-        args.env_args['scenario_dict'] = s_REGISTRY[args.scenario](rs=rs)
+        args.env_args['scenario_dict'] = scenario_dict(args.scenario, args.scenario_cache_dir, rs=rs)
+        if 'scenario_set_hash' in args.env_args['scenario_dict']:
+            logger.console_logger.info("Scenario set {}: {} scenarios, hash {}".format(
+                args.scenario, len(args.env_args['scenario_dict']['scenarios']),
+                args.env_args['scenario_dict']['scenario_set_hash']))
+    # preemption: save a full checkpoint at the end of the current iteration and stop.
+    # Installed before the env workers start, they ignore SIGTERM (see env_worker) so a
+    # group-wide SIGTERM leaves them running until the checkpoint is written
+    if preempted is None:
+        preempted = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: preempted.append(signum))
     runner = r_REGISTRY[args.runner](args=args, logger=logger)
 
     # Set up schemes and groups here
@@ -271,9 +275,18 @@ def run_sequential(args, logger):
         "actions": ("actions_onehot", [OneHot(out_dim=args.n_actions)])
     }
 
+    buffer_device = "cpu" if args.buffer_cpu_only else args.device
+    buffer_bytes = sum(ReplayBuffer.estimate_memory(scheme, groups, args.buffer_size, env_info["episode_limit"] + 1,
+                                                    preprocess=preprocess).values())
+    free_bytes = available_memory(buffer_device)
+    logger.console_logger.info("Replay buffer of {} episodes needs {} on {} ({} free)".format(
+        args.buffer_size, format_bytes(buffer_bytes), buffer_device,
+        "unknown" if free_bytes is None else format_bytes(free_bytes)))
+    if free_bytes is not None and buffer_bytes > free_bytes:
+        logger.console_logger.warning("Replay buffer is larger than the free memory, reduce buffer_size")
     buffer = ReplayBuffer(scheme, groups, args.buffer_size, env_info["episode_limit"] + 1,
                           preprocess=preprocess,
-                          device="cpu" if args.buffer_cpu_only else args.device)
+                          device=buffer_device)
 
     # Setup multiagent controller here
     mac = mac_REGISTRY[args.mac](buffer.scheme, groups, args)
@@ -289,41 +302,37 @@ def run_sequential(args, logger):
 
     if args.use_cuda:
         learner.cuda()
+    train_step = learner.train if bind_learner is None else bind_learner(learner)
 
-    if args.checkpoint_path != "":
-
-        timesteps = []
-        timestep_to_load = 0
+    if args.memory_report:
+        log_memory_report(logger, buffer, learner)
+        if threading.current_thread() is threading.main_thread():
+            # on demand: kill -USR1 <pid>
+            signal.signal(signal.SIGUSR1, lambda signum, frame: log_memory_report(logger, buffer, learner))
 
-        if not os.path.isdir(args.checkpoint_path):
+    resume_state = None
+    if args.checkpoint_path != "":
+        # resume training, evaluation runs go through run/evaluate.py
+        # files are checked against the manifest, a corrupted checkpoint falls back to the one before
+        found = find_verified_checkpoint(args.checkpoint_path, args.load_step, logger)
+        if found is None:
             logger.console_logger.info("Checkpoint directiory {} doesn't exist".format(args.checkpoint_path))
             return
+        model_path, timestep_to_load = found
 
-        # Go through all files in args.checkpoint_path
-        for name in os.listdir(args.checkpoint_path):
-            full_name = os.path.join(args.checkpoint_path, name)
-            # Check if they are dirs the names of which are numbers
-            if os.path.isdir(full_name) and name.isdigit():
-                timesteps.append(int(name))
-        print(args.checkpoint_path)
-
-        if args.load_step == 0:
-            # choose the max timestep
-            timestep_to_load = max(timesteps)
+        if is_training_checkpoint(model_path):
+            logger.console_logger.info("Resuming training state from {}".format(model_path))
+            # seeds sharing the process (n_seeds > 1) also share the global RNGs
+            resume_state = restore_training_checkpoint(model_path, learner, buffer,
+                                                       restore_rng=args.n_seeds <= 1)
         else:
-            # choose the timestep closest to load_step
-            timestep_to_load = min(timesteps, key=lambda x: abs(x - args.load_step))
-
-        model_path = os.path.join(args.checkpoint_path, str(timestep_to_load))
-
-        logger.console_logger.info("Loading model from {}".format(model_path))
-        learner.load_models(model_path, evaluate=args.evaluate)
+            logger.console_logger.info("Loading model from {}".format(model_path))
+            learner.load_models(model_path, evaluate=args.evaluate)
+        if args.export_policy:
+            export_policy(mac, os.path.join(model_path, "policy.pt"), args.export_batch_size)
+        runner.refresh_actor()
         runner.t_env = timestep_to_load
 
-        if args.evaluate or args.save_replay:
-            rm = evaluate_sequential(args, runner, logger)
-            return rm
-
     # start training
     episode = 0
     last_test_T = -args.test_interval - 1
@@ -333,34 +342,64 @@ def run_sequential(args, logger):
     start_time = time.time()
     last_time = start_time
 
+    # torch.profiler captures of chosen learner / rollout steps, see utils/profiling.py
+    profile_dir = os.path.join(args.local_results_path, "profiles", args.unique_token)
+    learner_profiler = StepProfiler("learner", args.profile_learner_steps, profile_dir, args.use_cuda, logger)
+    rollout_profiler = StepProfiler("rollout", args.profile_rollout_steps, profile_dir, args.use_cuda, logger)
+
+    learner_updates = 0
+    if resume_state is not None:
+        # exact resume from a full training checkpoint
+        runner.t_env = resume_state["t_env"]
+        episode = resume_state["episode"]
+        last_test_T = resume_state["last_test_T"]
+        last_log_T = resume_state["last_log_T"]
+        model_save_time = resume_state["model_save_time"]
+        learner_updates = resume_state["learner_updates"]
+        if resume_state.get("scenario_sampler") is not None and runner.scenario_sampler is not None:
+            runner.scenario_sampler.load_state_dict(resume_state["scenario_sampler"])
+
+    checkpointer = AsyncCheckpointer(logger, async_writes=args.checkpoint_async,
+                                     keep_last=args.checkpoint_keep_last, keep_best=args.checkpoint_keep_best,
+                                     best_metric=args.checkpoint_best_metric)
     logger.console_logger.info("Beginning training for {} timesteps".format(args.t_max))
 
     while runner.t_env <= args.t_max:
 
         # Run for a whole episode at a time
-        episode_batch = runner.run(test_mode=False)
+        with rollout_profiler.step():
+            episode_batch = runner.run(test_mode=False)
         if args.mac  == "rlcomm_mac":
             # train elector
             max_ep_t = episode_batch.max_t_filled()
             episode_sample = episode_batch[:,:max_ep_t]
             learner.train_elector(episode_sample, runner.t_env, episode)
+            runner.refresh_actor()
             # delete header selection info after training the elector
             episode_batch.pop("head_probs")
             episode_batch.pop("head_actions")
         buffer.insert_episode_batch(episode_batch)
 
         if buffer.can_sample(args.batch_size):
+            episode_sample = None
             for _ in range(args.training_iters):
-                episode_sample = buffer.sample(args.batch_size)
+                with learner_profiler.step():
+                    if episode_sample is None or not args.reuse_sample:
+                        with logger.timer("buffer_sample"):
+                            episode_sample = buffer.sample(args.batch_size)
 
-                # Truncate batch to only filled timesteps
-                max_ep_t = episode_sample.max_t_filled()
-                episode_sample = episode_sample[:, :max_ep_t]
+                            # Truncate batch to only filled timesteps
+                            max_ep_t = episode_sample.max_t_filled()
+                            episode_sample = episode_sample[:, :max_ep_t]
 
-                if episode_sample.device != args.device:
-                    episode_sample.to(args.device)
+                        if episode_sample.device != args.device:
+                            with logger.timer("h2d_copy"):
+                                episode_sample.to(args.device)
 
-                learner.train(episode_sample, runner.t_env, episode)
+                    train_step(episode_sample, runner.t_env, episode)
+                    learner_updates += 1
+            # the next rollouts act with the new weights
+            runner.refresh_actor()
 
         # Execute test runs once in a while
         n_test_runs = max(1, args.test_nepisode // runner.batch_size)
@@ -376,29 +415,54 @@ def run_sequential(args, logger):
             if args.mac == "rlcomm_mac":
                 mac.elector.eval()
             for _ in range(n_test_runs):
-                runner.run(test_mode=True)
+                test_batch = runner.run(test_mode=True)
+            if args.quantize_actor:
+                # greedy actions of the int8 actor vs. the float mac on the last test episodes
+                logger.log_stat("test_quant_action_agreement",
+                                greedy_action_agreement(mac, runner.actor_mac, test_batch), runner.t_env)
             if args.mac == "rlcomm_mac":
                 mac.elector.train()
-        if args.save_model and (runner.t_env - model_save_time >= args.save_model_interval or
-                                model_save_time == 0 or
-                                runner.t_env > args.t_max):
+        episode += args.batch_size_run
+        if (args.save_model or preempted) and (runner.t_env - model_save_time >= args.save_model_interval or
+                                               model_save_time == 0 or
+                                               runner.t_env > args.t_max or
+                                               preempted):
             model_save_time = runner.t_env
             save_path = os.path.join(args.local_results_path, "models", args.unique_token, str(runner.t_env))
             #"results/models/{}".format(unique_token)
-            os.makedirs(save_path, exist_ok=True)
             logger.console_logger.info("Saving models to {}".format(save_path))
 
-            # learner should handle saving/loading -- delegate actor save/load to mac,
-            # use appropriate filenames to do critics, optimizer states
-            learner.save_models(save_path)
-
-        episode += args.batch_size_run
+            # full training state, written by the checkpointer thread from a CPU snapshot
+            run_state = {"t_env": runner.t_env,
+                         "episode": episode,
+                         "last_test_T": last_test_T,
+                         "last_log_T": last_log_T,
+                         "model_save_time": model_save_time,
+                         "learner_updates": learner_updates,
+                         "scenario_sampler": runner.scenario_sampler.state_dict()
+                         if runner.scenario_sampler is not None else None}
+            checkpointer.save(save_path, training_checkpoint(learner, run_state,
+                                                             buffer if args.checkpoint_buffer else None),
+                              metrics=checkpoint_metrics(logger))
+            if args.export_policy:
+                # into the renamed checkpoint dir, the writer thread must be done with it
+                checkpointer.wait()
+                export_policy(mac, os.path.join(save_path, "policy.pt"), args.export_batch_size)
+
+        logger.update_progress(runner.t_env, episode, learner_updates,
+                               buffer.episodes_in_buffer / buffer.buffer_size)
 
         if (runner.t_env - last_log_T) >= args.log_interval:
             logger.log_stat("episode", episode, runner.t_env)
+            logger.log_timings(runner.t_env)
             logger.print_recent_stats()
             last_log_T = runner.t_env
 
+        if preempted:
+            logger.console_logger.info("Received signal {}, stopping at t_env {}".format(preempted[0], runner.t_env))
+            break
+
+    checkpointer.close()
     runner.close_env()
     logger.console_logger.info("Finished Training")
 
@@ -1,7 +1,8 @@
-REGISTRY = {}
+from utils.registry import LazyRegistry
 
-from .episode_runner import EpisodeRunner
-REGISTRY["episode"] = EpisodeRunner
+# runners are imported on first lookup, see utils/registry.py
+REGISTRY = LazyRegistry()
 
-from .parallel_runner import ParallelRunner
-REGISTRY["parallel"] = ParallelRunner
+REGISTRY["episode"] = "runners.episode_runner:EpisodeRunner"
+
+REGISTRY["parallel"] = "runners.parallel_runner:ParallelRunner"
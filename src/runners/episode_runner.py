@@ -1,6 +1,8 @@
 from envs import REGISTRY as env_REGISTRY
 from functools import partial
 from components.episode_buffer import EpisodeBatch
+from controllers.quantization import quantize_mac
+from components.scenario_sampler import build_scenario_sampler, ScenarioStats, team_sizes
 import numpy as np
 
 
@@ -35,11 +37,27 @@ class EpisodeRunner:
 
         # Log the first run
         self.log_train_stats_t = -1000000
+        # picks the scenario of every training episode (None: the env picks)
+        self.scenario_sampler = build_scenario_sampler(self.args)
+        # per team size stats of test (True) and training (False) episodes
+        self.scenario_stats = {True: ScenarioStats(), False: ScenarioStats()}
+        # keep env.render_geometry of every step in geometry_log, see utils.trajectory
+        self.record_geometry = False
+        self.geometry_log = []
 
     def setup(self, scheme, groups, preprocess, mac):
         self.new_batch = partial(EpisodeBatch, scheme, groups, self.batch_size, self.episode_limit + 1,
                                  preprocess=preprocess, device=self.args.device)
         self.mac = mac
+        # mac used for acting, a quantized copy of self.mac when quantize_actor is set
+        self.refresh_actor()
+
+    def refresh_actor(self):
+        """
+        Call after the weights of self.mac changed (training steps, loading a model):
+        the quantized actor is rebuilt from them on the next run.
+        """
+        self.actor_mac = None if self.args.quantize_actor else self.mac
 
     def get_env_info(self):
         return self.env.get_env_info(self.args)
@@ -50,6 +68,9 @@ class EpisodeRunner:
     def close_env(self):
         self.env.close()
 
+    def configure_envs(self, **env_args):
+        self.env.configure(**env_args)
+
     def reset(self, test=False, index=None, constrain_num=None):
         self.batch = self.new_batch()
         self.env.reset(test=test, index=index, constrain_num=constrain_num)
@@ -91,7 +112,19 @@ class EpisodeRunner:
             constrain_num=self.args.test_map_num if test_mode else self.args.train_map_num
         else:
             constrain_num=None
-        self.reset(test=test_scen, index=index, constrain_num=constrain_num)
+        scenario_key = None
+        if self.scenario_sampler is not None and not test_mode:
+            scenario_key = self.scenario_sampler.sample(1)[0]
+            self.reset(**dict(dict(test=test_scen, index=index, constrain_num=constrain_num),
+                              **self.scenario_sampler.reset_kwargs(scenario_key)))
+        else:
+            self.reset(test=test_scen, index=index, constrain_num=constrain_num)
+        self.geometry_log = []
+        if self.record_geometry:
+            self.geometry_log.append([self.env.render_geometry(**self.args.render_args)])
+        if self.actor_mac is None:
+            # quantized once per weight update, not every run
+            self.actor_mac = quantize_mac(self.mac)
         if vid_writer is not None:
             vid_writer.append_data(self.env.render(**self.args.render_args))
         else:
@@ -99,22 +132,27 @@ class EpisodeRunner:
             self.env.render(**self.args.render_args)
         terminated = False
         episode_return = 0
-        self.mac.init_hidden(batch_size=self.batch_size)
+        self.actor_mac.init_hidden(batch_size=self.batch_size)
         # make sure things like dropout are disabled
-        self.mac.eval()
+        self.actor_mac.eval()
 
         while not terminated:
             pre_transition_data = self._get_pre_transition_data()
 
-            self.batch.update(pre_transition_data, ts=self.t)
+            with self.logger.timer("batch_update"):
+                self.batch.update(pre_transition_data, ts=self.t)
 
             # Pass the entire batch of experiences up till now to the agents
             # Receive the actions for each agent at this timestep in a batch of size 1
-            if self.args.mac == "comm_mac":
-                actions, p_msg, h_msg = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode, ret_msg=True)
-            else:
-                actions = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode)
-            reward, terminated, env_info = self.env.step(actions[0].cpu())
+            with self.logger.timer("select_actions"):
+                if self.args.mac == "comm_mac":
+                    actions, p_msg, h_msg = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode, ret_msg=True)
+                else:
+                    actions = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode)
+            with self.logger.timer("env_step"):
+                reward, terminated, env_info = self.env.step(actions[0].cpu())
+            if self.record_geometry:
+                self.geometry_log.append([self.env.render_geometry(**self.args.render_args)])
             if vid_writer is not None:
                 vid_writer.append_data(self.env.render(**self.args.render_args))
             elif self.args.render:
@@ -130,7 +168,8 @@ class EpisodeRunner:
                 post_transition_data["self_message"] = p_msg
                 post_transition_data["head_message"] = h_msg
 
-            self.batch.update(post_transition_data, ts=self.t)
+            with self.logger.timer("batch_update"):
+                self.batch.update(post_transition_data, ts=self.t)
 
             self.t += 1
 
@@ -139,10 +178,10 @@ class EpisodeRunner:
 
         # Select actions in the last stored state
         if self.args.mac == "comm_mac":
-            actions, p_msg, h_msg = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode, ret_msg=True)
+            actions, p_msg, h_msg = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode, ret_msg=True)
             self.batch.update({"actions": actions, "self_message":p_msg, "head_message": h_msg}, ts=self.t)
         else:
-            actions = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode)
+            actions = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, test_mode=test_mode)
             self.batch.update({"actions": actions}, ts=self.t)
 
         cur_stats = self.test_stats if test_mode else self.train_stats
@@ -154,13 +193,24 @@ class EpisodeRunner:
 
         if not test_mode:
             self.t_env += self.t
+        self.logger.count("env_steps", self.t)
+        self.logger.count("episodes", self.batch_size)
 
         cur_returns.append(episode_return)
+        if scenario_key is not None:
+            self.scenario_sampler.update(scenario_key, episode_return, env_info.get("battle_won"))
+        if self.args.entity_scheme:
+            self.scenario_stats[test_mode].add(team_sizes(self.batch, self.args.n_agents)[0], episode_return,
+                                               env_info.get("battle_won"))
 
         if test_mode and (len(self.test_returns) == self.args.test_nepisode):
             self.rm = self._log(cur_returns, cur_stats, log_prefix)
+            self.scenario_stats[True].log(self.logger, log_prefix, self.t_env)
         elif not test_mode and self.t_env - self.log_train_stats_t >= self.args.runner_log_interval:
             self._log(cur_returns, cur_stats, log_prefix)
+            self.scenario_stats[False].log(self.logger, log_prefix, self.t_env)
+            if self.scenario_sampler is not None:
+                self.scenario_sampler.log(self.logger, self.t_env)
             if hasattr(self.mac.action_selector, "epsilon"):
                 self.logger.log_stat("epsilon", self.mac.action_selector.epsilon, self.t_env)
             self.log_train_stats_t = self.t_env
@@ -1,8 +1,14 @@
 from envs import REGISTRY as env_REGISTRY
 from functools import partial
 from components.episode_buffer import EpisodeBatch
-from multiprocessing import Pipe, Process
+from components.worker_monitor import WorkerMonitor
+from components.scenario_sampler import build_scenario_sampler, ScenarioStats, team_sizes
+from controllers.quantization import quantize_mac
+from envs.multiagent_particle_env.raster import rasterize, tile_frames
+import multiprocessing as mp
 import numpy as np
+import signal
+import time
 import torch as th
 
 
@@ -17,24 +23,27 @@ class ParallelRunner:
 
         # Make subprocesses for the envs
         # TODO: Add a delay when making sc2 envs
-        self.parent_conns, self.worker_conns = zip(*[Pipe() for _ in range(self.batch_size)])
-        env_fn = env_REGISTRY[self.args.env]
+        self.env_fn = env_REGISTRY[self.args.env]
         # if ('sc2' in self.args.env) or ('group_matching' in self.args.env)\
         #      or ('particle' in self.args.env) or ('catch' in self.args.env):
-        base_seed = self.args.env_args.pop('seed')
-        self.ps = [Process(target=env_worker, args=(worker_conn, self.args.entity_scheme,
-                                                    CloudpickleWrapper(partial(env_fn, seed=base_seed + rank,
-                                                                                **self.args.env_args))))
-                    for rank, worker_conn in enumerate(self.worker_conns)]
-        self.args.env_args['seed']=base_seed
+        self.base_seed = self.args.env_args['seed']
+        self.mp_context = self._worker_context()
+        self.monitor = WorkerMonitor(self.batch_size,
+                                     straggler_factor=self.args.straggler_factor,
+                                     straggler_patience=self.args.straggler_patience)
+        start = time.perf_counter()
+        self.parent_conns, self.ps = map(list, zip(*[self._start_worker(self.base_seed + rank)
+                                                     for rank in range(self.batch_size)]))
+        self._await_workers(range(self.batch_size))
+        self.logger.console_logger.info("Started {} env workers ({}) in {:.2f}s, per worker startup {}".format(
+            self.batch_size, self.mp_context.get_start_method(), time.perf_counter() - start,
+            self.monitor.startup_summary()))
         # else:
         #     self.ps = [Process(target=env_worker, args=(worker_conn, self.args.entity_scheme,
         #                                                 CloudpickleWrapper(partial(env_fn, env_args=self.args.env_args, args=self.args))))
         #                for worker_conn in self.worker_conns]
-
-        for p in self.ps:
-            p.daemon = True
-            p.start()
+        # number of times each worker process was replaced, see _recycle_worker
+        self.n_recycles = [0 for _ in range(self.batch_size)]
 
         # TODO: Close stuff if appropriate
 
@@ -54,16 +63,90 @@ class ParallelRunner:
 
         self.log_train_stats_t = -100000
         self.n_agents = self.env_info["n_agents"]
+        # whether the workers send frame geometry, see _set_render
+        self.rendering = False
+        self.geometries = [None] * self.batch_size
+        # picks the scenario of every training episode (None: the envs pick)
+        self.scenario_sampler = build_scenario_sampler(self.args)
+        # per team size stats of test (True) and training (False) episodes
+        self.scenario_stats = {True: ScenarioStats(), False: ScenarioStats()}
+        # keep the geometries of every step in geometry_log, see utils.trajectory
+        self.record_geometry = False
+        self.geometry_log = []
 
     def setup(self, scheme, groups, preprocess, mac):
         self.new_batch = partial(EpisodeBatch, scheme, groups, self.batch_size, self.episode_limit + 1,
                                  preprocess=preprocess, device=self.args.device)
         self.mac = mac
+        # mac used for acting, a quantized copy of self.mac when quantize_actor is set
+        self.refresh_actor()
         # TODO: Remove these if the runner doesn't need them
         self.scheme = scheme
         self.groups = groups
         self.preprocess = preprocess
 
+    def _worker_context(self):
+        """
+        multiprocessing context the env workers are started with (worker_start_method,
+        platform default if empty). With "forkserver", the forkserver process imports
+        this module, the env module and worker_preload once, and every worker is forked
+        from it: workers start without re-importing torch / pysc2 and without
+        inheriting the parent's CUDA state.
+        """
+        start_method = self.args.worker_start_method or None
+        ctx = mp.get_context(start_method)
+        if start_method == "forkserver":
+            # "__main__" keeps the workers from re-importing main.py (and sacred) each
+            preload = ["__main__", __name__] + list(self.args.worker_preload)
+            env = getattr(self.env_fn, "keywords", {}).get("env")
+            if isinstance(env, str):
+                preload.append(env.split(":")[0])
+            # only applies if the forkserver is not running yet (first runner of the process)
+            ctx.set_forkserver_preload(preload)
+        return ctx
+
+    def _start_worker(self, seed):
+        parent_conn, worker_conn = self.mp_context.Pipe()
+        env_args = dict(self.args.env_args, seed=seed)
+        p = self.mp_context.Process(target=env_worker,
+                                    args=(worker_conn, self.args.entity_scheme,
+                                          CloudpickleWrapper(partial(self.env_fn, **env_args)), time.time()))
+        p.daemon = True
+        p.start()
+        return parent_conn, p
+
+    def _await_workers(self, ranks):
+        """Wait until the workers in `ranks` have built their envs and record their startup times."""
+        for rank in ranks:
+            self.monitor.record_startup(rank, *self.parent_conns[rank].recv()["startup"])
+
+    def _recycle_worker(self, rank):
+        """
+        Replace the process of worker `rank` with a fresh one (new env instance and seed).
+        Only called between runs, when every worker is waiting for a command.
+        """
+        self.logger.console_logger.warning("Recycling env worker {} (pid {})".format(rank, self.ps[rank].pid))
+        self.parent_conns[rank].send(("close", None))
+        self.ps[rank].join(timeout=30)
+        if self.ps[rank].is_alive():
+            # workers ignore SIGTERM, see env_worker
+            self.ps[rank].kill()
+            self.ps[rank].join(timeout=10)
+        self.parent_conns[rank].close()
+        self.n_recycles[rank] += 1
+        seed = self.base_seed + rank + self.batch_size * self.n_recycles[rank]
+        self.parent_conns[rank], self.ps[rank] = self._start_worker(seed)
+        self.monitor.reset_worker(rank)
+        self._await_workers([rank])
+        self.logger.log_stat("recycled_workers", sum(self.n_recycles), self.t_env)
+
+    def refresh_actor(self):
+        """
+        Call after the weights of self.mac changed (training steps, loading a model):
+        the quantized actor is rebuilt from them on the next run.
+        """
+        self.actor_mac = None if self.args.quantize_actor else self.mac
+
     def get_env_info(self):
         return self.env_info
 
@@ -74,17 +157,48 @@ class ParallelRunner:
         for parent_conn in self.parent_conns:
             parent_conn.send(("close", None))
 
-    def reset(self, **kwargs):
+    def configure_envs(self, **env_args):
+        """Change env args of the running envs (see MultiAgentEnv.configure), keeping the workers."""
+        for parent_conn in self.parent_conns:
+            parent_conn.send(("configure", env_args))
+        for parent_conn in self.parent_conns:
+            parent_conn.recv()
+
+    def _set_render(self, render):
+        """
+        Have the workers send the frame geometry (env.render_geometry) with every reset
+        and step reply, or stop sending it. Frames are rasterized here, batched over envs.
+        """
+        if render == self.rendering:
+            return
+        if render:
+            # MultiAgentEnv.render_geometry raises in the workers for the other envs
+            assert "particle" in self.args.env, \
+                "ParallelRunner only renders particle envs (render_geometry), not {}".format(self.args.env)
+        for parent_conn in self.parent_conns:
+            parent_conn.send(("render", self.args.render_args if render else None))
+        for parent_conn in self.parent_conns:
+            parent_conn.recv()
+        self.rendering = render
+
+    def reset(self, per_env_kwargs=None, **kwargs):
+        """per_env_kwargs: list of reset kwargs for each env, on top of kwargs"""
         self.batch = self.new_batch()
 
         # Reset the envs
-        for parent_conn in self.parent_conns:
-            parent_conn.send(("reset", kwargs))
+        for idx, parent_conn in enumerate(self.parent_conns):
+            if per_env_kwargs is not None:
+                parent_conn.send(("reset", dict(kwargs, **per_env_kwargs[idx])))
+            else:
+                parent_conn.send(("reset", kwargs))
 
         pre_transition_data = {}
+        self.geometries = [None] * self.batch_size
         # Get the obs, state and avail_actions back
-        for parent_conn in self.parent_conns:
+        for idx, parent_conn in enumerate(self.parent_conns):
             data = parent_conn.recv()
+            self.monitor.record(idx, "reset", *data.pop("profile"))
+            self.geometries[idx] = data.pop("geometry", None)
             for k, v in data.items():
                 if k in pre_transition_data:
                     pre_transition_data[k].append(data[k])
@@ -100,94 +214,113 @@ class ParallelRunner:
         """
         test_mode: whether to use greedy action selection or sample actions
         test_scen: whether to run on test scenarios. defaults to matching test_mode.
-        vid_writer: imageio video writer object (not supported in parallel runner)
+        vid_writer: imageio video writer object, gets one frame per step with the envs
+                    of the batch tiled in a grid (envs that finished keep their last frame)
         """
         if test_scen is None:
             test_scen = test_mode
-        assert vid_writer is None, "Writing videos not supported for ParallelRunner"
+        self._set_render(vid_writer is not None or self.record_geometry)
         if self.args.test_unseen:
             constrain_num=self.args.test_map_num if test_mode else self.args.train_map_num
         else:
             constrain_num=None
+        scenario_keys = None
+        if self.scenario_sampler is not None and not test_mode:
+            scenario_keys = self.scenario_sampler.sample(self.batch_size)
         if self.args.env == "traffic_junction":
             self.reset(t_env=self.t_env)
+        elif scenario_keys is not None:
+            self.reset(per_env_kwargs=[self.scenario_sampler.reset_kwargs(k) for k in scenario_keys],
+                       test=test_scen, index=index, constrain_num=constrain_num)
         else:
             self.reset(test=test_scen, index=index, constrain_num=constrain_num)
+        self.geometry_log = [list(self.geometries)] if self.record_geometry else []
+        if vid_writer is not None:
+            frames = rasterize(self.geometries, size=self.args.render_args.get("size", 700))
+            vid_writer.append_data(tile_frames(frames))
+
+        if self.actor_mac is None:
+            # quantized once per weight update, not every run
+            self.actor_mac = quantize_mac(self.mac)
 
         all_terminated = False
         episode_returns = [0 for _ in range(self.batch_size)]
         episode_lengths = [0 for _ in range(self.batch_size)]
-        self.mac.init_hidden(batch_size=self.batch_size)
+        self.actor_mac.init_hidden(batch_size=self.batch_size)
         # make sure things like dropout are disabled
         if test_mode:
-            self.mac.eval()
+            self.actor_mac.eval()
         else:
-            self.mac.train()
+            self.actor_mac.train()
         terminated = [False for _ in range(self.batch_size)]
         envs_not_terminated = [b_idx for b_idx, termed in enumerate(terminated) if not termed]
         final_env_infos = []  # may store extra stats like battle won. this is filled in ORDER OF TERMINATION
+        episode_won = [None for _ in range(self.batch_size)]
 
         while True:
 
             # Pass the entire batch of experiences up till now to the agents
             # Receive the actions for each agent at this timestep in a batch for each un-terminated env
             # TODO: find a bug here
-            if self.args.mac == "comm_mac" or self.args.mac=="heucomm_mac" or self.args=="dppcomm_mac":
-                actions, p_msg, h_msg = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, bs=envs_not_terminated, test_mode=test_mode, ret_msg=True)
-                cpu_actions = actions.to("cpu").numpy()
-                cpu_p_msg = p_msg.detach().cpu().numpy()
-                cpu_h_msg = h_msg.detach().cpu().numpy()
-                actions_chosen = {
-                    "actions": actions.unsqueeze(1),
-                    "self_message": cpu_p_msg,
-                    "head_message": cpu_h_msg
-                }
-            elif self.args.mac == "rlcomm_mac":
-                actions, p_msg, h_msg, head_prob, election_actions = self.mac.select_actions(
-                    self.batch, t_ep = self.t, t_env = self.t_env, bs=envs_not_terminated,
-                    test_mode=test_mode, ret_msg=True)
-                cpu_actions = actions.to("cpu").numpy()
-                cpu_p_msg = p_msg.detach().cpu().numpy()
-                cpu_h_msg = h_msg.detach().cpu().numpy()
-                actions_chosen = {
-                    "actions": actions.unsqueeze(1),
-                    "self_message": cpu_p_msg,
-                    "head_message": cpu_h_msg
-                }
-                # TODO: complete here???
-                if head_prob is None:
-                    bs = len(envs_not_terminated)
-                    head_chosen = {
-                        "head_probs": -1.0*np.ones((bs, 1)).astype(np.float32),
-                        "head_actions": np.ones((bs, self.env_info["n_agents"])).astype(np.float32)
+            with self.logger.timer("select_actions"):
+                if self.args.mac == "comm_mac" or self.args.mac=="heucomm_mac" or self.args=="dppcomm_mac":
+                    actions, p_msg, h_msg = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, bs=envs_not_terminated, test_mode=test_mode, ret_msg=True)
+                    cpu_actions = actions.to("cpu").numpy()
+                    cpu_p_msg = p_msg.detach().cpu().numpy()
+                    cpu_h_msg = h_msg.detach().cpu().numpy()
+                    actions_chosen = {
+                        "actions": actions.unsqueeze(1),
+                        "self_message": cpu_p_msg,
+                        "head_message": cpu_h_msg
                     }
-                else:
-                    # TODO: we needs bp here
-                    head_chosen = {
-                        "head_probs": head_prob[envs_not_terminated],
-                        "head_actions": election_actions[envs_not_terminated], 
+                elif self.args.mac == "rlcomm_mac":
+                    actions, p_msg, h_msg, head_prob, election_actions = self.actor_mac.select_actions(
+                        self.batch, t_ep = self.t, t_env = self.t_env, bs=envs_not_terminated,
+                        test_mode=test_mode, ret_msg=True)
+                    cpu_actions = actions.to("cpu").numpy()
+                    cpu_p_msg = p_msg.detach().cpu().numpy()
+                    cpu_h_msg = h_msg.detach().cpu().numpy()
+                    actions_chosen = {
+                        "actions": actions.unsqueeze(1),
+                        "self_message": cpu_p_msg,
+                        "head_message": cpu_h_msg
                     }
-                actions_chosen.update(head_chosen)
-            else:
-                if self.args.save_entities_and_attn_weights:
-                    actions = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, bs=envs_not_terminated, test_mode=test_mode, ret_attn_weights=True)
+                    # TODO: complete here???
+                    if head_prob is None:
+                        bs = len(envs_not_terminated)
+                        head_chosen = {
+                            "head_probs": -1.0*np.ones((bs, 1)).astype(np.float32),
+                            "head_actions": np.ones((bs, self.env_info["n_agents"])).astype(np.float32)
+                        }
+                    else:
+                        # TODO: we needs bp here
+                        head_chosen = {
+                            "head_probs": head_prob[envs_not_terminated],
+                            "head_actions": election_actions[envs_not_terminated], 
+                        }
+                    actions_chosen.update(head_chosen)
                 else:
-                    actions = self.mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, bs=envs_not_terminated, test_mode=test_mode)
-                cpu_actions = actions.to("cpu").numpy()
-
-            # Update the actions taken
-                actions_chosen = {
-                    "actions": actions.unsqueeze(1)
-                }
-            self.batch.update(actions_chosen, bs=envs_not_terminated, ts=self.t, mark_filled=False)
+                    if self.args.save_entities_and_attn_weights:
+                        actions = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, bs=envs_not_terminated, test_mode=test_mode, ret_attn_weights=True)
+                    else:
+                        actions = self.actor_mac.select_actions(self.batch, t_ep=self.t, t_env=self.t_env, bs=envs_not_terminated, test_mode=test_mode)
+                    cpu_actions = actions.to("cpu").numpy()
+
+                # Update the actions taken
+                    actions_chosen = {
+                        "actions": actions.unsqueeze(1)
+                    }
+            with self.logger.timer("batch_update"):
+                self.batch.update(actions_chosen, bs=envs_not_terminated, ts=self.t, mark_filled=False)
 
             # Send actions to each env
             action_idx = 0
-            for idx, parent_conn in enumerate(self.parent_conns):
-                if idx in envs_not_terminated: # We produced actions for this env
-                    if not terminated[idx]: # Only send the actions to the env if it hasn't terminated
-                        parent_conn.send(("step", cpu_actions[action_idx]))
-                    action_idx += 1 # actions is not a list over every env
+            with self.logger.timer("pipe_send"):
+                for idx, parent_conn in enumerate(self.parent_conns):
+                    if idx in envs_not_terminated: # We produced actions for this env
+                        if not terminated[idx]: # Only send the actions to the env if it hasn't terminated
+                            parent_conn.send(("step", cpu_actions[action_idx]))
+                        action_idx += 1 # actions is not a list over every env
 
             # Post step data we will insert for the current timestep
             post_transition_data = {
@@ -217,9 +350,16 @@ class ParallelRunner:
                 break
 
             # Receive data back for each unterminated env
+            stepped = []
             for idx, parent_conn in enumerate(self.parent_conns):
                 if not terminated[idx]:
-                    data = parent_conn.recv()
+                    # includes waiting for the worker's env.step
+                    with self.logger.timer("pipe_recv"):
+                        data = parent_conn.recv()
+                    self.monitor.record(idx, "step", *data["profile"])
+                    if self.rendering:
+                        stepped.append(idx)
+                        self.geometries[idx] = data["geometry"]
                     # Remaining data for this current timestep
                     post_transition_data["reward"].append((data["reward"],))
 
@@ -231,6 +371,7 @@ class ParallelRunner:
                     env_terminated = False
                     if data["terminated"]:
                         final_env_infos.append(data["info"])
+                        episode_won[idx] = data["info"].get("battle_won")
                     if data["terminated"] and not data["info"].get("episode_limit", False):
                         env_terminated = True
                     terminated[idx] = data["terminated"]
@@ -240,19 +381,33 @@ class ParallelRunner:
                     for k in pre_transition_data:
                         pre_transition_data[k].append(data[k])
 
+            if self.record_geometry:
+                # finished envs keep their last geometry, their steps are not filled
+                self.geometry_log.append(list(self.geometries))
+            if vid_writer is not None:
+                # one batched rasterize for the envs that stepped, the others keep their frame
+                with self.logger.timer("render"):
+                    frames[stepped] = rasterize([self.geometries[idx] for idx in stepped],
+                                                size=frames.shape[1])
+                    vid_writer.append_data(tile_frames(frames))
+
             # Add post_transiton data into the batch
-            self.batch.update(post_transition_data, bs=envs_not_terminated, ts=self.t, mark_filled=False)
+            with self.logger.timer("batch_update"):
+                self.batch.update(post_transition_data, bs=envs_not_terminated, ts=self.t, mark_filled=False)
 
             # Move onto the next timestep
             self.t += 1
 
             # Add the pre-transition data
 
-            self.batch.update(pre_transition_data, bs=envs_not_terminated, ts=self.t, mark_filled=True)
+            with self.logger.timer("batch_update"):
+                self.batch.update(pre_transition_data, bs=envs_not_terminated, ts=self.t, mark_filled=True)
 
 
         if not test_mode:
             self.t_env += self.env_steps_this_run
+        self.logger.count("env_steps", sum(episode_lengths))
+        self.logger.count("episodes", self.batch_size)
 
         # Get stats back for each env
         if 'sc2' in self.args.env:
@@ -284,18 +439,32 @@ class ParallelRunner:
 
 
         cur_returns.extend(episode_returns)
+        if scenario_keys is not None:
+            for key, episode_return, won in zip(scenario_keys, episode_returns, episode_won):
+                self.scenario_sampler.update(key, episode_return, won)
+        if self.args.entity_scheme:
+            for team_size, episode_return, won in zip(team_sizes(self.batch, self.n_agents), episode_returns, episode_won):
+                self.scenario_stats[test_mode].add(team_size, episode_return, won)
 
         n_test_runs = max(1, self.args.test_nepisode // self.batch_size) * self.batch_size
         if test_mode and (len(self.test_returns) == n_test_runs):
             self.rm = self._log(cur_returns, cur_stats, log_prefix)
+            self.scenario_stats[True].log(self.logger, log_prefix, self.t_env)
         elif not test_mode and self.t_env - self.log_train_stats_t >= self.args.runner_log_interval:
             self._log(cur_returns, cur_stats, log_prefix)
+            self.scenario_stats[False].log(self.logger, log_prefix, self.t_env)
+            if self.scenario_sampler is not None:
+                self.scenario_sampler.log(self.logger, self.t_env)
             if hasattr(self.mac.action_selector, "epsilon"):
                 self.logger.log_stat("epsilon", self.mac.action_selector.epsilon, self.t_env)
             if 'sc2' in self.args.env:
                 self.logger.log_stat("forced_restarts",
                                      sum(es['restarts'] for es in env_stats),
                                      self.t_env)
+            self.monitor.log(self.logger, self.t_env)
+            if self.args.recycle_stragglers:
+                for rank in self.monitor.chronic_stragglers():
+                    self._recycle_worker(rank)
             self.log_train_stats_t = self.t_env
         return self.batch
 
@@ -334,13 +503,24 @@ class ParallelRunner:
         return visibility, visibility0, visibility1
 
 
-def env_worker(remote, entity_scheme, env_fn):
+def env_worker(remote, entity_scheme, env_fn, launch_time):
+    # SIGTERM goes to the runner process, which stops the workers with "close" once it has
+    # saved its preemption checkpoint. Set explicitly, so workers neither die of a
+    # group-wide SIGTERM nor inherit the runner's Python handler when forked
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
     # Make environment
+    boot_time = time.time()
     env = env_fn.x()
+    ready_time = time.time()
+    # (seconds from Process.start to ready, of which spent building the env), read by WorkerMonitor
+    remote.send({"startup": (ready_time - launch_time, ready_time - boot_time)})
+    # render args while the runner records a video, see ParallelRunner._set_render
+    render_args = None
     while True:
         cmd, data = remote.recv()
         if cmd == "step":
             actions = data
+            start = time.perf_counter()
             # Take a step in the environment
             reward, terminated, env_info = env.step(actions)
             send_dict = {
@@ -366,8 +546,13 @@ def env_worker(remote, entity_scheme, env_fn):
                 # Data for the next timestep needed to pick an action
                 send_dict["state"] = env.get_state()
                 send_dict["obs"] = env.get_obs()
+            # (seconds spent in the step, total SC2 restarts), read by WorkerMonitor
+            send_dict["profile"] = (time.perf_counter() - start, getattr(env, "force_restarts", 0))
+            if render_args is not None:
+                send_dict["geometry"] = env.render_geometry(**render_args)
             remote.send(send_dict)
         elif cmd == "reset":
+            start = time.perf_counter()
             env.reset(**data)
             if entity_scheme:
                 masks = env.get_masks()
@@ -384,13 +569,16 @@ def env_worker(remote, entity_scheme, env_fn):
                 }
                 if gt_mask is not None:
                     send_dict["gt_mask"] = gt_mask
-                remote.send(send_dict)
             else:
-                remote.send({
+                send_dict = {
                     "state": env.get_state(),
                     "avail_actions": env.get_avail_actions(),
                     "obs": env.get_obs()
-                })
+                }
+            send_dict["profile"] = (time.perf_counter() - start, getattr(env, "force_restarts", 0))
+            if render_args is not None:
+                send_dict["geometry"] = env.render_geometry(**render_args)
+            remote.send(send_dict)
         elif cmd == "close":
             env.close()
             remote.close()
@@ -399,6 +587,12 @@ def env_worker(remote, entity_scheme, env_fn):
             remote.send(env.get_env_info(data))
         elif cmd == "get_stats":
             remote.send(env.get_stats())
+        elif cmd == "configure":
+            env.configure(**data)
+            remote.send(None)
+        elif cmd == "render":
+            render_args = data
+            remote.send(None)
         # TODO: unused now?
         # elif cmd == "agg_stats":
         #     agg_stats = env.get_agg_stats(data)
@@ -0,0 +1,2 @@
+# Offline tools are run from src/, e.g.
+#   python -m tools.render_trajectories results/trajectories/<unique_token>/<t_env>
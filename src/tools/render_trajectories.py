@@ -0,0 +1,147 @@
+"""
+Videos and plots of recorded evaluation episodes (record_trajectories=True), made
+offline so evaluation runs at full ParallelRunner speed:
+    video    one mp4 per episode, frames drawn by the numpy rasterizer from the
+             recorded render geometry (particle envs), leaders outlined in black
+    plot     one png per episode: visible fraction of entities, reward and, for SOG
+             runs, number of leaders over the episode
+
+Episodes are split across a pool of worker processes; every worker memory maps the
+dump, so only the records of its episodes are read.
+
+Run from src/:
+    python -m tools.render_trajectories results/trajectories/<unique_token>/<t_env>
+    python -m tools.render_trajectories <path> --what=plot --episodes=0-9 --workers=8
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+
+import numpy as np
+
+from envs.multiagent_particle_env.raster import rasterize
+from utils.attn_dump import SCHEMA_FILE
+from utils.logging import get_logger
+from utils.trajectory import load_trajectories
+
+# leader outline: a ring just outside the agent's circle
+LEADER_RGBA = [0.0, 0.0, 0.0, 1.0]
+
+
+def episode_geometries(records, start, end, n_agents):
+    """render_geometry dicts of the steps of one episode, with rings around the leaders."""
+    geometries = []
+    for i in range(start, end):
+        rings = np.asarray(records["rings"][i])
+        if "head_actions" in records:
+            circles = np.asarray(records["circles"][i][:n_agents])
+            leaders = circles[np.asarray(records["head_actions"][i]) > 0]
+            outline = np.concatenate([leaders[:, :2], leaders[:, 2:3] * 1.3,
+                                      np.tile(LEADER_RGBA, (len(leaders), 1))], axis=1)
+            rings = np.concatenate([rings, outline.astype(rings.dtype)])
+        geometry = {"circles": records["circles"][i], "rings": rings}
+        if "center" in records:
+            geometry["center"] = records["center"][i]
+        geometries.append(geometry)
+    return geometries
+
+
+def render_video(records, episode, start, end, out_dir, size, fps, n_agents):
+    import imageio
+    path = os.path.join(out_dir, "episode_{:06d}.mp4".format(episode))
+    writer = imageio.get_writer(path, format='FFMPEG', mode='I', fps=fps, codec='h264', quality=10)
+    geometries = episode_geometries(records, start, end, n_agents)
+    # rasterize a few steps at a time, frames of a whole episode can be large
+    for i in range(0, len(geometries), 32):
+        for frame in rasterize(geometries[i:i + 32], size=size):
+            writer.append_data(frame)
+    writer.close()
+    return path
+
+
+def render_plot(records, episode, start, end, out_dir, n_agents):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    path = os.path.join(out_dir, "episode_{:06d}.png".format(episode))
+    t = np.asarray(records["t"][start:end])
+    entity_mask = np.asarray(records["entity_mask"][start:end]).astype(bool)
+    obs_mask = np.asarray(records["obs_mask"][start:end]).astype(bool)
+    # masks are 1 where hidden / absent, as in the episode batch
+    present = ~entity_mask
+    seen = (~obs_mask[:, :n_agents]) & present[:, None, :] & present[:, :n_agents, None]
+    visibility = seen.sum((1, 2)) / np.maximum(present[:, :n_agents].sum(1) * present.sum(1), 1)
+    panels = [("visible fraction", visibility), ("reward", np.asarray(records["reward"][start:end]))]
+    if "head_actions" in records:
+        panels.append(("leaders", (np.asarray(records["head_actions"][start:end]) > 0).sum(1)))
+    fig, axes = plt.subplots(len(panels), 1, sharex=True, figsize=(6, 2 * len(panels)))
+    for ax, (label, values) in zip(axes, panels):
+        ax.plot(t, values)
+        ax.set_ylabel(label)
+    axes[-1].set_xlabel("t")
+    fig.suptitle("episode {}".format(episode))
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def _render_episodes(job):
+    path, episodes, opts = job
+    records, ranges = load_trajectories(path)
+    n_agents = records["actions"].shape[1]
+    out = []
+    for episode in episodes:
+        start, end = ranges[episode]
+        if opts["what"] in ("video", "both"):
+            out.append(render_video(records, episode, start, end, opts["out"], opts["size"], opts["fps"], n_agents))
+        if opts["what"] in ("plot", "both"):
+            out.append(render_plot(records, episode, start, end, opts["out"], n_agents))
+    return out
+
+
+def _parse_episodes(spec, available):
+    if spec is None:
+        return sorted(available)
+    episodes = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        episodes += range(int(lo), int(hi or lo) + 1)
+    return [e for e in episodes if e in available]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Videos / plots of recorded evaluation episodes")
+    parser.add_argument("path", help="trajectory dump directory")
+    parser.add_argument("--what", default="video", choices=["video", "plot", "both"])
+    parser.add_argument("--episodes", default=None, help="e.g. 0-9,20, defaults to all")
+    parser.add_argument("--out", default=None, help="output directory, defaults to <path>/render")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--size", type=int, default=700, help="video frame width and height")
+    parser.add_argument("--fps", type=int, default=12)
+    opts = parser.parse_args(argv)
+    console = get_logger()
+
+    _, ranges = load_trajectories(opts.path, columns=["episode"])
+    episodes = _parse_episodes(opts.episodes, ranges)
+    with open(os.path.join(opts.path, SCHEMA_FILE), "r") as f:
+        columns = json.load(f)["columns"]
+    if opts.what in ("video", "both") and "circles" not in columns:
+        console.error("{} has no render geometry (recorded from an env without render_geometry), "
+                      "only --what=plot is available".format(opts.path))
+        return 1
+    out_dir = opts.out or os.path.join(opts.path, "render")
+    os.makedirs(out_dir, exist_ok=True)
+
+    job_opts = {"what": opts.what, "out": out_dir, "size": opts.size, "fps": opts.fps}
+    n_workers = max(1, min(opts.workers, len(episodes)))
+    jobs = [(opts.path, episodes[i::n_workers], job_opts) for i in range(n_workers)]
+    with mp.get_context("spawn").Pool(n_workers) as pool:
+        written = [p for paths in pool.imap_unordered(_render_episodes, jobs) for p in paths]
+    console.info("Wrote {} files for {} episodes to {}".format(len(written), len(episodes), out_dir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+
+SCHEMA_FILE = "schema.json"
+
+
+def attn_dump_schema(n_heads, n_agents, n_entities, entity_shape):
+    """
+    Columns of an attention dump. One record per (episode, t), the agent / entity
+    axes are inside the records.
+    """
+    return {"episode": {"dtype": "int64", "shape": [], "dims": []},
+            "t": {"dtype": "int32", "shape": [], "dims": []},
+            "attn_weights": {"dtype": "float32", "shape": [n_heads, n_agents, n_entities],
+                             "dims": ["head", "agent", "entity"]},
+            "entities": {"dtype": "float32", "shape": [n_entities, entity_shape],
+                         "dims": ["entity", "feature"]},
+            "obs_mask": {"dtype": "uint8", "shape": [n_entities, n_entities], "dims": ["entity", "entity"]},
+            "entity_mask": {"dtype": "uint8", "shape": [n_entities], "dims": ["entity"]}}
+
+
+class AttnDumpWriter:
+    """
+    Appends records to a columnar dump directory:
+        schema.json        columns (dtype, per record shape, axis names), number of
+                           records and chunks, rewritten after every chunk
+        <column>.bin       raw records of the column, one after the other
+                           (or, with compress=True, chunk_<i>.npz with every column)
+
+    Records are collected in preallocated chunks of `chunk_size` records and written
+    when a chunk is full, so memory does not grow with the size of the dump. The raw
+    column files can be memory mapped whole, see load_attn_dump; compressed chunks are
+    smaller but have to be decompressed to be read.
+    """
+    def __init__(self, path, schema, chunk_size=4096, compress=False):
+        self.path = path
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.n_records = 0
+        self.n_chunks = 0
+        self.chunk = {k: np.empty((chunk_size, *c["shape"]), dtype=c["dtype"]) for k, c in schema.items()}
+        self.n_chunk = 0
+        os.makedirs(path, exist_ok=True)
+        if not compress:
+            for k in schema:
+                open(os.path.join(path, k + ".bin"), "wb").close()
+        self._write_schema()
+
+    def append(self, **columns):
+        """Append n records, given as arrays of shape (n, *column shape) for every column."""
+        assert set(columns) == set(self.schema), "expected columns {}".format(sorted(self.schema))
+        n = len(columns["episode"])
+        start = 0
+        while start < n:
+            k = min(n - start, self.chunk_size - self.n_chunk)
+            for name, values in columns.items():
+                self.chunk[name][self.n_chunk:self.n_chunk + k] = values[start:start + k]
+            self.n_chunk += k
+            start += k
+            if self.n_chunk == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        if self.n_chunk == 0:
+            return
+        if self.compress:
+            np.savez_compressed(os.path.join(self.path, "chunk_{:05d}.npz".format(self.n_chunks)),
+                                **{k: v[:self.n_chunk] for k, v in self.chunk.items()})
+        else:
+            for k, v in self.chunk.items():
+                with open(os.path.join(self.path, k + ".bin"), "ab") as f:
+                    f.write(v[:self.n_chunk].tobytes())
+        self.n_records += self.n_chunk
+        self.n_chunks += 1
+        self.n_chunk = 0
+        self._write_schema()
+
+    def close(self):
+        self.flush()
+
+    def _write_schema(self):
+        tmp_path = os.path.join(self.path, SCHEMA_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"columns": self.schema,
+                       "n_records": self.n_records,
+                       "n_chunks": self.n_chunks,
+                       "compressed": self.compress}, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, SCHEMA_FILE))
+
+
+def load_attn_dump(path, columns=None):
+    """
+    {column: array of shape (n_records, *column shape)} of a dump written by
+    AttnDumpWriter. Uncompressed columns are read-only np.memmaps, so only the parts
+    an analysis touches are read from disk.
+    """
+    with open(os.path.join(path, SCHEMA_FILE), "r") as f:
+        meta = json.load(f)
+    names = columns if columns is not None else list(meta["columns"])
+    n = meta["n_records"]
+    if not meta["compressed"]:
+        out = {}
+        for k in names:
+            c = meta["columns"][k]
+            if n == 0:
+                out[k] = np.empty((0, *c["shape"]), dtype=c["dtype"])
+            else:
+                out[k] = np.memmap(os.path.join(path, k + ".bin"), dtype=c["dtype"], mode="r",
+                                   shape=(n, *c["shape"]))
+        return out
+    chunks = [np.load(os.path.join(path, "chunk_{:05d}.npz".format(i))) for i in range(meta["n_chunks"])]
+    return {k: np.concatenate([chunk[k] for chunk in chunks]) if chunks
+            else np.empty((0, *meta["columns"][k]["shape"]), dtype=meta["columns"][k]["dtype"])
+            for k in names}
+
+
+def batch_attn_records(batch, attn_weights, n_heads, first_episode):
+    """
+    Records of the filled steps of a test batch, for AttnDumpWriter.append.
+    attn_weights is the agent's StepBuffer view, (n_steps, bs * n_heads, n_agents, n_entities).
+    """
+    n_steps = attn_weights.shape[0]
+    bs = batch.batch_size
+    attn = attn_weights.reshape(n_steps, bs, n_heads, *attn_weights.shape[2:]).transpose(0, 1)
+    filled = batch["filled"][:, :n_steps, 0].bool()
+    episode, t = filled.nonzero(as_tuple=True)
+    return {"episode": (episode + first_episode).cpu().numpy(),
+            "t": t.cpu().numpy(),
+            "attn_weights": attn[filled].float().cpu().numpy(),
+            "entities": batch["entities"][:, :n_steps][filled].float().cpu().numpy(),
+            "obs_mask": batch["obs_mask"][:, :n_steps][filled].cpu().numpy(),
+            "entity_mask": batch["entity_mask"][:, :n_steps][filled].cpu().numpy()}
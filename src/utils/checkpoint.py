@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+
+import numpy as np
+import torch as th
+
+# written last, a checkpoint dir that has it is complete
+TRAINING_STATE_FILE = "training_state.th"
+BUFFER_FILE = "buffer.th"
+# per run dir index of the checkpoints in it, see CheckpointIndex
+MANIFEST_FILE = "manifest.json"
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class CheckpointIndex:
+    """
+    The checkpoints saved under one run dir (results/models/<unique_token>), one
+    entry per step:
+        {"step": t_env, "wall_time": time.time() at save, "metrics": {stat: value},
+         "files": {file name: sha256}}
+
+    Entries come from manifest.json, which AsyncCheckpointer keeps up to date, so
+    lookups do not list the directory. Run dirs written before the manifest existed are
+    scanned once for digit-named checkpoint dirs (step only).
+    """
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.entries = []
+        self.has_manifest = os.path.isfile(os.path.join(run_dir, MANIFEST_FILE))
+        if self.has_manifest:
+            with open(os.path.join(run_dir, MANIFEST_FILE), "r") as f:
+                self.entries = json.load(f)["checkpoints"]
+        elif os.path.isdir(run_dir):
+            self.entries = [{"step": int(name)} for name in os.listdir(run_dir)
+                            if name.isdigit() and os.path.isdir(os.path.join(run_dir, name))]
+        self.entries.sort(key=lambda e: e["step"])
+
+    def path(self, entry):
+        return os.path.join(self.run_dir, str(entry["step"]))
+
+    def resolve(self, query=0):
+        """
+        Entry for `query`, None if there is no match:
+            0 / "latest"          the latest checkpoint
+            step (int)            the checkpoint saved closest to step
+            "best" / "best:stat"  the checkpoint with the highest stat at save
+                                  (test_return_mean by default)
+        """
+        if not self.entries:
+            return None
+        if isinstance(query, str) and query.isdigit():
+            query = int(query)
+        if query in (0, "latest"):
+            return self.entries[-1]
+        if isinstance(query, str) and query.split(":")[0] == "best":
+            stat = query.split(":", 1)[1] if ":" in query else "test_return_mean"
+            scored = [e for e in self.entries if stat in e.get("metrics", {})]
+            if not scored:
+                return None
+            return max(scored, key=lambda e: (e["metrics"][stat], e["step"]))
+        step = int(query)
+        return min(self.entries, key=lambda e: abs(e["step"] - step))
+
+    def add(self, step, files, metrics, wall_time):
+        self.entries = [e for e in self.entries if e["step"] != step]
+        self.entries.append({"step": step, "wall_time": wall_time, "metrics": metrics, "files": files})
+        self.entries.sort(key=lambda e: e["step"])
+
+    def prune(self, keep_last=0, keep_best=0, stat="test_return_mean"):
+        """
+        Delete the checkpoints that are neither among the `keep_last` latest nor the
+        `keep_best` best by `stat` (keep_last 0 keeps everything). Returns the removed steps.
+        """
+        if keep_last <= 0 or len(self.entries) <= keep_last:
+            return []
+        keep = {e["step"] for e in self.entries[-keep_last:]}
+        scored = [e for e in self.entries if stat in e.get("metrics", {})]
+        keep |= {e["step"] for e in sorted(scored, key=lambda e: -e["metrics"][stat])[:keep_best]}
+        removed = [e for e in self.entries if e["step"] not in keep]
+        self.entries = [e for e in self.entries if e["step"] in keep]
+        # manifest first, so it never lists a deleted checkpoint
+        self.save()
+        for e in removed:
+            shutil.rmtree(self.path(e), ignore_errors=True)
+        return [e["step"] for e in removed]
+
+    def verify(self, entry):
+        """Names of the files of `entry` whose sha256 does not match the manifest."""
+        return [name for name, digest in entry.get("files", {}).items()
+                if not os.path.isfile(os.path.join(self.path(entry), name))
+                or _file_sha256(os.path.join(self.path(entry), name)) != digest]
+
+    def save(self):
+        tmp_path = os.path.join(self.run_dir, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"checkpoints": self.entries}, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.run_dir, MANIFEST_FILE))
+
+
+def find_checkpoint(checkpoint_path, load_step=0, index=None):
+    """
+    (model dir, timestep) of the checkpoint in `checkpoint_path` matching `load_step`
+    (see CheckpointIndex.resolve), None if there is none. Pass `index` to resolve several
+    load steps against one read of the manifest.
+    """
+    if index is None:
+        index = CheckpointIndex(checkpoint_path)
+    entry = index.resolve(load_step)
+    if entry is None:
+        return None
+    return os.path.join(checkpoint_path, str(entry["step"])), entry["step"]
+
+
+def find_verified_checkpoint(checkpoint_path, load_step, logger):
+    """
+    find_checkpoint for resuming training: a checkpoint whose files do not match the
+    sha256 in the manifest (truncated or corrupted) is skipped for the one saved before it.
+    """
+    index = CheckpointIndex(checkpoint_path)
+    entry = index.resolve(load_step)
+    while entry is not None:
+        mismatched = index.verify(entry)
+        if not mismatched:
+            return index.path(entry), entry["step"]
+        earlier = [e for e in index.entries if e["step"] < entry["step"]]
+        logger.console_logger.warning("Checkpoint {} is corrupted ({} do not match the manifest), {}".format(
+            index.path(entry), ", ".join(sorted(mismatched)),
+            "falling back to step {}".format(earlier[-1]["step"]) if earlier else "no earlier checkpoint"))
+        entry = earlier[-1] if earlier else None
+    return None
+
+
+def checkpoint_metrics(logger):
+    """Latest value of the test_*_mean and return_mean stats, recorded in the manifest."""
+    metrics = {}
+    for k, v in list(logger.stats.items()):
+        if v and (k == "return_mean" or (k.startswith("test_") and k.endswith("_mean"))):
+            try:
+                metrics[k] = float(v[-1][1])
+            except (TypeError, ValueError):
+                continue
+    return metrics
+
+
+def snapshot(obj):
+    """Copy of obj (nested dicts / lists of tensors) with every tensor cloned to CPU."""
+    if th.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def rng_state():
+    state = {"python": random.getstate(),
+             "numpy": np.random.get_state(),
+             "torch": th.get_rng_state()}
+    if th.cuda.is_available():
+        state["cuda"] = th.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    th.set_rng_state(state["torch"])
+    if "cuda" in state and th.cuda.is_available():
+        th.cuda.set_rng_state_all(state["cuda"])
+
+
+# learner attributes that are not part of any network or optimiser state
+_LEARNER_COUNTERS = ("last_target_update_episode", "log_stats_t", "log_stats_t_elector", "current_id")
+
+
+def training_checkpoint(learner, run_state, buffer=None):
+    """
+    {file name: object} of a full training checkpoint:
+        agent.th, elector.th, mixer.th, opt.th   the files learner.save_models writes,
+                                                 so evaluation and load_models work as before
+        training_state.th                        target networks, other optimisers, learner
+                                                 counters, `run_state` (t_env, episode, ...)
+                                                 and the python / numpy / torch RNG states
+        buffer.th                                filled replay buffer episodes, if `buffer` is given
+    The epsilon schedules are functions of t_env and need no state of their own.
+    """
+    mac = learner.mac
+    files = {"agent.th": mac.agent.state_dict(),
+             "opt.th": learner.optimiser.state_dict()}
+    if hasattr(mac, "elector"):
+        files["elector.th"] = mac.elector.state_dict()
+    state = {"target_agent": learner.target_mac.agent.state_dict()}
+    if learner.mixer is not None:
+        files["mixer.th"] = learner.mixer.state_dict()
+        state["target_mixer"] = learner.target_mixer.state_dict()
+    if hasattr(learner, "elector_optim"):
+        state["elector_optim"] = learner.elector_optim.state_dict()
+    state["counters"] = {k: getattr(learner, k) for k in _LEARNER_COUNTERS if hasattr(learner, k)}
+    if buffer is not None:
+        files[BUFFER_FILE] = buffer.state_dict()
+    files[TRAINING_STATE_FILE] = {"learner": state, "run": run_state, "rng": rng_state()}
+    return files
+
+
+def is_training_checkpoint(path):
+    return os.path.isfile(os.path.join(path, TRAINING_STATE_FILE))
+
+
+def restore_training_checkpoint(path, learner, buffer=None, restore_rng=True):
+    """
+    Load a checkpoint written from training_checkpoint into the learner (and the
+    replay buffer, if given and saved), restore the RNG states and return the run state.
+    restore_rng=False leaves the global RNGs alone (seeds sharing one process, see
+    run/multi_seed.py, would overwrite each other's states).
+    """
+    def load(name):
+        return th.load(os.path.join(path, name), map_location=lambda storage, loc: storage)
+
+    mac = learner.mac
+    state = load(TRAINING_STATE_FILE)
+    mac.agent.load_state_dict(load("agent.th"))
+    if hasattr(mac, "elector"):
+        mac.elector.load_state_dict(load("elector.th"))
+    learner.target_mac.agent.load_state_dict(state["learner"]["target_agent"])
+    if learner.mixer is not None:
+        learner.mixer.load_state_dict(load("mixer.th"))
+        learner.target_mixer.load_state_dict(state["learner"]["target_mixer"])
+    learner.optimiser.load_state_dict(load("opt.th"))
+    if hasattr(learner, "elector_optim"):
+        learner.elector_optim.load_state_dict(state["learner"]["elector_optim"])
+    for k, v in state["learner"]["counters"].items():
+        setattr(learner, k, v)
+    if buffer is not None and os.path.isfile(os.path.join(path, BUFFER_FILE)):
+        buffer.load_state_dict(load(BUFFER_FILE))
+    if restore_rng:
+        set_rng_state(state["rng"])
+    return state["run"]
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints from a background thread.
+
+    save() snapshots the given state to CPU tensors on the calling thread, so training
+    can go on changing the weights, and hands the copy to the writer thread. At most one
+    snapshot waits to be written: a save issued while the previous one is still queued
+    blocks until it is picked up, which bounds the extra memory to two snapshots.
+
+    A checkpoint is written into <path>.tmp and renamed to <path> once every file is on
+    disk, so a crash leaves either a complete checkpoint or no directory at all (digit-only
+    names are what find_checkpoint looks for). If <path> already exists (a checkpoint of
+    the same step saved before), the files are moved in one by one with training_state.th
+    last. Files written into <path> by the caller (export_policy) must wait() for the
+    checkpoint first.
+
+    Once renamed, the checkpoint is added to the manifest of its run dir with the sha256
+    of its files and the `metrics` given to save(), and the retention policy is applied:
+    with keep_last > 0, only the keep_last latest checkpoints and the keep_best best by
+    best_metric are kept.
+    """
+    def __init__(self, logger, async_writes=True, keep_last=0, keep_best=0, best_metric="test_return_mean"):
+        self.logger = logger
+        self.async_writes = async_writes
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.best_metric = best_metric
+        self.indexes = {}
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+        if async_writes:
+            self.thread = threading.Thread(target=self._write_loop, name="Checkpointer", daemon=True)
+            self.thread.start()
+
+    def save(self, path, files, metrics=None):
+        files = snapshot(files)
+        if self.async_writes:
+            self.queue.put((path, files, metrics or {}))
+        else:
+            self._write(path, files, metrics or {})
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                self.logger.console_logger.error("Writing checkpoint {} failed: {}".format(item[0], e))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, path, files, metrics):
+        tmp_path = path + ".tmp"
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        names = sorted(files, key=lambda name: name == TRAINING_STATE_FILE)
+        for name in names:
+            with open(os.path.join(tmp_path, name), "wb") as f:
+                th.save(files[name], f)
+                f.flush()
+                os.fsync(f.fileno())
+        # read back while the files are still in the page cache
+        hashes = {name: _file_sha256(os.path.join(tmp_path, name)) for name in names}
+        if os.path.isdir(path):
+            for name in names:
+                os.replace(os.path.join(tmp_path, name), os.path.join(path, name))
+            os.rmdir(tmp_path)
+        else:
+            os.rename(tmp_path, path)
+        self._update_manifest(path, hashes, metrics)
+
+    def _update_manifest(self, path, hashes, metrics):
+        run_dir, step = os.path.split(os.path.normpath(path))
+        if not step.isdigit():
+            return
+        if run_dir not in self.indexes:
+            # read once per run dir, afterwards this thread is the only writer
+            self.indexes[run_dir] = CheckpointIndex(run_dir)
+        index = self.indexes[run_dir]
+        index.add(int(step), hashes, metrics, time.time())
+        removed = index.prune(self.keep_last, self.keep_best, self.best_metric)
+        if not removed:
+            index.save()
+        else:
+            self.logger.console_logger.info("Removed checkpoints {} from {}".format(removed, run_dir))
+
+    def wait(self):
+        """Block until every queued checkpoint is written."""
+        if self.async_writes:
+            self.queue.join()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
@@ -1,43 +1,259 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
 import logging
+import queue
+import threading
+import time
 import numpy as np
+from utils.profiling import is_capturing, record_function
+
+
+class _Timer:
+    __slots__ = ("stat", "sync_cuda", "t_start", "label", "range")
+
+    def __init__(self, stat, sync_cuda, label=None):
+        # stat is None when only labelling a range for a torch profiler capture
+        self.stat = stat
+        self.sync_cuda = sync_cuda
+        self.label = label
+
+    def start(self):
+        if self.label is not None:
+            self.range = record_function(self.label)
+            self.range.__enter__()
+        if self.sync_cuda:
+            import torch
+            torch.cuda.synchronize()
+        self.t_start = time.perf_counter()
+        return self
+
+    def stop(self):
+        if self.sync_cuda:
+            import torch
+            torch.cuda.synchronize()
+        if self.stat is not None:
+            self.stat[0] += time.perf_counter() - self.t_start
+            self.stat[1] += 1
+        if self.label is not None:
+            self.range.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# shared no-op timer returned by Logger.timer when profiling is off
+_NULL_TIMER = _NullTimer()
+
 
 class Logger:
-    def __init__(self, console_logger):
+    def __init__(self, console_logger, history=100, async_writes=False):
+        """
+        history: number of most recent (t, value) entries kept per key in self.stats.
+            Full-run means for print_stats_summary are kept as running sums instead.
+        async_writes: hand tensorboard/sacred writes to a background thread that writes
+            them in batches, call close() (or flush()) before exiting.
+        """
         self.console_logger = console_logger
 
         self.use_tb = False
         self.use_sacred = False
         self.use_hdf = False
 
-        self.stats = defaultdict(lambda: [])
+        self.stats = defaultdict(lambda: deque(maxlen=history))
+        # key -> [sum of values, number of values] over the whole run
+        self.stat_totals = {}
+
+        self.async_writes = async_writes
+        self._write_queue = None
+        self._writer = None
+
+        self.metrics_server = None
+
+        self.profile = False
+        self.profile_sync_cuda = False
+        # name -> [total seconds, number of calls] / name -> count, reset on every log_timings
+        self.timings = defaultdict(lambda: [0.0, 0])
+        self.counters = defaultdict(int)
+        self.last_timings_log = time.perf_counter()
 
     def setup_tb(self, directory_name):
         # Import here so it doesn't have to be installed if you don't use it
-        from tensorboard_logger import configure, log_value
-        configure(directory_name)
-        self.tb_logger = log_value
+        from tensorboard_logger import Logger as TBLogger
+        # own writer rather than the module level default one, so several Loggers
+        # (one per seed, see run/multi_seed.py) can write to their own directories
+        self.tb_logger = TBLogger(directory_name).log_value
         self.use_tb = True
+        self._start_writer()
 
-    def setup_sacred(self, sacred_run_dict):
+    def setup_sacred(self, sacred_run_dict, prefix=""):
+        """prefix: prepended to the keys in sacred's info, for Loggers sharing a run"""
         self.sacred_info = sacred_run_dict.info
+        self.sacred_prefix = prefix
         self.use_sacred = True
+        self._start_writer()
 
-    # TODO: Setup hdf logger
+    def setup_metrics_server(self, port, host="127.0.0.1", run_label=""):
+        # Import here so it is only loaded when a metrics port is configured
+        from utils.metrics_server import MetricsServer
+        try:
+            self.metrics_server = MetricsServer(self, port, host=host, run_label=run_label)
+        except OSError as e:
+            self.console_logger.warning("Could not serve metrics on {}:{} ({}), continuing without".format(host, port, e))
+            return
+        self.console_logger.info("Serving metrics on {}".format(self.metrics_server.address))
 
-    def log_stat(self, key, value, t, to_sacred=True):
-        self.stats[key].append((t, value))
+    def update_progress(self, t_env, episode, learner_updates, buffer_fill):
+        """Training loop progress for the metrics endpoint, a no-op without one."""
+        if self.metrics_server is not None:
+            self.metrics_server.update_progress(t_env, episode, learner_updates, buffer_fill)
 
-        if self.use_tb:
-            self.tb_logger(key, value, t)
+    def _start_writer(self):
+        if not self.async_writes or self._writer is not None:
+            return
+        self._write_queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="LoggerWriter", daemon=True)
+        self._writer.start()
 
-        if self.use_sacred and to_sacred:
+    def _write_loop(self, max_batch=1024):
+        while True:
+            entries = [self._write_queue.get()]
+            while len(entries) < max_batch:
+                try:
+                    entries.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in entries
+            try:
+                self._write([e for e in entries if e is not None])
+            except Exception:
+                self.console_logger.exception("Logger writer failed to write {} entries".format(len(entries)))
+            for _ in entries:
+                self._write_queue.task_done()
+            if stop:
+                return
+
+    def _write(self, entries):
+        """Write (key, value, t, to_sacred) entries to tensorboard and sacred."""
+        sacred_entries = defaultdict(lambda: ([], []))
+        for key, value, t, to_sacred in entries:
+            if self.use_tb:
+                self.tb_logger(key, value, t)
+            if self.use_sacred and to_sacred:
+                ts, values = sacred_entries[self.sacred_prefix + key]
+                ts.append(t)
+                values.append(value)
+        for key, (ts, values) in sacred_entries.items():
             if key in self.sacred_info:
-                self.sacred_info["{}_T".format(key)].append(t)
-                self.sacred_info[key].append(value)
+                self.sacred_info["{}_T".format(key)].extend(ts)
+                self.sacred_info[key].extend(values)
             else:
-                self.sacred_info["{}_T".format(key)] = [t]
-                self.sacred_info[key] = [value]
+                self.sacred_info["{}_T".format(key)] = ts
+                self.sacred_info[key] = values
+
+    def flush(self):
+        """Block until all queued tensorboard/sacred writes are done."""
+        if self._writer is not None:
+            self._write_queue.join()
+
+    def close(self):
+        """
+        Flush and stop the background writer (later log_stat calls write synchronously)
+        and shut down the metrics endpoint.
+        """
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        if self._writer is not None:
+            self._write_queue.put(None)
+            self._writer.join()
+            self._writer = None
+            self._write_queue = None
+
+    def setup_profiling(self, enabled, sync_cuda=False):
+        """
+        Turn on the hot-path timers/counters. sync_cuda synchronises around every timer so
+        that GPU work is attributed to the right section, at the cost of stalling the pipeline.
+        """
+        self.profile = enabled
+        self.profile_sync_cuda = sync_cuda and enabled
+        self.last_timings_log = time.perf_counter()
+
+    def timer(self, name):
+        """
+        Timer that adds wall time to `name`, either as a context manager
+            with logger.timer("env_step"):
+                env.step(actions)
+        or with explicit start()/stop() for sections that span many lines.
+        While a torch profiler capture is running (utils/profiling.py) the section
+        is also labelled `name` in the trace.
+        Returns a shared no-op timer when neither is on.
+        """
+        label = name if is_capturing() else None
+        if not self.profile:
+            return _NULL_TIMER if label is None else _Timer(None, False, label)
+        return _Timer(self.timings[name], self.profile_sync_cuda, label)
+
+    def count(self, name, n=1):
+        if self.profile:
+            self.counters[name] += n
+
+    def log_timings(self, t):
+        """
+        Log the aggregates since the previous call and reset them:
+            timer_<name>_ms:   mean milliseconds per call
+            timer_<name>_frac: fraction of the wall time spent in the timer
+            count_<name>_per_s: counter rate
+        """
+        if not self.profile:
+            return
+        now = time.perf_counter()
+        elapsed = max(now - self.last_timings_log, 1e-9)
+        for name, (total, calls) in sorted(self.timings.items()):
+            if calls == 0:
+                continue
+            self.log_stat("timer_{}_ms".format(name), 1000 * total / calls, t)
+            self.log_stat("timer_{}_frac".format(name), total / elapsed, t)
+        for name, n in sorted(self.counters.items()):
+            self.log_stat("count_{}_per_s".format(name), n / elapsed, t)
+        self.timings.clear()
+        self.counters.clear()
+        self.last_timings_log = now
+
+    # TODO: Setup hdf logger
+
+    def log_stat(self, key, value, t, to_sacred=True):
+        self.stats[key].append((t, value))
+        if key in self.stat_totals:
+            total = self.stat_totals[key]
+            total[0] = total[0] + value
+            total[1] += 1
+        else:
+            self.stat_totals[key] = [np.array(value, dtype=np.float64), 1]
+
+        if self._writer is not None:
+            self._write_queue.put((key, value, t, to_sacred))
+        elif self.use_tb or self.use_sacred:
+            self._write([(key, value, t, to_sacred)])
 
     def print_recent_stats(self):
         log_str = "Recent Stats | t_env: {:>10} | Episode: {:>8}\n".format(*self.stats["episode"][-1])
@@ -47,7 +263,7 @@ class Logger:
                 continue
             i += 1
             window = 5 if k != "epsilon" else 1
-            item = "{:.4f}".format(np.mean([x[1] for x in self.stats[k][-window:]]))
+            item = "{:.4f}".format(np.mean([x[1] for x in islice(reversed(v), window)]))
             log_str += "{:<25}{:>8}".format(k + ":", item)
             log_str += "\n" if i % 4 == 0 else "\t"
         self.console_logger.info(log_str)
@@ -55,13 +271,13 @@ class Logger:
     def print_stats_summary(self):
         log_str = "Summary Stats"
         i = 0
-        for (k, v) in sorted(self.stats.items()):
+        for (k, (total, n)) in sorted(self.stat_totals.items()):
             if k == "episode":
                 continue
             i += 1
-            mean_value = np.mean([x[1] for x in self.stats[k]], axis=0)
+            mean_value = total / n
             if len(mean_value.shape) == 0:
-                item = "{:.4f}".format(mean_value)
+                item = "{:.4f}".format(float(mean_value))
             else:
                 item = mean_value.__repr__()
             log_str += "{:<25}{:>8}".format(k + ":", item)
@@ -0,0 +1,73 @@
+import os
+import torch as th
+
+
+def format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(n) < 1024:
+            return "{:.1f}{}".format(n, unit)
+        n /= 1024
+    return "{:.1f}TB".format(n)
+
+
+def tensors_nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def optimizer_state_nbytes(optimiser):
+    """
+    Bytes of the optimiser state (square averages, moments, ...). torch optimisers keep
+    a dict of tensors per parameter, FlatOptimizer one flat tensor per state key.
+    """
+    n = 0
+    for state in optimiser.state.values():
+        if th.is_tensor(state):
+            n += state.numel() * state.element_size()
+        else:
+            n += tensors_nbytes(v for v in state.values() if th.is_tensor(v))
+    return n
+
+
+def batch_memory_report(title, usage, scheme):
+    """
+    Format {field: bytes} of an EpisodeBatch as one line per field followed by
+    the totals per scheme group ("-" for fields without a group).
+    """
+    lines = [title]
+    group_totals = {}
+    for k, n in sorted(usage.items(), key=lambda kv: -kv[1]):
+        group = scheme.get(k, {}).get("group", "-")
+        group_totals[group] = group_totals.get(group, 0) + n
+        lines.append("  {:<25}{:>12}  group: {}".format(k, format_bytes(n), group))
+    for group, n in sorted(group_totals.items()):
+        lines.append("  {:<25}{:>12}".format("[group " + group + "]", format_bytes(n)))
+    lines.append("  {:<25}{:>12}".format("[total]", format_bytes(sum(usage.values()))))
+    return "\n".join(lines)
+
+
+def module_memory_report(title, usage):
+    """Format {module name: bytes} of a learner, see the learners' memory_usage."""
+    lines = [title]
+    for k, n in usage.items():
+        lines.append("  {:<25}{:>12}".format(k, format_bytes(n)))
+    lines.append("  {:<25}{:>12}".format("[total]", format_bytes(sum(usage.values()))))
+    return "\n".join(lines)
+
+
+def available_memory(device):
+    """Free bytes on `device` (free GPU memory / available RAM), None if unknown."""
+    if str(device).startswith("cuda"):
+        return th.cuda.mem_get_info(th.device(device))[0]
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def log_memory_report(logger, buffer, learner):
+    logger.console_logger.info(buffer.memory_report())
+    logger.console_logger.info(module_memory_report("{} memory".format(type(learner).__name__),
+                                                    learner.memory_usage()))
+    if th.cuda.is_available() and th.cuda.is_initialized():
+        logger.console_logger.info("CUDA allocated {}, reserved {}".format(
+            format_bytes(th.cuda.memory_allocated()), format_bytes(th.cuda.memory_reserved())))
@@ -0,0 +1,118 @@
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _metric_name(key):
+    return "pymarl_" + _INVALID_NAME_CHARS.sub("_", key)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep scrapes out of the training console
+        pass
+
+
+class MetricsServer:
+    """
+    Serves the latest training metrics in the Prometheus text exposition format
+    on http://host:port/metrics from a daemon thread.
+
+    The training loop never waits on it: log_stat values are read from the Logger's
+    stats deques and update_progress only replaces a dict, the text is built in the
+    server thread when a scraper asks for it.
+
+    Exposed metrics (all with a run="<unique_token>" label):
+        pymarl_t_env, pymarl_episode, pymarl_learner_updates   counters
+        pymarl_env_steps_per_second, pymarl_learner_updates_per_second
+                                        rates over the last `rate_window` seconds
+        pymarl_buffer_fill              fraction of the replay buffer in use
+        pymarl_<stat>                   latest value of every scalar Logger stat
+                                        (return_mean, test_return_mean, epsilon, timer_*, ...)
+    """
+    def __init__(self, logger, port, host="127.0.0.1", run_label="", rate_window=60.0):
+        self.logger = logger
+        self.labels = '{{run="{}"}}'.format(_escape_label(run_label))
+        self.rate_window = rate_window
+        self.progress = {}
+        # (wall time, t_env, learner updates), one sample per second at most
+        self.history = deque(maxlen=int(rate_window) + 1)
+
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="MetricsServer", daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/metrics".format(host, port)
+
+    def update_progress(self, t_env, episode, learner_updates, buffer_fill):
+        now = time.time()
+        self.progress = {"t_env": t_env,
+                         "episode": episode,
+                         "learner_updates": learner_updates,
+                         "buffer_fill": buffer_fill}
+        if not self.history or now - self.history[-1][0] >= 1.0:
+            self.history.append((now, t_env, learner_updates))
+
+    def _rates(self):
+        history = list(self.history)
+        if len(history) < 2:
+            return {}
+        (t0, env0, upd0), (t1, env1, upd1) = history[0], history[-1]
+        elapsed = max(t1 - t0, 1e-9)
+        return {"env_steps_per_second": (env1 - env0) / elapsed,
+                "learner_updates_per_second": (upd1 - upd0) / elapsed}
+
+    def _sample(self, lines, key, value, kind="gauge"):
+        name = _metric_name(key)
+        lines.append("# TYPE {} {}".format(name, kind))
+        lines.append("{}{} {}".format(name, self.labels, float(value)))
+
+    def render(self):
+        lines = []
+        progress = self.progress
+        for key in ("t_env", "episode", "learner_updates"):
+            if key in progress:
+                self._sample(lines, key, progress[key], kind="counter")
+        if "buffer_fill" in progress:
+            self._sample(lines, "buffer_fill", progress["buffer_fill"])
+        for key, value in sorted(self._rates().items()):
+            self._sample(lines, key, value)
+        reserved = set(progress) | {"env_steps_per_second", "learner_updates_per_second"}
+        for key, entries in sorted(list(self.logger.stats.items())):
+            if key in reserved or not entries:
+                continue
+            try:
+                value = float(entries[-1][1])
+            except (TypeError, ValueError, IndexError):
+                # non scalar stats (e.g. arrays) are not exported
+                continue
+            self._sample(lines, key, value)
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,52 @@
+"""
+Standalone runner for actors exported with controllers/policy_export.py.
+
+Only depends on torch, so this file can be copied next to an evaluation service
+without the rest of the training code (sacred, configs, learners, envs).
+"""
+import torch
+
+
+class ExportedPolicyRunner:
+    """
+    Keeps the per-episode state (step counter, recurrent hidden state, messages and
+    last actions) for an exported policy and maps env inputs to greedy actions.
+
+    Inputs per step (numpy arrays or tensors, leading batch dim of the export):
+        entities:      bs x n_entities x entity_dim (or bs x n_agents x obs_dim without entity scheme)
+        obs_mask:      bs x n_entities x n_entities, 1 = not observed
+        entity_mask:   bs x n_entities, 1 = entity not present
+        avail_actions: bs x n_agents x n_actions
+    """
+    def __init__(self, path, num_threads=None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.policy = torch.jit.load(path, map_location="cpu")
+        self.batch_size = self.policy.batch_size
+        self.n_agents = self.policy.n_agents
+        self.n_actions = self.policy.n_actions
+        self.reset()
+
+    def reset(self):
+        self.t = 0
+        self.hidden = torch.zeros(self.batch_size, self.n_agents, self.policy.hidden_dim)
+        self.message = torch.zeros(self.batch_size, self.n_agents, self.policy.message_dim)
+        self.last_actions = torch.zeros(self.batch_size, self.n_agents, self.n_actions)
+
+    def act(self, entities, avail_actions, obs_mask=None, entity_mask=None):
+        entities = torch.as_tensor(entities, dtype=torch.float32)
+        avail_actions = torch.as_tensor(avail_actions, dtype=torch.int32)
+        if obs_mask is None:
+            obs_mask = torch.zeros(self.batch_size, 1, dtype=torch.uint8)
+        if entity_mask is None:
+            entity_mask = torch.zeros(self.batch_size, 1, dtype=torch.uint8)
+        obs_mask = torch.as_tensor(obs_mask, dtype=torch.uint8)
+        entity_mask = torch.as_tensor(entity_mask, dtype=torch.uint8)
+
+        with torch.no_grad():
+            actions, self.hidden, self.message = self.policy(self.t, entities, obs_mask, entity_mask,
+                                                             avail_actions, self.last_actions,
+                                                             self.hidden, self.message)
+        self.last_actions = torch.nn.functional.one_hot(actions, self.n_actions).float()
+        self.t += 1
+        return actions
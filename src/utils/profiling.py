@@ -0,0 +1,113 @@
+import functools
+import os
+from contextlib import contextmanager
+
+# True while a StepProfiler is capturing. profile_range labels only open a
+# record_function range then, so outside a capture they cost one flag check.
+_capturing = False
+
+
+def is_capturing():
+    return _capturing
+
+
+def record_function(name):
+    """
+    torch.autograd.profiler.record_function(name). torch is imported on the first call, not
+    with this module, so utils.logging (and with it main and the tools) loads without torch.
+    """
+    from torch.autograd.profiler import record_function as _record_function
+    return _record_function(name)
+
+
+def profile_range(name):
+    """
+    Decorator that labels every call of the function as `name` in torch profiler traces:
+        @profile_range("EntityAttentionLayer")
+        def forward(self, ...):
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _capturing:
+                return fn(*args, **kwargs)
+            with record_function(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StepProfiler:
+    """
+    Captures a torch.profiler trace of steps [start, start + n_steps) of a loop
+    (learner.train calls, runner.run calls, ...):
+
+        learner_profiler = StepProfiler("learner", args.profile_learner_steps, out_dir, args.use_cuda, logger)
+        with learner_profiler.step():
+            learner.train(...)
+
+    `steps` is [start, n_steps] (None or [] disables the profiler). The trace is
+    written to out_dir/<name>.pt.trace.json, which chrome://tracing and the
+    tensorboard profiler plugin (--logdir out_dir/..) read, together with a table
+    of the most expensive ops in out_dir/<name>_ops.txt.
+
+    torch allows a single active profiler, so if another StepProfiler is capturing
+    when this one is due to start, the capture starts after that one is done.
+    """
+    _active = None
+
+    def __init__(self, name, steps, out_dir, use_cuda, logger):
+        self.name = name
+        self.start, self.n_steps = steps if steps else (0, 0)
+        self.out_dir = out_dir
+        self.use_cuda = use_cuda
+        self.logger = logger
+        self.n_calls = 0
+        self.n_captured = 0
+        self.prof = None
+
+    @property
+    def done(self):
+        return self.n_captured >= self.n_steps
+
+    def _start(self):
+        global _capturing
+        import torch as th
+        activities = [th.profiler.ProfilerActivity.CPU]
+        if self.use_cuda:
+            activities.append(th.profiler.ProfilerActivity.CUDA)
+        self.prof = th.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self.prof.__enter__()
+        StepProfiler._active = self
+        _capturing = True
+        self.logger.console_logger.info("Profiling {} steps {}..{}".format(
+            self.name, self.n_calls, self.n_calls + self.n_steps - 1))
+
+    def _stop(self):
+        global _capturing
+        self.prof.__exit__(None, None, None)
+        StepProfiler._active = None
+        _capturing = False
+        os.makedirs(self.out_dir, exist_ok=True)
+        trace_path = os.path.join(self.out_dir, "{}.pt.trace.json".format(self.name))
+        self.prof.export_chrome_trace(trace_path)
+        sort_by = "self_cuda_time_total" if self.use_cuda else "self_cpu_time_total"
+        with open(os.path.join(self.out_dir, "{}_ops.txt".format(self.name)), "w") as f:
+            f.write(self.prof.key_averages().table(sort_by=sort_by, row_limit=50))
+        self.logger.console_logger.info("Wrote {} profile to {}".format(self.name, trace_path))
+        self.prof = None
+
+    @contextmanager
+    def step(self):
+        if self.prof is None and not self.done and self.n_calls >= self.start and StepProfiler._active is None:
+            self._start()
+        self.n_calls += 1
+        if self.prof is None:
+            yield
+            return
+        with record_function("{}_step_{}".format(self.name, self.n_calls - 1)):
+            yield
+        self.prof.step()
+        self.n_captured += 1
+        if self.done:
+            self._stop()
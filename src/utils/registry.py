@@ -0,0 +1,32 @@
+import importlib
+
+
+def load_object(path):
+    """Import "package.module:attr" and return attr."""
+    module_name, attr = path.split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class LazyRegistry(dict):
+    """
+    Registry dict whose values can be given as "package.module:attr" strings. The
+    module is imported on the first lookup of the key, so importing a registry does
+    not import every learner / controller / env (and their dependencies) up front.
+
+    Objects registered directly (REGISTRY["x"] = cls) work as in a plain dict.
+    """
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, str):
+            value = load_object(value)
+            self[key] = value
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
@@ -1,3 +1,4 @@
+import copy
 import torch
 from torch import nn
 
@@ -30,4 +31,61 @@ def init(module, weight_init, bias_init, gain=1):
 def orthogonal_init_(m, gain=1):
     if isinstance(m, nn.Linear):
         init(m, nn.init.orthogonal_,
-                    lambda x: nn.init.constant_(x, 0), gain=gain)
\ No newline at end of file
+                    lambda x: nn.init.constant_(x, 0), gain=gain)
+
+def compact_state_dict(module):
+    """
+    state_dict whose tensors own their storage. With flat_params the parameters are
+    views into one buffer shared by the whole learner, which th.save would otherwise
+    write out in full for every module.
+    """
+    return {k: v.detach().clone() for k, v in module.state_dict().items()}
+
+
+def compact_deepcopy(module):
+    """
+    copy.deepcopy of a module whose parameters and buffers own their storage, without
+    gradients. With flat_params, deep copying the views would copy the learner's whole
+    flat parameter and gradient buffers.
+    """
+    memo = {id(p): nn.Parameter(p.detach().clone(), requires_grad=p.requires_grad) for p in module.parameters()}
+    memo.update({id(b): b.detach().clone() for b in module.buffers()})
+    return copy.deepcopy(module, memo)
+
+
+class StepBuffer:
+    """
+    Per-step tensors of a fixed shape stacked along a new leading axis, in one
+    preallocated tensor that doubles in size when full. Appending is amortised O(1),
+    where th.cat-ing onto a growing tensor every step is quadratic in the episode length.
+    The storage is kept across clear() calls, so it is only allocated for the first
+    episodes of a run.
+    """
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.data = None
+        self.n = 0
+
+    def clear(self):
+        self.n = 0
+
+    def append(self, x):
+        x = x.detach()
+        if self.data is None or self.data.shape[1:] != x.shape \
+                or self.data.dtype != x.dtype or self.data.device != x.device:
+            if self.n > 0:
+                raise ValueError("StepBuffer holds steps of shape {}, got {}".format(
+                    tuple(self.data.shape[1:]), tuple(x.shape)))
+            self.data = x.new_empty((self.capacity, *x.shape))
+        elif self.n == self.data.shape[0]:
+            grown = x.new_empty((2 * self.n, *x.shape))
+            grown[:self.n] = self.data
+            self.data = grown
+        self.data[self.n].copy_(x)
+        self.n += 1
+
+    def view(self):
+        """(n_steps, *step shape) view of the appended steps, None if there are none."""
+        if self.n == 0:
+            return None
+        return self.data[:self.n]
@@ -0,0 +1,132 @@
+import numpy as np
+
+from utils.attn_dump import AttnDumpWriter, load_attn_dump
+
+# columns of a render_geometry row, see envs/multiagent_particle_env/raster.py
+GEOM_COLS = 7
+
+
+def trajectory_schema(n_agents, n_entities, entity_shape, leaders=False, n_circles=None, n_rings=0):
+    """
+    Columns of a trajectory dump, one record per (episode, t). Written with
+    AttnDumpWriter and read with load_trajectories, same layout as attention dumps.
+
+    With n_circles, positions are recorded as the env's render geometry (circles, sight
+    range rings and camera center, what tools/render_trajectories draws), otherwise as
+    the raw entity features. leaders adds the leader election (head_actions) of SOG runs.
+    """
+    schema = {"episode": {"dtype": "int64", "shape": [], "dims": []},
+              "t": {"dtype": "int32", "shape": [], "dims": []},
+              "actions": {"dtype": "int64", "shape": [n_agents], "dims": ["agent"]},
+              "reward": {"dtype": "float32", "shape": [], "dims": []},
+              "obs_mask": {"dtype": "uint8", "shape": [n_entities, n_entities], "dims": ["entity", "entity"]},
+              "entity_mask": {"dtype": "uint8", "shape": [n_entities], "dims": ["entity"]}}
+    if leaders:
+        schema["head_actions"] = {"dtype": "uint8", "shape": [n_agents], "dims": ["agent"]}
+    if n_circles is not None:
+        schema["circles"] = {"dtype": "float32", "shape": [n_circles, GEOM_COLS], "dims": ["circle", "geom"]}
+        schema["rings"] = {"dtype": "float32", "shape": [n_rings, GEOM_COLS], "dims": ["ring", "geom"]}
+        schema["center"] = {"dtype": "float32", "shape": [2], "dims": ["xy"]}
+    else:
+        schema["entities"] = {"dtype": "float32", "shape": [n_entities, entity_shape],
+                              "dims": ["entity", "feature"]}
+    return schema
+
+
+def _stack_geometry(geometry_log, key, n_steps, bs, n_rows):
+    """(bs, n_steps, n_rows, 7) array of the runner's per step geometries, zero (invisible) padded."""
+    out = np.zeros((bs, n_steps, n_rows, GEOM_COLS), dtype=np.float32)
+    for t, geometries in enumerate(geometry_log[:n_steps]):
+        for b, geometry in enumerate(geometries):
+            if geometry is not None:
+                rows = geometry[key]
+                assert len(rows) <= n_rows, "more {} than the trajectory schema has".format(key)
+                out[b, t, :len(rows)] = rows
+    return out
+
+
+def batch_trajectory_records(batch, schema, first_episode, geometry_log=None):
+    """
+    Records of the filled steps of an episode batch, for AttnDumpWriter.append.
+    geometry_log is the runner's list over steps of per env render geometries.
+    """
+    filled = batch["filled"][:, :, 0].bool()
+    if geometry_log is not None:
+        # steps past the geometry log (final state of EpisodeRunner) are not recorded
+        filled[:, len(geometry_log):] = False
+    episode, t = filled.nonzero(as_tuple=True)
+    records = {"episode": (episode + first_episode).cpu().numpy(),
+               "t": t.int().cpu().numpy(),
+               "actions": batch["actions"][filled][..., 0].cpu().numpy(),
+               "reward": batch["reward"][filled][..., 0].float().cpu().numpy(),
+               "obs_mask": batch["obs_mask"][filled].cpu().numpy(),
+               "entity_mask": batch["entity_mask"][filled].cpu().numpy()}
+    if "head_actions" in schema:
+        records["head_actions"] = batch["head_actions"][filled].cpu().numpy()
+    if "circles" in schema:
+        n_steps = filled.shape[1]
+        sel = (episode.cpu().numpy(), t.cpu().numpy())
+        for key in ("circles", "rings"):
+            records[key] = _stack_geometry(geometry_log, key, n_steps, batch.batch_size,
+                                           schema[key]["shape"][0])[sel]
+        center = np.zeros((batch.batch_size, n_steps, 2), dtype=np.float32)
+        for t, geometries in enumerate(geometry_log[:n_steps]):
+            for b, geometry in enumerate(geometries):
+                if geometry is not None:
+                    center[b, t] = geometry["center"]
+        records["center"] = center[sel]
+    else:
+        records["entities"] = batch["entities"][filled].float().cpu().numpy()
+    return records
+
+
+def load_trajectories(path, columns=None):
+    """
+    ({column: array over records}, {episode: (start, end) record range}) of a
+    trajectory dump. Records of an episode are contiguous and ordered by t.
+    """
+    records = load_attn_dump(path, columns if columns is None or "episode" in columns
+                             else list(columns) + ["episode"])
+    episodes, starts = np.unique(np.asarray(records["episode"]), return_index=True)
+    ends = list(starts[1:]) + [len(records["episode"])]
+    return records, {int(e): (int(s), int(end)) for e, s, end in zip(episodes, starts, ends)}
+
+
+class TrajectoryRecorder:
+    """
+    Records the test episodes of a runner (EpisodeRunner or ParallelRunner) to a
+    trajectory dump while evaluation runs at full speed; videos and plots are made
+    from the dump afterwards by tools/render_trajectories.
+    """
+    def __init__(self, path, args, runner, chunk_size=4096, compress=False):
+        assert args.entity_scheme, "trajectories are only recorded for entity scheme envs"
+        self.path = path
+        self.args = args
+        self.runner = runner
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.writer = None
+        self.n_episodes = 0
+        # positions as render geometry for envs that provide it
+        runner.record_geometry = "particle" in args.env
+
+    def append(self, batch):
+        geometry_log = self.runner.geometry_log if self.runner.record_geometry else None
+        if self.writer is None:
+            n_circles = n_rings = None
+            if geometry_log is not None:
+                # the team size is drawn on every reset: room for the most entities the
+                # env can have (args.n_entities), smaller teams are zero padded
+                first = [g for g in geometry_log[0] if g is not None][0]
+                n_circles, n_rings = self.args.n_entities, len(first["rings"])
+            schema = trajectory_schema(self.args.n_agents, self.args.n_entities, self.args.entity_shape,
+                                       leaders="head_actions" in batch.scheme,
+                                       n_circles=n_circles, n_rings=n_rings or 0)
+            self.writer = AttnDumpWriter(self.path, schema, chunk_size=self.chunk_size, compress=self.compress)
+        self.writer.append(**batch_trajectory_records(batch, self.writer.schema, self.n_episodes, geometry_log))
+        self.n_episodes += batch.batch_size
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.runner.record_geometry = False